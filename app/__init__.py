@@ -1,9 +1,11 @@
 import os
+import multiprocessing
 from flask import Flask
 from .models import db
-from .controllers import testcase_bp, knowledge_bp
+from .controllers import testcase_bp, knowledge_bp, metrics_bp
 from flask_migrate import Migrate
 from .utils.logger import init_logger
+from .services.embedding_model_registry import warm_up
 
 def create_app(config_class=None):
     """创建并配置Flask应用程序"""
@@ -29,9 +31,15 @@ def create_app(config_class=None):
         os.makedirs(os.path.join(app.root_path, 'exports'), exist_ok=True)
         os.makedirs(os.path.join(app.root_path, 'documents'), exist_ok=True)
     
+    # 预加载向量模型，避免首个上传请求承担模型加载延迟
+    # spawn启动的工作进程会重新执行run.py中的create_app，工作进程按需加载自己的模型，不需要预热
+    if app.config.get('EMBEDDING_WARMUP') and multiprocessing.parent_process() is None:
+        warm_up(app.config.get('EMBEDDING_MODEL'))
+    
     # 注册蓝图
     app.register_blueprint(testcase_bp)
     app.register_blueprint(knowledge_bp)
+    app.register_blueprint(metrics_bp)
     
     # 注册首页路由
     @app.route('/')
@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+# 项目根目录
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 class Config:
     """基础配置类"""
     # Flask配置
@@ -18,12 +21,131 @@ class Config:
     DIFY_API_BASE_URL = os.getenv('DIFY_API_BASE_URL', 'https://api.dify.ai/v1')
     # 根据Dify API文档更新，知识库ID现在称为dataset_id
     DIFY_KNOWLEDGE_BASE_ID = os.getenv('DIFY_DATASET_ID') or os.getenv('DIFY_KNOWLEDGE_BASE_ID')
+    # Dify API连接池大小、连接和读取超时（秒）、幂等请求的重试次数和退避基准时间（秒）
+    DIFY_POOL_SIZE = int(os.getenv('DIFY_POOL_SIZE', '10'))
+    DIFY_CONNECT_TIMEOUT = float(os.getenv('DIFY_CONNECT_TIMEOUT', '5'))
+    DIFY_READ_TIMEOUT = float(os.getenv('DIFY_READ_TIMEOUT', '60'))
+    DIFY_MAX_RETRIES = int(os.getenv('DIFY_MAX_RETRIES', '2'))
+    DIFY_RETRY_BACKOFF = float(os.getenv('DIFY_RETRY_BACKOFF', '0.5'))
+    # Dify熔断器：连续失败次数阈值，以及熔断后多少秒放行探测请求
+    DIFY_BREAKER_FAILURE_THRESHOLD = int(os.getenv('DIFY_BREAKER_FAILURE_THRESHOLD', '5'))
+    DIFY_BREAKER_RESET_TIMEOUT = float(os.getenv('DIFY_BREAKER_RESET_TIMEOUT', '30'))
     
     # AI模型配置
     AI_MODEL = os.getenv('AI_MODEL', 'gpt-3.5-turbo')
     AI_BASE_URL = os.getenv('AI_BASE_URL', 'https://api.openai.com/v1')
     AI_API_KEY = os.getenv('AI_API_KEY')
     AI_MAX_TOKENS = int(os.getenv('AI_MAX_TOKENS', '4096'))
+    # 单次模型调用的超时时间（秒），0表示不限制
+    AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '60'))
+    # 每个模型服务地址的最大并发调用数（同时作为HTTP连接池大小）和空闲长连接保持时间（秒）
+    LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', '8'))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+    # 大模型网关限流：每分钟请求数和token数上限（0表示不限制），429后的最大重试次数和无Retry-After时的等待秒数
+    LLM_RATE_LIMIT_RPM = int(os.getenv('LLM_RATE_LIMIT_RPM', '0'))
+    LLM_RATE_LIMIT_TPM = int(os.getenv('LLM_RATE_LIMIT_TPM', '0'))
+    LLM_RATE_LIMIT_MAX_RETRIES = int(os.getenv('LLM_RATE_LIMIT_MAX_RETRIES', '5'))
+    LLM_RATE_LIMIT_BACKOFF = float(os.getenv('LLM_RATE_LIMIT_BACKOFF', '5'))
+    # 5xx、超时和连接错误的重试次数，以及指数退避的基准和上限等待时间（秒）
+    LLM_RETRY_MAX_RETRIES = int(os.getenv('LLM_RETRY_MAX_RETRIES', '3'))
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '1'))
+    LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '30'))
+    # 对冲请求（默认关闭）：调用耗时超过历史耗时分位数时再发出一个相同请求，对冲请求数不超过调用总数的给定比例
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'False').lower() == 'true'
+    LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+    LLM_HEDGE_MAX_RATIO = float(os.getenv('LLM_HEDGE_MAX_RATIO', '0.1'))
+    # 流式生成测试用例，每个测试用例解析完成后立即推送到前端
+    AI_STREAMING = os.getenv('AI_STREAMING', 'True').lower() == 'true'
+    # 测试用例生成模式：single（单次调用）、map_reduce（按章节并行生成后合并）、auto（文档超出上下文预算时按章节生成）
+    AI_GENERATION_MODE = os.getenv('AI_GENERATION_MODE', 'auto').lower()
+    AI_MAP_REDUCE_WORKERS = int(os.getenv('AI_MAP_REDUCE_WORKERS', '4'))
+    # 每个章节的token数，0表示使用AI_MAX_TOKENS的40%
+    AI_MAP_REDUCE_SECTION_TOKENS = int(os.getenv('AI_MAP_REDUCE_SECTION_TOKENS', '0'))
+    AI_MAP_REDUCE_MIN_SECTION_CASES = int(os.getenv('AI_MAP_REDUCE_MIN_SECTION_CASES', '3'))
+    # 评审模式：full（默认，模型返回完整的测试用例集）、diff（模型只返回对草稿用例的修改、删除、新增操作，在本地应用）
+    AI_REVIEW_MODE = os.getenv('AI_REVIEW_MODE', 'full').lower()
+    # 分片评审（默认关闭）：草稿用例数超过分片大小时按分片并行评审，每个分片检索自身相关的文档内容（0表示不分片）
+    AI_REVIEW_SHARD_SIZE = int(os.getenv('AI_REVIEW_SHARD_SIZE', '0'))
+    AI_REVIEW_WORKERS = int(os.getenv('AI_REVIEW_WORKERS', '4'))
+    
+    # 大模型响应缓存（默认关闭）：相同模型参数和提示的请求直接复用磁盘上缓存的响应
+    LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'False').lower() == 'true'
+    LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(BASE_DIR, 'cache', 'llm_responses.sqlite3'))
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+    # 响应有效期（秒），0表示永不过期
+    LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', '604800'))
+    
+    # 测试用例语义去重（默认关闭）：入库前合并余弦相似度超过阈值的测试用例，阈值需按所用向量模型校准
+    TESTCASE_DEDUP_ENABLED = os.getenv('TESTCASE_DEDUP_ENABLED', 'False').lower() == 'true'
+    TESTCASE_DEDUP_THRESHOLD = float(os.getenv('TESTCASE_DEDUP_THRESHOLD', '0.92'))
+    # 去重使用的向量模型，为空时使用EMBEDDING_MODEL
+    TESTCASE_DEDUP_MODEL = os.getenv('TESTCASE_DEDUP_MODEL', '')
+    
+    # 多文件并行解析：多文件上传中同时解析的PDF数（0表示在当前进程中逐个解析），单个文件的解析时间上限（秒）和解析进程常驻内存上限（MB，0表示不限制）
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+    EXTRACTION_TIMEOUT = int(os.getenv('EXTRACTION_TIMEOUT', '600'))
+    EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv('EXTRACTION_MEMORY_LIMIT_MB', '0'))
+    
+    # 后台任务配置：同时执行的测试用例生成任务数，以及内存中保留的已结束任务数
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+    JOB_HISTORY_LIMIT = int(os.getenv('JOB_HISTORY_LIMIT', '200'))
+    # 数据库中已结束任务的保留天数（0表示不清理），单个SSE连接的最长保持时间（秒），超时后浏览器自动重连
+    JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', '7'))
+    JOB_EVENTS_MAX_SECONDS = int(os.getenv('JOB_EVENTS_MAX_SECONDS', '300'))
+    
+    # 向量模型配置
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+    # 应用启动时预加载向量模型
+    EMBEDDING_WARMUP = os.getenv('EMBEDDING_WARMUP', 'True').lower() == 'true'
+    # 向量化后端：torch（SentenceTransformer）或onnx（ONNX Runtime，默认int8动态量化）
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+    EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR', os.path.join(BASE_DIR, 'cache', 'onnx'))
+    EMBEDDING_ONNX_QUANTIZE = os.getenv('EMBEDDING_ONNX_QUANTIZE', 'True').lower() == 'true'
+    # 向量化计算线程数，0表示使用默认值
+    EMBEDDING_NUM_THREADS = int(os.getenv('EMBEDDING_NUM_THREADS', '0'))
+    
+    # 向量索引持久化配置
+    VECTOR_INDEX_CACHE_ENABLED = os.getenv('VECTOR_INDEX_CACHE_ENABLED', 'True').lower() == 'true'
+    VECTOR_INDEX_CACHE_DIR = os.getenv('VECTOR_INDEX_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'indexes'))
+    # 索引存储总大小上限（MB），超过时按最近访问时间淘汰，0表示不限制
+    VECTOR_INDEX_CACHE_MAX_MB = int(os.getenv('VECTOR_INDEX_CACHE_MAX_MB', '2048'))
+    
+    # 文本块向量缓存配置
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True').lower() == 'true'
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'cache', 'embeddings.sqlite3'))
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+    
+    # 多进程向量化配置：待向量化文本块数达到阈值时启用，每个工作进程各自加载一份模型，进程数为0表示使用CPU核数，设为1关闭
+    EMBEDDING_POOL_THRESHOLD = int(os.getenv('EMBEDDING_POOL_THRESHOLD', '256'))
+    EMBEDDING_POOL_WORKERS = int(os.getenv('EMBEDDING_POOL_WORKERS', '2'))
+    EMBEDDING_POOL_START_METHOD = os.getenv('EMBEDDING_POOL_START_METHOD', 'spawn')
+    
+    # 向量化微批调度配置：并发请求在等待窗口内合并为一个批次调用模型
+    EMBEDDING_MICROBATCH_ENABLED = os.getenv('EMBEDDING_MICROBATCH_ENABLED', 'True').lower() == 'true'
+    EMBEDDING_MICROBATCH_MAX_WAIT_MS = float(os.getenv('EMBEDDING_MICROBATCH_MAX_WAIT_MS', '5'))
+    EMBEDDING_MICROBATCH_MAX_SIZE = int(os.getenv('EMBEDDING_MICROBATCH_MAX_SIZE', '256'))
+    
+    # token计数使用的tiktoken编码，分词器不可用时自动改用近似估算
+    TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'cl100k_base')
+    
+    # 向量索引类型配置：auto按向量数量在flat、hnsw、ivf之间自动选择
+    VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'auto').lower()
+    VECTOR_HNSW_MIN_VECTORS = int(os.getenv('VECTOR_HNSW_MIN_VECTORS', '5000'))
+    VECTOR_IVF_MIN_VECTORS = int(os.getenv('VECTOR_IVF_MIN_VECTORS', '200000'))
+    VECTOR_IVF_NLIST = int(os.getenv('VECTOR_IVF_NLIST', '0'))
+    VECTOR_IVF_NPROBE = int(os.getenv('VECTOR_IVF_NPROBE', '16'))
+    VECTOR_HNSW_M = int(os.getenv('VECTOR_HNSW_M', '32'))
+    VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv('VECTOR_HNSW_EF_CONSTRUCTION', '200'))
+    VECTOR_HNSW_EF_SEARCH = int(os.getenv('VECTOR_HNSW_EF_SEARCH', '64'))
+    VECTOR_TRAIN_SAMPLE_SIZE = int(os.getenv('VECTOR_TRAIN_SAMPLE_SIZE', '100000'))
+    
+    # 向量量化配置：none（float32原始向量）、sq8（int8标量量化）、pq（乘积量化）
+    VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none').lower()
+    VECTOR_PQ_M = int(os.getenv('VECTOR_PQ_M', '0'))
+    VECTOR_PQ_NBITS = int(os.getenv('VECTOR_PQ_NBITS', '8'))
+    VECTOR_RERANK_FACTOR = int(os.getenv('VECTOR_RERANK_FACTOR', '4'))
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
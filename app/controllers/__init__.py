@@ -1,4 +1,5 @@
 from .testcase_controller import testcase_bp
 from .knowledge_controller import knowledge_bp
+from .metrics_controller import metrics_bp
 
-__all__ = ['testcase_bp', 'knowledge_bp'] 
\ No newline at end of file
+__all__ = ['testcase_bp', 'knowledge_bp', 'metrics_bp'] 
\ No newline at end of file
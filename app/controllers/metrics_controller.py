@@ -0,0 +1,40 @@
+from flask import Blueprint, jsonify
+from ..services.dify_transport import get_dify_transport
+from ..services.embedding_cache import get_embedding_cache
+from ..services.embedding_model_registry import get_loaded_models
+from ..services.embedding_scheduler import get_scheduler_stats
+from ..services.job_service import get_job_manager
+from ..services.llm_cache import get_llm_cache
+from ..services.llm_client_registry import get_llm_client_registry
+from ..services.llm_rate_limiter import get_rate_limiter_stats
+from ..services.llm_resilience import get_request_hedger
+from ..utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('metrics_controller')
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+
+@metrics_bp.route('', methods=['GET'])
+def get_metrics():
+    """获取当前进程的缓存和性能统计"""
+    try:
+        embedding_cache = get_embedding_cache()
+        llm_cache = get_llm_cache()
+        
+        result = {
+            "embedding_models": get_loaded_models(),
+            "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+            "embedding_scheduler": get_scheduler_stats(),
+            "jobs": get_job_manager().stats(),
+            "llm_cache": llm_cache.stats() if llm_cache else None,
+            "llm_endpoints": get_llm_client_registry().stats(),
+            "llm_rate_limits": get_rate_limiter_stats(),
+            "llm_hedging": get_request_hedger().stats(),
+            "dify": get_dify_transport().stats()
+        }
+        
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"获取性能统计失败: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
@@ -1,13 +1,19 @@
 import os
 import json
+import time
 import pandas as pd
 import shutil
-from flask import Blueprint, request, jsonify, current_app, send_file
+import tempfile
+from flask import Blueprint, request, jsonify, current_app, send_file, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from ..models import db, TestCase, TestCaseBatch
-from ..services import document_service  # 导入全局实例
 from ..services.dify_service import DifyService
 from ..services.ai_service import AIService
+from ..services.job_service import get_job_manager, JOB_SUCCEEDED, JOB_FAILED
+from ..services.testcase_dedup_service import TestCaseDedupService
+from ..services.pipeline import Pipeline
+from ..services.extraction_pool import get_extraction_pool
+from ..config import get_config
 from ..utils.logger import get_logger
 
 # 获取日志器
@@ -15,6 +21,9 @@ logger = get_logger('testcase_controller')
 
 testcase_bp = Blueprint('testcase', __name__, url_prefix='/api/testcase')
 
+# 任务由其他进程执行时，SSE接口从数据库读取任务状态的间隔（秒）
+JOB_EVENTS_POLL_INTERVAL = 2
+
 def _extract_knowledge_base_content(kb_results):
     """
     从Dify知识库返回的结果中提取内容
@@ -49,9 +58,25 @@ def _extract_knowledge_base_content(kb_results):
     
     return content_list
 
+# 测试用例生成任务的阶段定义：(阶段名称, 显示名称, 进度权重)
+GENERATION_STAGES = [
+    ('extract', '解析文档', 15),
+    ('summarize', '生成文档摘要', 5),
+    ('retrieve', '检索知识库', 5),
+    ('generate', '生成测试用例', 40),
+    ('review', '评审测试用例', 23),
+    ('dedupe', '合并相似测试用例', 2),
+    ('save', '保存测试用例', 5),
+    ('kb_upload', '上传文档到知识库', 5)
+]
+
 @testcase_bp.route('/upload', methods=['POST'])
 def upload_document():
-    """上传文档并生成测试用例，同时将文档添加到知识库"""
+    """上传文档并提交测试用例生成任务，立即返回任务ID
+    
+    文档解析、生成、评审、入库和上传知识库在后台任务中执行，
+    前端通过 /api/testcase/jobs/<job_id> 查询进度和生成的批次ID。
+    """
     if 'file' not in request.files:
         return jsonify({"error": "没有文件"}), 400
         
@@ -72,9 +97,20 @@ def upload_document():
     except (ValueError, TypeError):
         case_count = 100  # 如果不是有效的整数，使用默认值100
     
-    # 创建临时上传目录
+    # 是否复用大模型响应缓存，传false时本次跳过缓存重新生成
+    use_cache = request.form.get('use_cache', 'true').lower() != 'false'
+    
+    # 先检查文件类型，避免提交注定失败的任务
+    filenames = [file.filename for file in files]
+    for filename in filenames:
+        file_ext = os.path.splitext(filename)[1].lower().replace('.', '')
+        if file_ext not in ['pdf', 'docx', 'md']:
+            return jsonify({"error": f"不支持的文件类型: {filename}，仅支持PDF、DOCX和MD文件"}), 400
+    
+    # 创建临时上传目录，每次上传使用独立的子目录，避免并发任务的同名文件互相覆盖
     upload_folder = os.path.join(current_app.root_path, 'uploads')
     os.makedirs(upload_folder, exist_ok=True)
+    job_upload_folder = tempfile.mkdtemp(prefix='job-', dir=upload_folder)
     
     # 创建文档存储目录
     documents_folder = os.path.join(current_app.root_path, 'documents')
@@ -82,142 +118,308 @@ def upload_document():
     
     # 保存所有文件到临时上传目录
     file_paths = []
-    filenames = []
-    combined_document_text = ""
-    
-    for file in files:
-        filename = file.filename
-        filenames.append(filename)
-        file_path = os.path.join(upload_folder, filename)
+    for file, filename in zip(files, filenames):
+        file_path = os.path.join(job_upload_folder, filename)
         file.save(file_path)
-        
-        # 获取文件类型
-        file_ext = os.path.splitext(filename)[1].lower().replace('.', '')
-        if file_ext not in ['pdf', 'docx', 'md']:
-            # 删除已上传的文件
-            for path in file_paths:
-                if os.path.exists(path):
-                    os.remove(path)
-            os.remove(file_path)  # 删除不支持的文件
-            return jsonify({"error": f"不支持的文件类型: {filename}，仅支持PDF、DOCX和MD文件"}), 400
-        
         file_paths.append(file_path)
     
-    try:
-        # 处理所有文档，合并文本内容
-        for i, file_path in enumerate(file_paths):
-            file_ext = os.path.splitext(filenames[i])[1].lower().replace('.', '')
-            # 处理文档，使用全局document_service实例
-            document_text = document_service.process_document(file_path, file_ext)
-            # 添加文件分隔符和文件名
-            combined_document_text += f"\n\n--- 文件: {filenames[i]} ---\n\n{document_text}"
-        
-        # 使用AI生成文档摘要
-        ai_service = AIService()
-        document_summary = ai_service.summarize_text(combined_document_text, max_length=200)
-        
-        # 查询Dify知识库，使用摘要而非原始文本
-        dify_service = DifyService()
-        kb_results = dify_service.query_knowledge_base(document_summary)
-        
-        # 处理知识库返回的数据，提取内容
-        kb_content = _extract_knowledge_base_content(kb_results)
+    job = get_job_manager().submit(
+        'testcase_generation',
+        GENERATION_STAGES,
+        _run_testcase_generation,
+        current_app._get_current_object(),
+        file_paths,
+        filenames,
+        job_upload_folder,
+        documents_folder,
+        batch_name,
+        batch_description,
+        case_count,
+        use_cache
+    )
+    
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/testcase/jobs/{job.id}"
+    }), 202
+
+@testcase_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """查询测试用例生成任务的阶段进度和结果，任务由其他进程执行时从数据库读取"""
+    status = get_job_manager().get_status(job_id)
+    if status is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
         
-        # 生成测试用例，传递处理后的知识库内容
-        test_cases = ai_service.generate_test_cases(combined_document_text, kb_content, case_count)
+    return jsonify(status)
+
+@testcase_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """以Server-Sent Events推送任务进度和流式生成的测试用例
+    
+    事件类型：progress（任务状态，与任务查询接口返回格式相同）、
+    test_case（初步生成的单个测试用例，provisional为True，评审和去重后可能被修改或删除）、
+    test_cases（入库的最终测试用例列表，用于替换之前推送的初稿）。
+    任务结束后发送最后一个progress事件并关闭连接。任务由其他进程执行时只能从数据库读取状态，定期推送progress事件。
+    每个连接最多保持JOB_EVENTS_MAX_SECONDS秒，之后关闭连接释放请求线程，浏览器自动重连并从断点继续。
+    """
+    job_manager = get_job_manager()
+    job = job_manager.get(job_id)
+    if job is None and job_manager.get_status(job_id) is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    
+    deadline = time.monotonic() + get_config().JOB_EVENTS_MAX_SECONDS
+    
+    # 断线重连时浏览器携带Last-Event-ID，从断点继续推送
+    try:
+        start_cursor = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        start_cursor = 0
+    
+    def generate():
+        cursor = start_cursor
+        while time.monotonic() < deadline:
+            events, finished = job.wait_events(cursor)
+            for event, data in events:
+                yield f"id: {cursor}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                cursor += 1
+            if finished and not events:
+                break
+            if not events:
+                # 心跳注释，防止代理因长时间无数据断开连接
+                yield ": keep-alive\n\n"
+    
+    def generate_stored():
+        # 其他进程的任务没有事件列表，状态变化时推送progress事件，不带事件ID，不影响重连到任务所在进程时的断点
+        last_status = None
+        while time.monotonic() < deadline:
+            status = job_manager.get_status(job_id)
+            if status is None:
+                break
+            if status != last_status:
+                yield f"event: progress\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+                last_status = status
+            else:
+                yield ": keep-alive\n\n"
+            if status["status"] in (JOB_SUCCEEDED, JOB_FAILED):
+                break
+            time.sleep(JOB_EVENTS_POLL_INTERVAL)
+    
+    return Response(
+        stream_with_context(generate() if job is not None else generate_stored()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _run_testcase_generation(job, app, file_paths, filenames, job_upload_folder, documents_folder,
+                             batch_name, batch_description, case_count, use_cache=True):
+    """后台执行测试用例生成流程
+    
+    Args:
+        job: 任务实例，用于汇报阶段进度
+        app: Flask应用实例，用于在后台线程中访问数据库
+        file_paths: 临时上传的文件路径列表
+        filenames: 原始文件名列表
+        job_upload_folder: 本次上传的临时目录
+        documents_folder: 文档存储目录
+        batch_name: 批次名称
+        batch_description: 批次描述
+        case_count: 期望生成的测试用例数量
+        use_cache: 是否复用大模型响应缓存
         
-        # 检查是否有错误
-        if isinstance(test_cases, dict) and 'error' in test_cases:
-            return jsonify(test_cases), 500
+    Returns:
+        包含批次ID、批次名称和测试用例数量的字典
+    """
+    with app.app_context():
+        try:
+            ai_service = AIService(use_cache=use_cache)
+            dify_service = DifyService()
             
-        # 对初步生成的测试用例进行评审
-        reviewed_test_cases = ai_service.review_test_cases(test_cases, combined_document_text, kb_content, case_count)
-        
-        # 创建批次
-        source_document = ", ".join(filenames) if len(filenames) > 1 else filenames[0]
-        batch = TestCaseBatch(name=batch_name, description=batch_description)
-        db.session.add(batch)
-        db.session.flush()  # 获取批次ID
-        
-        # 保存测试用例（使用评审后的测试用例）
-        saved_test_cases = []
-        for tc in reviewed_test_cases:
-            test_case = TestCase(
-                title=tc.get('title', '未命名测试用例'),
-                description=tc.get('description', ''),
-                preconditions=tc.get('preconditions', ''),
-                steps=tc.get('steps', ''),
-                expected_results=tc.get('expected_results', ''),
-                source_document=source_document,
-                batch_id=batch.id
+            # 解析成功的文件下标，只有这些文件会存入文档目录并上传到知识库
+            parsed = []
+            
+            # 并行解析所有文档，按上传顺序合并文本内容
+            def extract():
+                job.start_stage('extract', f"解析 {len(file_paths)} 个文档")
+                files = [
+                    (file_path, os.path.splitext(filenames[i])[1].lower().replace('.', ''))
+                    for i, file_path in enumerate(file_paths)
+                ]
+                
+                def on_file_done(index, completed, error):
+                    status = f"失败: {error}" if error else "完成"
+                    job.update_stage(completed / len(files), f"解析文档 {filenames[index]} {status} ({completed}/{len(files)})")
+                
+                # 多文件上传中的PDF在进程内共享的解析池中解析，受时间和内存限制；其他文件在当前进程中解析
+                results = get_extraction_pool().extract_all(files, on_file_done)
+                parsed.extend(i for i, (_, error) in enumerate(results) if not error)
+                
+                # 单个文件解析失败时跳过该文件，全部失败时终止任务
+                failed = [f"{filenames[i]}: {error}" for i, (_, error) in enumerate(results) if error]
+                if len(failed) == len(results):
+                    raise RuntimeError(f"文档解析失败: {'; '.join(failed)}")
+                if failed:
+                    logger.warning(f"以下文档解析失败，已跳过: {'; '.join(failed)}")
+                
+                # 添加文件分隔符和文件名
+                return "".join(
+                    f"\n\n--- 文件: {filenames[i]} ---\n\n{document_text}"
+                    for i, (document_text, error) in enumerate(results) if not error
+                )
+            
+            # 使用AI生成文档摘要
+            def summarize(extract):
+                job.start_stage('summarize')
+                return ai_service.summarize_text(extract, max_length=200)
+            
+            # 查询Dify知识库，使用摘要而非原始文本，并提取知识库返回的内容
+            def retrieve(summarize):
+                job.start_stage('retrieve')
+                kb_results = dify_service.query_knowledge_base(summarize)
+                return _extract_knowledge_base_content(kb_results)
+            
+            # 文档向量化只依赖文档文本，与摘要生成和知识库查询并发执行
+            def index(extract):
+                return ai_service.prepare_vector_store(extract)
+            
+            pipeline = Pipeline('testcase-generation')
+            pipeline.add('extract', extract)
+            pipeline.add('summarize', summarize, deps=['extract'])
+            pipeline.add('retrieve', retrieve, deps=['summarize'])
+            pipeline.add('index', index, deps=['extract'])
+            stage_results = pipeline.run()
+            
+            combined_document_text = stage_results['extract']
+            kb_content = stage_results['retrieve']
+            
+            # 生成测试用例，传递处理后的知识库内容
+            # 流式生成时每解析出一个测试用例就作为初稿推送给前端，无需等待整个响应结束
+            job.start_stage('generate')
+            generated = []
+            
+            def on_test_case(test_case):
+                generated.append(test_case)
+                job.publish('test_case', {"provisional": True, "index": len(generated) - 1, "test_case": test_case})
+                job.update_stage(len(generated) / case_count, f"已生成 {len(generated)} 个测试用例")
+            
+            test_cases = ai_service.generate_test_cases(
+                combined_document_text, kb_content, case_count, on_test_case, vector_store=stage_results['index']
             )
-            db.session.add(test_case)
-            saved_test_cases.append(test_case)
             
-        # 将文件从临时上传目录移动到文档存储目录
-        for i, file_path in enumerate(file_paths):
-            document_path = os.path.join(documents_folder, filenames[i])
-            shutil.copy2(file_path, document_path)
+            # 检查是否有错误
+            if isinstance(test_cases, dict) and 'error' in test_cases:
+                raise RuntimeError(test_cases['error'])
+                
+            # 对初步生成的测试用例进行评审
+            job.start_stage('review', f"评审 {len(test_cases)} 个测试用例")
+            reviewed_test_cases = ai_service.review_test_cases(
+                test_cases, combined_document_text, kb_content, case_count, vector_store=stage_results['index']
+            )
             
-        db.session.commit()
-        
-        # 构建处理规则
-        process_rule = {
-            "mode": "custom",
-            "rules": {
-                "pre_processing_rules": [
-                    {
-                        "id": "remove_extra_spaces",
-                        "enabled": True
-                    },
-                    {
-                        "id": "remove_urls_emails",
-                        "enabled": True
+            # 入库前合并语义相似的测试用例
+            job.start_stage('dedupe')
+            merged_count = 0
+            if get_config().TESTCASE_DEDUP_ENABLED:
+                try:
+                    reviewed_test_cases, dedup_stats = TestCaseDedupService().deduplicate(reviewed_test_cases)
+                    merged_count = dedup_stats['merged']
+                    job.update_stage(1.0, f"合并了 {merged_count} 个相似测试用例")
+                except Exception as e:
+                    logger.warning(f"测试用例语义去重失败，保留全部测试用例: {str(e)}")
+            
+            # 创建批次
+            job.start_stage('save')
+            source_document = ", ".join(filenames[i] for i in parsed)
+            batch = TestCaseBatch(name=batch_name, description=batch_description)
+            db.session.add(batch)
+            db.session.flush()  # 获取批次ID
+            
+            # 保存测试用例（使用评审后的测试用例）
+            saved_count = 0
+            for tc in reviewed_test_cases:
+                test_case = TestCase(
+                    title=tc.get('title', '未命名测试用例'),
+                    description=tc.get('description', ''),
+                    preconditions=tc.get('preconditions', ''),
+                    steps=tc.get('steps', ''),
+                    expected_results=tc.get('expected_results', ''),
+                    source_document=source_document,
+                    batch_id=batch.id
+                )
+                db.session.add(test_case)
+                saved_count += 1
+                
+            # 将解析成功的文件从临时上传目录移动到文档存储目录，解析失败或超时的文件不保留
+            for i in parsed:
+                document_path = os.path.join(documents_folder, filenames[i])
+                shutil.copy2(file_paths[i], document_path)
+                
+            db.session.commit()
+            
+            # 推送入库的最终测试用例，前端用其替换评审和去重前推送的初稿
+            job.publish('test_cases', {
+                "provisional": False,
+                "test_cases": [{"title": tc.get('title', '未命名测试用例')} for tc in reviewed_test_cases]
+            })
+            
+            result = {
+                "batch_id": batch.id,
+                "batch_name": batch.name,
+                "test_case_count": saved_count,
+                "merged_count": merged_count
+            }
+            
+            # 构建处理规则
+            process_rule = {
+                "mode": "custom",
+                "rules": {
+                    "pre_processing_rules": [
+                        {
+                            "id": "remove_extra_spaces",
+                            "enabled": True
+                        },
+                        {
+                            "id": "remove_urls_emails",
+                            "enabled": True
+                        }
+                    ],
+                    "segmentation": {
+                        "separator": "\n\n",
+                        "max_tokens": 1024
                     }
-                ],
-                "segmentation": {
-                    "separator": "\n\n",
-                    "max_tokens": 1024
                 }
             }
-        }
-        
-        # 分别将每个文档上传到知识库
-        for i, file_path in enumerate(file_paths):
-            filename = filenames[i]
-            logger.info(f"正在将文档 {filename} 上传到知识库")
             
-            # 上传文档到知识库
-            kb_upload_result = dify_service.upload_file_to_knowledge_base(
-                file_path, 
-                filename,
-                indexing_technique="high_quality",
-                process_rule=process_rule
-            )
+            # 分别将每个文档上传到知识库
+            job.start_stage('kb_upload')
+            for n, i in enumerate(parsed):
+                file_path = file_paths[i]
+                filename = filenames[i]
+                logger.info(f"正在将文档 {filename} 上传到知识库")
+                job.update_stage(n / len(parsed), f"上传文档 {filename} 到知识库 ({n + 1}/{len(parsed)})")
+                
+                # 上传文档到知识库
+                kb_upload_result = dify_service.upload_file_to_knowledge_base(
+                    file_path, 
+                    filename,
+                    indexing_technique="high_quality",
+                    process_rule=process_rule
+                )
+                
+                # 检查知识库上传结果
+                if 'error' in kb_upload_result:
+                    logger.warning(f"文档 {filename} 上传到知识库失败: {kb_upload_result['error']}")
+                else:
+                    logger.info(f"文档 {filename} 已成功上传到知识库，文档ID: {kb_upload_result.get('document', {}).get('id')}")
             
-            # 检查知识库上传结果
-            if 'error' in kb_upload_result:
-                logger.warning(f"文档 {filename} 上传到知识库失败: {kb_upload_result['error']}")
-            else:
-                logger.info(f"文档 {filename} 已成功上传到知识库，文档ID: {kb_upload_result.get('document', {}).get('id')}")
-        
-        # 返回生成的测试用例
-        result = {
-            "batch_id": batch.id,
-            "batch_name": batch.name,
-            "test_cases": [tc.to_dict() for tc in saved_test_cases]
-        }
-        
-        return jsonify(result), 201
-    except Exception as e:
-        logger.error(f"生成测试用例失败: {str(e)}", exc_info=True)
-        db.session.rollback()
-        return jsonify({"error": str(e)}), 500
-    finally:
-        # 清理临时上传的文件
-        for file_path in file_paths:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            return result
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            # 清理临时上传的文件
+            shutil.rmtree(job_upload_folder, ignore_errors=True)
+            db.session.remove()
 
 @testcase_bp.route('/batch/<int:batch_id>', methods=['GET'])
 def get_batch_test_cases(batch_id):
@@ -4,5 +4,6 @@ db = SQLAlchemy()
 
 from .testcase import TestCase, TestCaseBatch
 from .knowledge_file import KnowledgeFile
+from .job import JobRecord
 
-__all__ = ['db', 'TestCase', 'TestCaseBatch', 'KnowledgeFile'] 
\ No newline at end of file
+__all__ = ['db', 'TestCase', 'TestCaseBatch', 'KnowledgeFile', 'JobRecord'] 
\ No newline at end of file
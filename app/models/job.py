@@ -0,0 +1,21 @@
+import json
+from datetime import datetime
+from . import db
+
+class JobRecord(db.Model):
+    """后台任务状态模型，多进程部署时任意进程都可以查询其他进程提交的任务"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)  # 任务ID
+    kind = db.Column(db.String(50), nullable=False)  # 任务类型
+    status = db.Column(db.String(20), default='queued')  # queued, running, succeeded, failed
+    snapshot = db.Column(db.Text, nullable=False)  # 任务查询接口返回内容的JSON
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    def __repr__(self):
+        return f'<JobRecord {self.id}>'
+        
+    def to_dict(self):
+        """转换为字典，与内存中任务的to_dict格式相同"""
+        return json.loads(self.snapshot)
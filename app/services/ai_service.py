@@ -1,12 +1,22 @@
+import re
+import time
+import uuid
+import threading
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from ..config import get_config
 from .vector_store_service import VectorStoreService
+from .llm_cache import get_llm_cache
+from .llm_client_registry import get_llm_client_registry
+from .llm_rate_limiter import get_rate_limiter, is_rate_limit_error, get_retry_after, PRIORITY_HIGH, PRIORITY_LOW
+from .llm_resilience import RetryPolicy, is_retryable_error, get_request_hedger
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI
 from langchain.schema.messages import HumanMessage
 from typing import List, Optional
 from ..utils.logger import get_logger
+from ..utils.token_counter import count_tokens, truncate_to_tokens
+from ..utils.json_stream import JSONArrayStreamParser, extract_json_array
 
 # 获取日志记录器
 logger = get_logger('ai_service')
@@ -14,25 +24,236 @@ logger = get_logger('ai_service')
 class AIService:
     """AI服务，负责生成测试用例"""
     
-    def __init__(self):
+    def __init__(self, use_cache=True):
+        """初始化AI服务
+        
+        Args:
+            use_cache: 是否使用大模型响应缓存，传False时本次请求跳过缓存重新调用模型
+        """
         config = get_config()
         self.api_key = config.AI_API_KEY
         self.base_url = config.AI_BASE_URL
         self.model = config.AI_MODEL
         self.max_tokens = config.AI_MAX_TOKENS
+        self.request_timeout = config.AI_REQUEST_TIMEOUT or None
+        # 流式生成：逐个token读取模型输出，每个测试用例对象完整后立即回调
+        self.streaming = config.AI_STREAMING
+        # 生成模式：single（单次调用）、map_reduce（按章节并行生成后合并）、auto（超出上下文预算时使用map_reduce）
+        self.generation_mode = config.AI_GENERATION_MODE
+        self.map_reduce_workers = config.AI_MAP_REDUCE_WORKERS
+        self.section_tokens = config.AI_MAP_REDUCE_SECTION_TOKENS or int(self.max_tokens * 0.4)
+        self.min_section_cases = config.AI_MAP_REDUCE_MIN_SECTION_CASES
+        # 评审模式：diff（模型只返回对草稿用例的修改操作）、full（模型返回完整的测试用例集）
+        self.review_mode = config.AI_REVIEW_MODE
+        # 分片评审：草稿用例数超过分片大小时按分片并行评审，0表示不分片
+        self.review_shard_size = config.AI_REVIEW_SHARD_SIZE
+        self.review_workers = config.AI_REVIEW_WORKERS
         
         if not self.api_key:
             raise ValueError("AI API密钥未配置")
             
-        # 初始化LangChain的ChatOpenAI客户端
-        self.chat_model = ChatOpenAI(
-            model=self.model,
-            openai_api_key=self.api_key,
-            openai_api_base=self.base_url,
-            max_tokens=self.max_tokens,
-            temperature=0.7,
-            request_timeout=60
+        # LangChain的ChatOpenAI客户端由进程级注册表统一管理，所有AIService实例复用同一个长连接池
+        self.llm_registry = get_llm_client_registry()
+        self.chat_model = self._get_chat_model(temperature=0.7, max_tokens=self.max_tokens, request_timeout=self.request_timeout)
+        
+        # 调用模型网关前按RPM/TPM额度排队，同一AIService实例（即同一个上传任务）的调用计为同一个任务参与公平排序
+        self.rate_limiter = get_rate_limiter(self.base_url)
+        self.rate_limit_retries = config.LLM_RATE_LIMIT_MAX_RETRIES
+        self.rate_limit_backoff = config.LLM_RATE_LIMIT_BACKOFF
+        self.owner = uuid.uuid4().hex
+        
+        # 临时错误按指数退避重试；慢请求按历史耗时分位数发出对冲请求（需在配置中启用）
+        self.retry_policy = RetryPolicy(
+            max_retries=config.LLM_RETRY_MAX_RETRIES,
+            base_delay=config.LLM_RETRY_BASE_DELAY,
+            max_delay=config.LLM_RETRY_MAX_DELAY
         )
+        self.hedger = get_request_hedger()
+        
+        # 大模型响应缓存（需在配置中启用），相同参数和提示的请求直接复用之前的响应
+        self.llm_cache = get_llm_cache() if use_cache else None
+        
+    def _get_chat_model(self, temperature, max_tokens, request_timeout=None):
+        """从注册表获取共享的ChatOpenAI实例
+        
+        Args:
+            temperature: 采样温度
+            max_tokens: 最大生成token数
+            request_timeout: 请求超时（秒），None表示不限制
+            
+        Returns:
+            ChatOpenAI实例
+        """
+        return self.llm_registry.get_chat_model(
+            self.model,
+            self.api_key,
+            self.base_url,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            request_timeout=request_timeout
+        )
+        
+    def _cache_key(self, llm, prompt):
+        """计算响应缓存键，未启用缓存时返回None"""
+        if self.llm_cache is None:
+            return None
+        return self.llm_cache.make_key(self.base_url, llm.model_name, llm.temperature, llm.max_tokens, prompt)
+        
+    def _cache_get(self, cache_key):
+        """读取缓存的响应，未命中或读取失败时返回None"""
+        if cache_key is None:
+            return None
+        try:
+            content = self.llm_cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"读取大模型响应缓存失败: {str(e)}")
+            return None
+        if content is not None:
+            logger.info(f"命中大模型响应缓存 {cache_key[:12]}")
+        return content
+        
+    def _cache_put(self, cache_key, content, cacheable=None):
+        """写入响应缓存，空响应和cacheable判定为无效的响应不缓存"""
+        if cache_key is None or not content:
+            return
+        if cacheable is not None and not cacheable(content):
+            return
+        try:
+            self.llm_cache.put(cache_key, content)
+        except Exception as e:
+            logger.warning(f"写入大模型响应缓存失败: {str(e)}")
+        
+    def _estimate_call_tokens(self, llm, prompt):
+        """预估一次调用消耗的token数，按最大生成长度预扣TPM额度"""
+        return count_tokens(prompt) + (llm.max_tokens or 0)
+        
+    def _should_retry(self, error, attempt):
+        """
+        判断调用失败后是否重试，需要重试时先完成等待
+        - 429：暂停该网关的所有调用，由限流调度器重新排队
+        - 5xx、超时、连接错误：按指数退避加随机抖动等待
+        
+        Args:
+            error: 调用异常
+            attempt: 当前重试次数
+            
+        Returns:
+            是否应当重试
+        """
+        if is_rate_limit_error(error):
+            if attempt >= self.rate_limit_retries:
+                return False
+            self.rate_limiter.pause(get_retry_after(error, self.rate_limit_backoff))
+            return True
+        
+        if is_retryable_error(error) and attempt < self.retry_policy.max_retries:
+            delay = self.retry_policy.backoff(attempt)
+            logger.warning(f"调用大模型失败，{delay:.1f}秒后第{attempt + 1}次重试: {str(error)}")
+            time.sleep(delay)
+            return True
+        
+        return False
+        
+    def _invoke_once(self, llm, prompt, estimated_tokens, priority):
+        """排队获取限流额度和并发名额后调用一次大模型，返回响应文本"""
+        self.rate_limiter.acquire(estimated_tokens, priority, self.owner)
+        # 调用失败时只计入已发送的提示词，归还预扣的输出额度，避免重试和失败占满TPM窗口
+        actual_tokens = count_tokens(prompt)
+        try:
+            # 限制同一模型服务的并发调用数，超出时排队等待
+            with self.llm_registry.slot(self.base_url):
+                response = llm.invoke([HumanMessage(content=prompt)])
+            token_usage = (response.response_metadata or {}).get('token_usage') or {}
+            actual_tokens = token_usage.get('total_tokens')
+            return response.content
+        finally:
+            # 按实际消耗归还多预扣的TPM额度
+            self.rate_limiter.release(estimated_tokens, actual_tokens)
+        
+    def _invoke_llm(self, llm, prompt, cacheable=None, priority=PRIORITY_HIGH):
+        """
+        调用大模型并返回响应文本，所有非流式调用都经过这里
+        
+        Args:
+            llm: ChatOpenAI实例
+            prompt: 提示文本
+            cacheable: 判断响应是否值得缓存的函数，默认缓存所有非空响应
+            priority: 限流排队优先级
+            
+        Returns:
+            响应文本
+        """
+        cache_key = self._cache_key(llm, prompt)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        estimated_tokens = self._estimate_call_tokens(llm, prompt)
+        # 耗时统计按模型和最大生成长度分类，生成、评审和摘要的耗时分布差别很大
+        hedge_key = (llm.model_name, llm.max_tokens)
+        attempt = 0
+        while True:
+            try:
+                content = self.hedger.call(
+                    hedge_key,
+                    lambda: self._invoke_once(llm, prompt, estimated_tokens, priority)
+                )
+                break
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                attempt += 1
+        
+        self._cache_put(cache_key, content, cacheable)
+        return content
+        
+    def _stream_llm(self, llm, prompt, cacheable=None, priority=PRIORITY_HIGH):
+        """
+        以流式方式调用大模型，逐段返回响应文本；命中缓存时一次性返回缓存的完整响应
+        
+        Args:
+            llm: ChatOpenAI实例
+            prompt: 提示文本
+            cacheable: 判断响应是否值得缓存的函数，默认缓存所有非空响应
+            priority: 限流排队优先级
+            
+        Yields:
+            响应文本片段
+        """
+        cache_key = self._cache_key(llm, prompt)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        estimated_tokens = self._estimate_call_tokens(llm, prompt)
+        parts = []
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(estimated_tokens, priority, self.owner)
+            try:
+                with self.llm_registry.slot(self.base_url):
+                    for chunk in llm.stream([HumanMessage(content=prompt)]):
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            yield chunk.content
+                break
+            except Exception as e:
+                # 已经输出部分内容后无法重试，只有首个片段之前的失败才重新调用
+                if parts or not self._should_retry(e, attempt):
+                    raise
+                attempt += 1
+            finally:
+                # 每次调用结束（包括失败和调用方提前关闭生成器）都按已发送和已接收的内容归还多预扣的TPM额度
+                self.rate_limiter.release(estimated_tokens, count_tokens(prompt) + count_tokens(''.join(parts)))
+        
+        # 只缓存完整接收的响应，中途断开时异常直接抛出，不会写入缓存
+        self._cache_put(cache_key, ''.join(parts), cacheable)
+        
+    def _is_test_case_response(self, content):
+        """响应中能解析出完整的测试用例数组时才值得缓存，被截断的响应不缓存，以便重新生成"""
+        _, report = extract_json_array(content)
+        return report["found"] and not report["truncated"]
         
     def summarize_text(self, document_text, max_length=200):
         """
@@ -54,23 +275,12 @@ class AIService:
         """
         
         try:
-            # 创建一个临时的ChatOpenAI实例，使用较低的temperature
-            summarizer = ChatOpenAI(
-                model=self.model,
-                openai_api_key=self.api_key,
-                openai_api_base=self.base_url,
-                max_tokens=300,  # 为摘要分配足够的token
-                temperature=0.5  # 使用较低的temperature以获得更确定性的摘要
-            )
+            # 使用较低的temperature以获得更确定性的摘要，为摘要分配足够的token
+            summarizer = self._get_chat_model(temperature=0.5, max_tokens=300, request_timeout=self.request_timeout)
             
-            # 创建人类消息
-            human_message = HumanMessage(content=prompt)
-            
-            # 使用LangChain的ChatOpenAI调用API
-            response = summarizer.invoke([human_message])
-            
-            # 提取生成的摘要
-            summary = response.content.strip()
+            # 使用LangChain的ChatOpenAI调用API，提取生成的摘要
+            # 摘要只用于检索知识库，排队优先级低于生成和评审
+            summary = self._invoke_llm(summarizer, prompt, priority=PRIORITY_LOW).strip()
             
             # 确保摘要不超过指定长度
             if len(summary) > max_length:
@@ -83,7 +293,31 @@ class AIService:
             # 失败时返回文档前200个字符
             return document_text[:max_length]
             
-    def generate_test_cases(self, document_text, knowledge_base_results=None, case_count=100):
+    def _use_map_reduce(self, document_text):
+        """长文档按章节并行生成，避免整篇文档挤进一个提示、由一次很慢的调用生成全部用例"""
+        return self.generation_mode == 'map_reduce' or (
+            self.generation_mode == 'auto' and count_tokens(document_text) > self.max_tokens * 0.75
+        )
+        
+    def prepare_vector_store(self, document_text):
+        """
+        预先向量化文档，供generate_test_cases使用
+        向量化只依赖文档文本，可以与摘要生成、知识库查询并发执行
+        
+        Args:
+            document_text: 文档文本
+            
+        Returns:
+            已处理文档的VectorStoreService实例，按章节生成时不需要向量存储，返回None
+        """
+        if self._use_map_reduce(document_text):
+            return None
+        vector_store = VectorStoreService()
+        vector_store.process_document(document_text)
+        return vector_store
+        
+    def generate_test_cases(self, document_text, knowledge_base_results=None, case_count=100, on_test_case=None,
+                            vector_store=None):
         """
         生成测试用例
         
@@ -91,13 +325,18 @@ class AIService:
             document_text: 文档文本
             knowledge_base_results: 知识库查询结果，默认为None
             case_count: 期望生成的测试用例数量，默认为100
+            on_test_case: 流式生成时每解析出一个测试用例就调用的回调函数，默认为None
+            vector_store: prepare_vector_store预先处理好的向量存储，默认为None时在此处理文档
             
         Returns:
             生成的测试用例（JSON格式）
         """
+        if self._use_map_reduce(document_text):
+            return self._generate_map_reduce(document_text, knowledge_base_results, case_count, on_test_case)
+        
         # 使用向量存储处理文档
-        vector_store = VectorStoreService()
-        vector_store.process_document(document_text)
+        if vector_store is None:
+            vector_store = self.prepare_vector_store(document_text)
         
         # 创建提示，使用文档的摘要作为查询
         summary_query = self._create_summary_query(document_text)
@@ -107,10 +346,159 @@ class AIService:
         prompt = self._create_test_case_prompt(relevant_context, knowledge_base_results, case_count)
         
         # 检查提示长度，如果太长则进一步处理
-        if len(prompt.split()) > self.max_tokens * 0.75:  # 留出空间给响应
-            return self._handle_long_context(relevant_context, knowledge_base_results, case_count)
+        if count_tokens(prompt) > self.max_tokens * 0.75:  # 留出空间给响应
+            return self._handle_long_context(relevant_context, knowledge_base_results, case_count, on_test_case)
             
-        return self._call_ai_api(prompt)
+        return self._call_ai_api(prompt, on_test_case)
+        
+    def _generate_map_reduce(self, document_text, knowledge_base_results=None, case_count=100, on_test_case=None):
+        """
+        按章节并行生成测试用例后合并去重
+        
+        文档按token预算切分为若干章节，每个章节按长度比例分配用例数量，
+        在有界线程池中并发调用AI API，总耗时取决于最慢的章节而不是全部章节之和。
+        
+        Args:
+            document_text: 文档文本
+            knowledge_base_results: 知识库查询结果，默认为None
+            case_count: 期望生成的测试用例总数，默认为100
+            on_test_case: 流式生成时的测试用例回调函数，默认为None；各章节并发生成，回调会被串行调用
+            
+        Returns:
+            合并去重后的测试用例（JSON格式），全部章节失败时返回包含error的字典
+        """
+        sections = self._split_sections(document_text)
+        
+        # 各章节在不同线程中解析出测试用例，加锁保证回调与单次生成时一样串行执行
+        if on_test_case is not None:
+            callback_lock = threading.Lock()
+            section_callback = on_test_case
+            
+            def on_test_case(test_case):
+                with callback_lock:
+                    section_callback(test_case)
+        quotas = self._allocate_section_quotas(sections, case_count)
+        
+        # 每个章节的提示中，章节文本之外的预算留给知识库内容
+        max_available_tokens = int(self.max_tokens * 0.7)
+        
+        def generate_section(index):
+            section = sections[index]
+            kb_results = self._select_knowledge_base_results(
+                knowledge_base_results, max_available_tokens - count_tokens(section)
+            )
+            prompt = self._create_test_case_prompt(section, kb_results, quotas[index])
+            return self._call_ai_api(prompt, on_test_case)
+        
+        logger.info(f"按章节并行生成测试用例，章节数: {len(sections)}，用例配额: {quotas}")
+        
+        with ThreadPoolExecutor(max_workers=min(self.map_reduce_workers, len(sections)), thread_name_prefix='section') as executor:
+            section_results = list(executor.map(generate_section, range(len(sections))))
+        
+        # 按章节顺序合并，单个章节失败不影响其他章节
+        merged = []
+        errors = []
+        for index, result in enumerate(section_results):
+            if isinstance(result, dict) and 'error' in result:
+                logger.warning(f"第 {index + 1} 个章节生成测试用例失败: {result['error']}")
+                errors.append(result)
+            elif isinstance(result, list):
+                merged.extend(tc for tc in result if isinstance(tc, dict))
+        
+        if not merged:
+            return errors[0] if errors else {"error": "各章节均未生成测试用例"}
+        
+        test_cases = self._deduplicate_test_cases(merged)
+        logger.info(f"章节并行生成完成，合并 {len(merged)} 个测试用例，去重后 {len(test_cases)} 个，失败章节 {len(errors)} 个")
+        return test_cases
+        
+    def _split_sections(self, document_text):
+        """
+        按token预算将文档切分为章节，优先在段落边界切分
+        
+        Args:
+            document_text: 文档文本
+            
+        Returns:
+            章节文本列表
+        """
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.section_tokens,
+            chunk_overlap=min(200, self.section_tokens // 10),
+            length_function=lambda x: count_tokens(x, approximate=True)  # 分块时频繁调用，使用近似计数
+        )
+        sections = text_splitter.split_text(document_text)
+        return sections or [document_text]
+        
+    def _allocate_section_quotas(self, sections, case_count):
+        """
+        按章节长度比例分配测试用例数量
+        
+        Args:
+            sections: 章节文本列表
+            case_count: 期望生成的测试用例总数
+            
+        Returns:
+            与sections一一对应的用例数量列表
+        """
+        section_tokens = [max(count_tokens(section), 1) for section in sections]
+        total_tokens = sum(section_tokens)
+        return [
+            max(self.min_section_cases, round(case_count * tokens / total_tokens))
+            for tokens in section_tokens
+        ]
+        
+    def _select_knowledge_base_results(self, knowledge_base_results, remaining_tokens):
+        """
+        在剩余token预算内选取知识库结果
+        
+        Args:
+            knowledge_base_results: 知识库查询结果
+            remaining_tokens: 剩余token预算
+            
+        Returns:
+            选取的知识库结果，预算不足时只保留第一个结果
+        """
+        if not knowledge_base_results:
+            return None
+        
+        if remaining_tokens <= 500:
+            return knowledge_base_results[:1]
+        
+        selected = []
+        tokens_used = 0
+        for result in knowledge_base_results:
+            result_tokens = count_tokens(result.get('content', ''))
+            if tokens_used + result_tokens > remaining_tokens:
+                break
+            selected.append(result)
+            tokens_used += result_tokens
+        
+        return selected or knowledge_base_results[:1]
+        
+    @staticmethod
+    def _deduplicate_test_cases(test_cases):
+        """
+        去除标题和步骤完全相同的测试用例（忽略空白和标点差异），相邻章节重叠部分常产生此类重复
+        
+        Args:
+            test_cases: 测试用例列表
+            
+        Returns:
+            去重后的测试用例列表，保持原有顺序
+        """
+        seen = set()
+        unique = []
+        for tc in test_cases:
+            key = tuple(
+                re.sub(r'[\W_]+', '', str(tc.get(field, ''))).lower()
+                for field in ('title', 'steps')
+            )
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(tc)
+        return unique
         
     def _create_summary_query(self, document_text):
         """从文档中创建摘要查询"""
@@ -168,7 +556,7 @@ class AIService:
         
         return prompt
         
-    def _handle_long_context(self, document_text, knowledge_base_results=None, case_count=100):
+    def _handle_long_context(self, document_text, knowledge_base_results=None, case_count=100, on_test_case=None):
         """
         处理超长上下文的情况
         
@@ -176,6 +564,7 @@ class AIService:
             document_text: 文档文本
             knowledge_base_results: 知识库查询结果，默认为None
             case_count: 期望生成的测试用例数量，默认为100
+            on_test_case: 流式生成时的测试用例回调函数，默认为None
             
         Returns:
             生成的测试用例（JSON格式）
@@ -194,7 +583,7 @@ class AIService:
         processed_kb_results = None
         if knowledge_base_results:
             # 估算已使用的token数
-            context_tokens = len(extracted_context.split())
+            context_tokens = count_tokens(extracted_context)
             remaining_tokens = max_available_tokens - context_tokens
             
             # 如果剩余token足够，处理知识库结果
@@ -203,7 +592,7 @@ class AIService:
                 kb_tokens = 0
                 for result in knowledge_base_results:
                     if 'content' in result:
-                        kb_tokens += len(result['content'].split())
+                        kb_tokens += count_tokens(result['content'])
                 
                 if kb_tokens > 0 and len(knowledge_base_results) > 0:
                     avg_tokens_per_result = kb_tokens / len(knowledge_base_results)
@@ -218,38 +607,98 @@ class AIService:
         
         # 4. 创建提示并调用AI API
         prompt = self._create_test_case_prompt(extracted_context, processed_kb_results, case_count)
-        return self._call_ai_api(prompt)
+        return self._call_ai_api(prompt, on_test_case)
         
-    def _call_ai_api(self, prompt):
-        """调用AI API，使用LangChain"""
+    def _call_ai_api(self, prompt, on_test_case=None):
+        """调用AI API，使用LangChain
+        
+        Args:
+            prompt: 提示文本
+            on_test_case: 测试用例回调函数，提供且启用流式生成时逐个推送解析出的测试用例
+            
+        Returns:
+            测试用例列表，失败时返回包含error的字典
+        """
+        if on_test_case is not None and self.streaming:
+            return self._call_ai_api_streaming(prompt, on_test_case)
+            
         try:
-            # 创建人类消息
-            human_message = HumanMessage(content=prompt)
+            # 使用LangChain的ChatOpenAI调用API，提取生成的内容
+            content = self._invoke_llm(self.chat_model, prompt, cacheable=self._is_test_case_response)
             
-            # 使用LangChain的ChatOpenAI调用API
-            response = self.chat_model.invoke([human_message])
+            return self._parse_test_cases(content)
+        
+        except Exception as e:
+            logger.error(f"调用AI API失败: {str(e)}", exc_info=True)
+            return {"error": str(e)}
             
-            # 提取生成的内容
-            content = response.content
+    def _call_ai_api_streaming(self, prompt, on_test_case):
+        """以流式方式调用AI API，每个测试用例对象完整后立即解析并回调
+        
+        Args:
+            prompt: 提示文本
+            on_test_case: 测试用例回调函数
             
-            # 尝试解析JSON
-            try:
-                # 查找JSON部分
-                start_idx = content.find('[')
-                end_idx = content.rfind(']') + 1
+        Returns:
+            测试用例列表，失败时返回包含error的字典
+        """
+        parser = JSONArrayStreamParser()
+        test_cases = []
+        content_parts = []
+        
+        try:
+            for text in self._stream_llm(self.chat_model, prompt, cacheable=self._is_test_case_response):
+                content_parts.append(text)
                 
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_str = content[start_idx:end_idx]
-                    test_cases = json.loads(json_str)
-                    return test_cases
-                else:
-                    return {"error": "无法在AI响应中找到JSON格式的测试用例"}
-            except json.JSONDecodeError:
-                return {"error": "无法解析AI生成的测试用例JSON", "raw_content": content}
+                for test_case in parser.feed(text):
+                    test_cases.append(test_case)
+                    try:
+                        on_test_case(test_case)
+                    except Exception as e:
+                        logger.warning(f"测试用例回调处理失败: {str(e)}")
         
         except Exception as e:
-            logger.error(f"调用AI API失败: {str(e)}", exc_info=True)
+            logger.error(f"流式调用AI API失败: {str(e)}", exc_info=True)
+            # 中途断开时保留已经完整解析的测试用例
+            if test_cases:
+                logger.warning(f"流式响应中断，保留已解析的 {len(test_cases)} 个测试用例")
+                return test_cases
             return {"error": str(e)}
+        
+        if parser.close():
+            logger.warning("流式响应中的测试用例数组没有正常结束，响应可能被截断")
+        if parser.dropped:
+            logger.warning(f"流式解析丢弃了 {parser.dropped} 个无法解析的测试用例")
+        
+        if test_cases:
+            return test_cases
+        
+        # 响应中没有可增量解析的数组时，按完整响应再解析一次
+        return self._parse_test_cases(''.join(content_parts))
+        
+    def _parse_test_cases(self, content):
+        """从完整的AI响应中解析测试用例JSON数组
+        
+        Args:
+            content: AI响应文本
+            
+        Returns:
+            测试用例列表，失败时返回包含error的字典
+        """
+        # 逐个提取完整的测试用例对象，截断或格式错误的对象单独丢弃，不影响其余对象
+        test_cases, report = extract_json_array(content)
+        if not report["found"]:
+            return {"error": "无法在AI响应中找到JSON格式的测试用例"}
+        
+        if report["dropped"] or report["truncated"]:
+            logger.warning(
+                f"AI响应解析: 保留 {report['parsed']} 个测试用例，丢弃 {report['dropped']} 个无法解析的对象"
+                f"{'，响应被截断' if report['truncated'] else ''}"
+            )
+        
+        if not test_cases and report["dropped"]:
+            return {"error": "无法解析AI生成的测试用例JSON", "raw_content": content}
+        return test_cases
 
     def _generate_dynamic_queries(self, document_text, base_queries=None):
         """
@@ -307,7 +756,7 @@ class AIService:
             
         return queries 
 
-    def _extract_key_sections(self, document_text, queries, max_tokens):
+    def _extract_key_sections(self, document_text, queries, max_tokens, vector_store=None):
         """
         从文档中提取关键部分
         
@@ -315,6 +764,7 @@ class AIService:
             document_text: 文档文本
             queries: 查询关键词列表
             max_tokens: 最大token数
+            vector_store: 已处理该文档的向量存储，默认为None时在此向量化文档
             
         Returns:
             提取的关键部分文本
@@ -323,7 +773,7 @@ class AIService:
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
-            length_function=lambda x: len(x.split())  # 简单估算token数量
+            length_function=lambda x: count_tokens(x, approximate=True)  # 分块时频繁调用，使用近似计数
         )
         
         # 分割文档
@@ -332,37 +782,36 @@ class AIService:
         # 如果文档太短，不需要进一步处理
         if len(chunks) <= 3:
             # 确保不超过最大token数
-            total_tokens = sum(len(chunk.split()) for chunk in chunks)
+            total_tokens = sum(count_tokens(chunk) for chunk in chunks)
             if total_tokens <= max_tokens:
                 return document_text
             
-        # 创建向量存储
-        vector_store = VectorStoreService()
-        
-        # 处理每个文档块
-        for chunk in chunks:
-            vector_store.process_document(chunk)
+        # 没有可复用的向量存储时创建，按向量存储的分块规则切分所有文档块，整个文档只向量化一次
+        if vector_store is None:
+            vector_store = VectorStoreService()
+            texts = [piece for chunk in chunks for piece in vector_store.text_splitter.split_text(chunk)]
+            vector_store.add_texts(texts)
             
         # 使用查询关键词检索相关内容
         combined_context = ""
         tokens_used = 0
         max_tokens_per_query = max(int(max_tokens / len(queries)), 500)  # 确保每个查询至少有一些token
         
-        for query in queries:
-            # 为每个查询分配token预算
-            context = vector_store.get_relevant_context(query, max_tokens=max_tokens_per_query)
+        # 所有查询一次性向量化并检索，每个查询分配相同的token预算
+        contexts = vector_store.get_relevant_contexts(queries, max_tokens=max_tokens_per_query)
+        
+        for query, context in zip(queries, contexts):
             if context:
                 # 添加标题和内容
                 section = f"--- {query} 相关内容 ---\n{context}\n\n"
-                section_tokens = len(section.split())
+                section_tokens = count_tokens(section)
                 
                 # 检查是否超出总token预算
                 if tokens_used + section_tokens > max_tokens:
                     # 如果添加整个部分会超出预算，尝试添加部分内容
-                    words = section.split()
                     remaining_tokens = max_tokens - tokens_used
                     if remaining_tokens > 50:  # 确保至少添加一些有意义的内容
-                        combined_context += " ".join(words[:remaining_tokens]) + "...\n\n"
+                        combined_context += truncate_to_tokens(section, remaining_tokens) + "...\n\n"
                     break
                 
                 combined_context += section
@@ -381,38 +830,42 @@ class AIService:
             tail_tokens = min(int(remaining_tokens * 0.3), 1000)  # 结尾分配较少
             
             # 提取文档开头
-            head_text = " ".join(document_text.split()[:head_tokens])
+            head_text = truncate_to_tokens(document_text, head_tokens)
             
             # 提取文档结尾
-            all_words = document_text.split()
-            if len(all_words) > head_tokens + tail_tokens:
-                tail_text = " ".join(all_words[-tail_tokens:])
+            if count_tokens(document_text) > head_tokens + tail_tokens:
+                tail_text = truncate_to_tokens(document_text, tail_tokens, from_end=True)
                 combined_context += f"\n\n--- 文档开头 ---\n{head_text}\n\n--- 文档结尾 ---\n{tail_text}"
             else:
                 # 如果文档不够长，只添加未包含的部分
-                remaining_text = " ".join(all_words[head_tokens:])
+                remaining_text = document_text[len(head_text):]
                 combined_context += f"\n\n--- 文档其余部分 ---\n{remaining_text}"
         
         return combined_context.strip() 
 
-    def review_test_cases(self, test_cases, document_text, knowledge_base_results=None, case_count=100):
+    def review_test_cases(self, test_cases, document_text, knowledge_base_results=None, case_count=100,
+                          vector_store=None):
         """
         对初步生成的测试用例进行评审，查缺补漏，生成最终测试用例
+        用例数量超过分片大小时按分片并行评审，每个分片只携带与其相关的文档内容
         
         Args:
             test_cases: 初步生成的测试用例（JSON格式）
             document_text: 原始需求文档
             knowledge_base_results: 知识库查询结果，默认为None
             case_count: 期望生成的测试用例数量，默认为100
+            vector_store: prepare_vector_store预先处理好的向量存储，检索文档内容时复用，默认为None时按需向量化
             
         Returns:
             评审后的测试用例（JSON格式）
         """
-        # 将测试用例转换为字符串
-        test_cases_str = json.dumps(test_cases, ensure_ascii=False, indent=2)
+        if self.review_shard_size and len(test_cases) > self.review_shard_size:
+            return self._review_sharded(test_cases, document_text, knowledge_base_results, case_count, vector_store)
+        
+        test_cases_str, create_prompt = self._serialize_for_review(test_cases)
         
         # 检查文档长度，估算token数量
-        doc_tokens = len(document_text.split())
+        doc_tokens = count_tokens(document_text)
         max_available_tokens = int(self.max_tokens * 0.7)  # 留出30%给响应
         
         # 如果文档太长，需要进行处理
@@ -424,67 +877,178 @@ class AIService:
             
             # 2. 提取文档关键部分
             # 为测试用例和提示保留一些token
-            test_cases_tokens = len(test_cases_str.split())
-            prompt_overhead_tokens = 500  # 评审提示的固定部分大约需要的token数
-            
-            # 计算文档可用的token预算
-            doc_token_budget = max_available_tokens - test_cases_tokens - prompt_overhead_tokens
-            doc_token_budget = max(doc_token_budget, int(max_available_tokens * 0.3))  # 确保至少有一些token用于文档
+            doc_token_budget = self._review_document_budget(test_cases_str, max_available_tokens)
             
             # 提取文档关键部分
-            extracted_document = self._extract_key_sections(document_text, queries, doc_token_budget)
+            extracted_document = self._extract_key_sections(document_text, queries, doc_token_budget, vector_store)
             
             # 3. 处理知识库结果
             processed_kb_results = self._process_knowledge_base_for_review(extracted_document, knowledge_base_results, max_available_tokens)
             
             # 4. 创建评审提示并调用API
-            prompt = self._create_review_prompt(test_cases_str, extracted_document, processed_kb_results, case_count)
+            prompt = create_prompt(test_cases_str, extracted_document, processed_kb_results, case_count)
         else:
             # 文档不长，使用完整文档
-            prompt = self._create_review_prompt(test_cases_str, document_text, knowledge_base_results, case_count)
+            prompt = create_prompt(test_cases_str, document_text, knowledge_base_results, case_count)
         
-        # 调用API获取评审结果
-        try:
-            # 创建一个专门用于评审的ChatOpenAI实例
-            reviewer = ChatOpenAI(
-                model=self.model,
-                openai_api_key=self.api_key,
-                openai_api_base=self.base_url,
-                max_tokens=self.max_tokens,
-                temperature=0.5  # 使用较低的temperature以获得更确定性的结果
-            )
+        return self._run_review(test_cases, prompt)
+        
+    def _serialize_for_review(self, test_cases):
+        """
+        按评审模式序列化测试用例
+        
+        Args:
+            test_cases: 测试用例列表
             
-            # 创建人类消息
-            human_message = HumanMessage(content=prompt)
+        Returns:
+            (测试用例字符串, 对应评审模式的提示创建函数)
+        """
+        # diff模式下每行一个带编号的紧凑JSON对象，供模型按编号引用
+        if self.review_mode == 'diff':
+            test_cases_str = "\n".join(
+                json.dumps({"index": i, **tc}, ensure_ascii=False) for i, tc in enumerate(test_cases)
+            )
+            return test_cases_str, self._create_review_diff_prompt
+        return json.dumps(test_cases, ensure_ascii=False, indent=2), self._create_review_prompt
+        
+    @staticmethod
+    def _review_document_budget(test_cases_str, max_available_tokens):
+        """计算评审提示中文档内容可用的token预算"""
+        test_cases_tokens = count_tokens(test_cases_str)
+        prompt_overhead_tokens = 500  # 评审提示的固定部分大约需要的token数
+        
+        # 计算文档可用的token预算
+        doc_token_budget = max_available_tokens - test_cases_tokens - prompt_overhead_tokens
+        return max(doc_token_budget, int(max_available_tokens * 0.3))  # 确保至少有一些token用于文档
+        
+    def _run_review(self, test_cases, prompt):
+        """
+        调用模型评审一批测试用例
+        
+        Args:
+            test_cases: 待评审的测试用例列表
+            prompt: 评审提示
             
-            # 调用API
-            response = reviewer.invoke([human_message])
+        Returns:
+            评审后的测试用例列表，评审失败时返回原始测试用例
+        """
+        try:
+            # 评审使用较低的temperature以获得更确定性的结果
+            reviewer = self._get_chat_model(temperature=0.5, max_tokens=self.max_tokens, request_timeout=self.request_timeout)
             
-            # 提取生成的内容
-            content = response.content
+            # 调用API，提取生成的内容
+            content = self._invoke_llm(reviewer, prompt, cacheable=self._is_test_case_response)
             
-            # 尝试解析JSON
-            try:
-                # 查找JSON部分
-                start_idx = content.find('[')
-                end_idx = content.rfind(']') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_str = content[start_idx:end_idx]
-                    reviewed_test_cases = json.loads(json_str)
-                    return reviewed_test_cases
-                else:
-                    logger.info("无法在评审响应中找到JSON格式的测试用例，返回原始测试用例")
+            # 逐个提取完整的对象，评审响应被截断时保留已完整的部分
+            reviewed_test_cases, report = extract_json_array(content)
+            if self.review_mode == 'diff':
+                if not report["found"]:
+                    logger.info("无法在评审响应中找到修改操作，返回原始测试用例")
                     return test_cases
-            except json.JSONDecodeError:
-                logger.error(f"无法解析评审生成的测试用例JSON，返回原始测试用例")
+                return self._apply_review_operations(test_cases, reviewed_test_cases)
+            
+            if not reviewed_test_cases:
+                logger.info("无法在评审响应中找到可解析的测试用例，返回原始测试用例")
                 return test_cases
+            
+            if report["dropped"] or report["truncated"]:
+                logger.warning(
+                    f"评审响应解析: 保留 {report['parsed']} 个测试用例，丢弃 {report['dropped']} 个无法解析的对象"
+                    f"{'，响应被截断' if report['truncated'] else ''}"
+                )
+            return reviewed_test_cases
                 
         except Exception as e:
             logger.error(f"测试用例评审失败: {str(e)}", exc_info=True)
             # 评审失败时返回原始测试用例
             return test_cases
             
+    def _review_sharded(self, test_cases, document_text, knowledge_base_results=None, case_count=100,
+                        vector_store=None):
+        """
+        按分片并行评审测试用例后合并
+        
+        草稿用例按生成顺序（即文档章节顺序）切分为连续的分片，每个分片以自身用例的标题和描述
+        检索文档中最相关的内容作为上下文，在有界线程池中并发评审。评审总耗时取决于最慢的分片，
+        不随用例数量线性增长，每个分片的提示也能为文档内容留出足够的token预算。
+        
+        Args:
+            test_cases: 初步生成的测试用例
+            document_text: 原始需求文档
+            knowledge_base_results: 知识库查询结果，默认为None
+            case_count: 期望生成的测试用例总数，默认为100
+            vector_store: 已处理该文档的向量存储，默认为None时在此向量化文档
+            
+        Returns:
+            合并去重后的评审结果
+        """
+        size = self.review_shard_size
+        shards = [test_cases[i:i + size] for i in range(0, len(test_cases), size)]
+        max_available_tokens = int(self.max_tokens * 0.7)  # 留出30%给响应
+        
+        serialized = [self._serialize_for_review(shard) for shard in shards]
+        budgets = [self._review_document_budget(shard_str, max_available_tokens) for shard_str, _ in serialized]
+        
+        # 文档能完整放入分片提示时直接使用全文，否则为每个分片检索相关内容，优先复用生成阶段已处理的向量存储
+        if count_tokens(document_text) <= min(budgets):
+            documents = [document_text] * len(shards)
+        else:
+            if vector_store is None:
+                vector_store = VectorStoreService()
+                vector_store.process_document(document_text)
+            queries = [
+                "\n".join(f"{tc.get('title', '')} {tc.get('description', '')}".strip() for tc in shard)
+                for shard in shards
+            ]
+            documents = [
+                self._build_review_document(context, document_text, budgets[index])
+                for index, context in enumerate(
+                    vector_store.get_relevant_contexts(queries, max_tokens=max(budgets), k=10)
+                )
+            ]
+        
+        def review_shard(index):
+            shard_str, create_prompt = serialized[index]
+            kb_results = self._process_knowledge_base_for_review(documents[index], knowledge_base_results, max_available_tokens)
+            shard_count = max(len(shards[index]), round(case_count * len(shards[index]) / len(test_cases)))
+            prompt = create_prompt(shard_str, documents[index], kb_results, shard_count)
+            return self._run_review(shards[index], prompt)
+        
+        logger.info(f"按分片并行评审测试用例，用例数: {len(test_cases)}，分片数: {len(shards)}")
+        
+        with ThreadPoolExecutor(max_workers=min(self.review_workers, len(shards)), thread_name_prefix='review') as executor:
+            shard_results = list(executor.map(review_shard, range(len(shards))))
+        
+        # 按分片顺序合并，不同分片新增的用例可能重复
+        merged = [tc for result in shard_results for tc in result if isinstance(tc, dict)]
+        reviewed = self._deduplicate_test_cases(merged)
+        logger.info(f"分片评审完成，评审前 {len(test_cases)} 个测试用例，评审后 {len(reviewed)} 个")
+        return reviewed
+        
+    @staticmethod
+    def _build_review_document(context, document_text, max_tokens):
+        """
+        组装分片评审使用的文档内容：检索到的相关内容加上文档开头的概述
+        
+        Args:
+            context: 检索到的相关内容
+            document_text: 原始需求文档
+            max_tokens: 文档内容的token预算
+            
+        Returns:
+            文档内容文本
+        """
+        if not context:
+            return truncate_to_tokens(document_text, max_tokens)
+        
+        # 文档开头通常是需求背景和整体说明，为每个分片保留一小部分
+        head_tokens = min(int(max_tokens * 0.2), 500)
+        context_tokens = count_tokens(context)
+        if context_tokens + head_tokens > max_tokens:
+            context = truncate_to_tokens(context, max_tokens - head_tokens)
+        head_text = truncate_to_tokens(document_text, head_tokens)
+        return f"--- 文档开头 ---\n{head_text}\n\n--- 与本组测试用例相关的内容 ---\n{context}"
+        
     def _process_knowledge_base_for_review(self, extracted_document, knowledge_base_results, max_tokens):
         """
         为评审处理知识库结果，考虑token预算
@@ -501,7 +1065,7 @@ class AIService:
             return None
             
         # 估算已使用的token数
-        doc_tokens = len(extracted_document.split())
+        doc_tokens = count_tokens(extracted_document)
         remaining_tokens = max_tokens - doc_tokens - 500  # 减去提示的固定部分
         
         # 如果剩余token不足，返回有限的知识库结果
@@ -512,7 +1076,7 @@ class AIService:
         kb_tokens = 0
         for result in knowledge_base_results:
             if 'content' in result:
-                kb_tokens += len(result['content'].split())
+                kb_tokens += count_tokens(result['content'])
         
         # 计算可以包含多少知识库结果
         if kb_tokens > 0 and len(knowledge_base_results) > 0:
@@ -558,16 +1122,7 @@ class AIService:
         {document_text}
         """
         
-        # 添加知识库内容
-        if knowledge_base_results:
-            prompt += "\n\n参考知识库信息：\n"
-            for result in knowledge_base_results:
-                if 'content' in result:
-                    content_text = result['content']
-                    # 如果单个知识库条目太长，进行截断
-                    if len(content_text.split()) > 500:
-                        content_text = " ".join(content_text.split()[:500]) + "..."
-                    prompt += content_text + "\n\n"
+        prompt += self._format_review_knowledge(knowledge_base_results)
         
         prompt += """
         请对初步测试用例进行评审，并返回改进后的完整测试用例集。你可以：
@@ -591,4 +1146,132 @@ class AIService:
         只返回JSON格式的测试用例集，不要添加任何额外的说明或解释。
         """
         
-        return prompt 
\ No newline at end of file
+        return prompt 
+        
+    def _format_review_knowledge(self, knowledge_base_results):
+        """
+        将知识库结果格式化为评审提示中的参考信息
+        
+        Args:
+            knowledge_base_results: 处理后的知识库结果
+            
+        Returns:
+            参考信息文本，没有知识库结果时返回空字符串
+        """
+        if not knowledge_base_results:
+            return ""
+        
+        text = "\n\n参考知识库信息：\n"
+        for result in knowledge_base_results:
+            if 'content' in result:
+                content_text = result['content']
+                # 如果单个知识库条目太长，进行截断
+                if count_tokens(content_text) > 500:
+                    content_text = truncate_to_tokens(content_text, 500) + "..."
+                text += content_text + "\n\n"
+        return text
+        
+    def _create_review_diff_prompt(self, test_cases_str, document_text, knowledge_base_results=None, case_count=10):
+        """
+        创建只返回修改操作的测试用例评审提示
+        输出token数只与需要修改的用例数成正比，而不是与整批用例数成正比
+        
+        Args:
+            test_cases_str: 每行一个带index编号的测试用例JSON
+            document_text: 处理后的文档文本
+            knowledge_base_results: 处理后的知识库结果
+            case_count: 期望生成的测试用例数量，默认为10
+            
+        Returns:
+            评审提示字符串
+        """
+        prompt = f"""
+        你是一个资深的测试专家和软件评审员，负责对测试用例进行严格评审。
+        我已经基于需求文档生成了一组初步的测试用例，现在需要你对这些测试用例进行全面评审，查缺补漏，确保测试覆盖了所有重要场景。
+        
+        请特别关注以下方面：
+        1. 功能完整性：是否测试了所有功能点和业务流程
+        2. 边界条件：是否考虑了各种边界情况和异常情况
+        3. 数据验证：是否验证了各种数据输入和输出
+        4. 用户场景：是否覆盖了所有可能的用户交互场景
+        5. 安全性考虑：是否包含必要的安全测试
+        6. 测试步骤的清晰度和可执行性
+        7. 预期结果的明确性和可验证性
+        
+        请确保最终测试用例的数量尽可能不少于{case_count}个，除非需求文档确实无法支持这么多测试用例。
+        如果初步生成的测试用例数量不足{case_count}个，请尝试添加新的测试用例以达到预期数量。
+        
+        初步生成的测试用例（每行一个，index为用例编号）：
+        {test_cases_str}
+        
+        原始需求文档：
+        {document_text}
+        """
+        
+        prompt += self._format_review_knowledge(knowledge_base_results)
+        
+        prompt += """
+        请对初步测试用例进行评审，但不要返回完整的测试用例集，只返回需要执行的修改操作。
+        没有出现在操作列表中的测试用例将原样保留，因此不需要为合格的测试用例返回任何内容。
+        支持以下操作：
+        1. 改进现有测试用例：{"op": "modify", "index": 用例编号, "changes": {只包含需要修改的字段}}
+        2. 删除不必要或重复的测试用例：{"op": "delete", "index": 用例编号}
+        3. 添加新的测试用例以覆盖遗漏的场景：{"op": "add", "case": {完整的测试用例}}
+        
+        测试用例的字段为title、description、preconditions、steps、expected_results。
+        请以JSON数组格式返回操作列表，例如：
+        [
+            {"op": "modify", "index": 3, "changes": {"steps": "1. 步骤1\\n2. 步骤2", "expected_results": "1. 预期结果1\\n2. 预期结果2"}},
+            {"op": "delete", "index": 7},
+            {"op": "add", "case": {"title": "测试用例标题", "description": "测试用例描述", "preconditions": "前置条件", "steps": "1. 步骤1\\n2. 步骤2", "expected_results": "1. 预期结果1\\n2. 预期结果2"}}
+        ]
+        
+        所有测试用例都合格且无需补充时返回 []。只返回JSON格式的操作列表，不要添加任何额外的说明或解释。
+        """
+        
+        return prompt
+        
+    def _apply_review_operations(self, test_cases, operations):
+        """
+        将评审返回的修改操作应用到草稿测试用例上
+        新增的用例追加在末尾；同一用例同时被修改和删除时以删除为准；编号无效或格式错误的操作被忽略
+        
+        Args:
+            test_cases: 草稿测试用例列表
+            operations: 评审返回的操作列表
+            
+        Returns:
+            评审后的测试用例列表
+        """
+        reviewed = [dict(tc) if isinstance(tc, dict) else tc for tc in test_cases]
+        deleted = set()
+        added = []
+        counts = {"keep": 0, "modify": 0, "delete": 0, "add": 0, "invalid": 0}
+        
+        for operation in operations:
+            op = str(operation.get('op', '')).lower()
+            index = operation.get('index')
+            valid_index = isinstance(index, int) and not isinstance(index, bool) and 0 <= index < len(reviewed)
+            
+            if op == 'keep' and valid_index:
+                counts["keep"] += 1
+            elif op == 'modify' and valid_index and isinstance(operation.get('changes'), dict) and isinstance(reviewed[index], dict):
+                reviewed[index].update(
+                    (field, value) for field, value in operation['changes'].items() if field != 'index'
+                )
+                counts["modify"] += 1
+            elif op == 'delete' and valid_index:
+                deleted.add(index)
+                counts["delete"] += 1
+            elif op == 'add' and isinstance(operation.get('case'), dict) and operation['case'].get('title'):
+                added.append({field: value for field, value in operation['case'].items() if field != 'index'})
+                counts["add"] += 1
+            else:
+                counts["invalid"] += 1
+        
+        result = [tc for i, tc in enumerate(reviewed) if i not in deleted] + added
+        logger.info(
+            f"评审操作已应用: 修改 {counts['modify']} 个，删除 {counts['delete']} 个，新增 {counts['add']} 个，"
+            f"忽略无效操作 {counts['invalid']} 个，测试用例 {len(test_cases)} -> {len(result)}"
+        )
+        return result
@@ -2,6 +2,7 @@ import os
 import requests
 import json
 from app.config import get_config
+from app.services.dify_transport import get_dify_transport
 from app.utils.logger import get_logger
 
 # 获取日志记录器
@@ -15,6 +16,8 @@ class DifyService:
         self.api_key = config.DIFY_API_KEY
         self.base_url = config.DIFY_API_BASE_URL
         self.dataset_id = config.DIFY_KNOWLEDGE_BASE_ID
+        # 所有DifyService实例共享同一个带连接池、超时、重试和熔断的传输层
+        self.transport = get_dify_transport()
         
         if not self.api_key:
             raise ValueError("Dify API密钥未配置")
@@ -87,7 +90,8 @@ class DifyService:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data)
+            # 检索只读取数据，可以安全重试
+            response = self.transport.request('POST', url, 'retrieve', idempotent=True, headers=headers, json=data)
             
             # 如果请求失败，使用辅助方法处理错误
             if response.status_code != 200:
@@ -126,7 +130,7 @@ class DifyService:
             params["keyword"] = keyword
         
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self.transport.request('GET', url, 'documents.list', headers=headers, params=params)
             
             # 如果请求失败，使用辅助方法处理错误
             if response.status_code != 200:
@@ -210,7 +214,7 @@ class DifyService:
                 }
                 
                 # 发送请求
-                response = requests.post(url, headers=headers, files=files)
+                response = self.transport.request('POST', url, 'document.create_by_file', headers=headers, files=files)
                 
                 # 详细记录请求和响应信息（调试用）
                 logger.debug(f"请求头: {headers}")
@@ -249,7 +253,7 @@ class DifyService:
         }
         
         try:
-            response = requests.delete(url, headers=headers)
+            response = self.transport.request('DELETE', url, 'document.delete', headers=headers)
             
             # API返回204 No Content表示成功
             if response.status_code == 204:
@@ -286,7 +290,7 @@ class DifyService:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.transport.request('GET', url, 'document.indexing_status', headers=headers)
             
             # 如果请求失败，使用辅助方法处理错误
             if response.status_code != 200:
@@ -0,0 +1,243 @@
+"""
+Dify API共享HTTP传输层
+- 进程内所有DifyService实例共享一个requests.Session，保持长连接，避免每次调用重新建立TCP/TLS连接
+- 所有请求都有连接超时和读取超时，Dify无响应时不会无限期占用工作线程
+- 幂等请求在连接错误、超时和502/503/504时按指数退避重试
+- 熔断器：连续失败达到阈值后一段时间内直接失败，不再等待超时，之后放行一个探测请求判断Dify是否恢复
+- 按接口统计调用耗时分布
+"""
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from app.config import get_config
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('dify_transport')
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+# 耗时分布的桶上限（毫秒）
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """熔断器打开时直接失败的请求"""
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed正常放行，open直接拒绝，half_open只放行一个探测请求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """初始化熔断器
+
+        Args:
+            failure_threshold: 连续失败多少次后打开熔断器
+            reset_timeout: 熔断器打开多少秒后放行探测请求
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """判断是否放行请求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info("Dify服务已恢复，熔断器关闭")
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def abandon(self):
+        """请求因与Dify服务无关的原因（如参数错误）中断时释放探测名额，不计入成功或失败"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                logger.warning(f"Dify服务连续失败 {self.failures} 次，熔断器打开 {self.reset_timeout} 秒")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
+
+
+class LatencyHistogram:
+    """单个接口的调用耗时分布"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms, error=False):
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= bound), len(LATENCY_BUCKETS_MS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if error:
+            self.errors += 1
+
+    def stats(self):
+        labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["gt_30000ms"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0,
+            "max_ms": round(self.max_ms, 1),
+            "buckets": dict(zip(labels, self.buckets))
+        }
+
+
+class DifyTransport:
+    """带连接池、超时、重试和熔断的Dify API传输层"""
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=60, max_retries=2, backoff=0.5,
+                 failure_threshold=5, reset_timeout=30):
+        """初始化传输层
+
+        Args:
+            pool_size: 长连接池大小
+            connect_timeout: 连接超时（秒）
+            read_timeout: 读取超时（秒）
+            max_retries: 幂等请求的最大重试次数
+            backoff: 首次重试的基准等待时间（秒），之后每次翻倍
+            failure_threshold: 熔断器打开前允许的连续失败次数
+            reset_timeout: 熔断器打开后多少秒放行探测请求
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _record(self, endpoint, elapsed_ms, error):
+        with self._lock:
+            if endpoint not in self._histograms:
+                self._histograms[endpoint] = LatencyHistogram()
+            self._histograms[endpoint].record(elapsed_ms, error)
+
+    def request(self, method, url, endpoint, idempotent=None, **kwargs):
+        """发送请求
+
+        Args:
+            method: HTTP方法
+            url: 请求地址
+            endpoint: 接口名称，用于耗时统计（URL中含有ID，不适合直接作为统计维度）
+            idempotent: 是否可以安全重试，默认GET、HEAD、DELETE可以重试
+            **kwargs: 传给requests的其他参数，未指定timeout时使用默认超时
+
+        Returns:
+            requests响应对象
+
+        Raises:
+            CircuitOpenError: 熔断器打开
+            requests.exceptions.RequestException: 重试后仍然失败的连接错误或超时，以及其他不可重试的请求错误
+        """
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'DELETE')
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = self.max_retries + 1 if idempotent else 1
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Dify服务暂时不可用（熔断中），请稍后重试: {endpoint}")
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                # 所有请求错误都计为失败，否则半开状态下的探测请求失败后熔断器会一直停在半开状态
+                self._record(endpoint, (time.perf_counter() - start) * 1000, error=True)
+                self.breaker.record_failure()
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if not retryable or attempt + 1 >= attempts:
+                    raise
+                logger.warning(f"调用Dify接口 {endpoint} 失败，准备重试: {str(e)}")
+            except Exception:
+                self.breaker.abandon()
+                raise
+            else:
+                server_error = response.status_code >= 500
+                self._record(endpoint, (time.perf_counter() - start) * 1000, error=server_error)
+                # 4xx说明Dify服务本身正常，只有5xx计为失败
+                if server_error:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt + 1 >= attempts:
+                    return response
+                logger.warning(f"调用Dify接口 {endpoint} 返回 HTTP {response.status_code}，准备重试")
+
+            delay = self.backoff * (2 ** attempt)
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+    def stats(self):
+        """获取熔断器状态和各接口的耗时分布"""
+        with self._lock:
+            endpoints = {endpoint: histogram.stats() for endpoint, histogram in self._histograms.items()}
+        return {"circuit_breaker": self.breaker.stats(), "endpoints": endpoints}
+
+
+# 进程内共享的传输层
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_dify_transport():
+    """获取进程内共享的Dify API传输层"""
+    global _transport
+
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                config = get_config()
+                _transport = DifyTransport(
+                    pool_size=config.DIFY_POOL_SIZE,
+                    connect_timeout=config.DIFY_CONNECT_TIMEOUT,
+                    read_timeout=config.DIFY_READ_TIMEOUT,
+                    max_retries=config.DIFY_MAX_RETRIES,
+                    backoff=config.DIFY_RETRY_BACKOFF,
+                    failure_threshold=config.DIFY_BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=config.DIFY_BREAKER_RESET_TIMEOUT
+                )
+
+    return _transport
@@ -13,7 +13,9 @@ import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
 from paddleocr import PaddleOCR
 import time
+import threading
 from ..utils.logger import get_logger
+from ..utils.token_counter import count_tokens
 
 # 获取日志器
 logger = get_logger('document_service')
@@ -42,41 +44,48 @@ class DocumentService:
             return
             
         # 检查OCR总开关是否启用
-        ocr_enabled = os.environ.get('OCR_ENABLED', 'True').lower() == 'true'
-        
-        # 如果OCR被禁用，直接设置tesseract_available为False并跳过初始化
-        if not ocr_enabled:
+        self.ocr_enabled = os.environ.get('OCR_ENABLED', 'True').lower() == 'true'
+        if not self.ocr_enabled:
             logger.info("OCR功能已禁用，将跳过所有OCR处理")
-            # 仅在真正初始化时打印信息，而不是每次创建实例
-            self.tesseract_available = False
-            self.ocr_engine = None
-            self._initialized = True
-            return
             
-        # 初始化PaddleOCR，替代原来的Tesseract
-        try:
-            logger.info("正在初始化PaddleOCR...")
-            start_time = time.time()
-
-            # 从环境变量中获取OCR配置参数
-            lang = os.environ.get('OCR_LANG', 'ch')
-            # 初始化PaddleOCR实例
-            self.ocr_engine = PaddleOCR(use_angle_cls=True, lang=lang)
-            # 为了兼容性，保留tesseract_available标志，但始终设为True
-            self.tesseract_available = True
-
-            elapsed_time = time.time() - start_time
-            logger.info(f"PaddleOCR初始化成功，耗时: {elapsed_time:.2f}秒")
-            # 仅在真正初始化时打印信息，而不是每次创建实例
-        except Exception as e:
-            logger.error(f"PaddleOCR初始化失败: {str(e)}", exc_info=True)
-            # 仅在真正初始化时打印信息，而不是每次创建实例
-            self.tesseract_available = False
-            self.ocr_engine = None
+        # PaddleOCR在首次需要OCR时才初始化：解析子进程和向量化子进程导入本模块时不必各自加载一份OCR模型
+        self.ocr_engine = None
+        self._ocr_loaded = False
+        self._ocr_lock = threading.Lock()
         
         # 标记为已初始化
         self._initialized = True
 
+    def init_ocr(self):
+        """初始化PaddleOCR，替代原来的Tesseract；已初始化或OCR被禁用时直接返回"""
+        if self._ocr_loaded:
+            return
+        with self._ocr_lock:
+            if self._ocr_loaded:
+                return
+            if self.ocr_enabled:
+                try:
+                    logger.info("正在初始化PaddleOCR...")
+                    start_time = time.time()
+
+                    # 从环境变量中获取OCR配置参数
+                    lang = os.environ.get('OCR_LANG', 'ch')
+                    # 初始化PaddleOCR实例
+                    self.ocr_engine = PaddleOCR(use_angle_cls=True, lang=lang)
+
+                    elapsed_time = time.time() - start_time
+                    logger.info(f"PaddleOCR初始化成功，耗时: {elapsed_time:.2f}秒")
+                except Exception as e:
+                    logger.error(f"PaddleOCR初始化失败: {str(e)}", exc_info=True)
+                    self.ocr_engine = None
+            self._ocr_loaded = True
+
+    @property
+    def tesseract_available(self):
+        """OCR引擎是否可用（为了兼容性保留tesseract_available名称），首次访问时初始化PaddleOCR"""
+        self.init_ocr()
+        return self.ocr_engine is not None
+
     def process_document(self, file_path, file_type):
         """处理文档并返回文本内容"""
         if file_type == 'pdf':
@@ -310,7 +319,7 @@ class DocumentService:
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=lambda x: len(x.split())  # 简单估算token数量
+            length_function=lambda x: count_tokens(x, approximate=True)  # 分块时频繁调用，使用近似计数
         )
 
         chunks = text_splitter.split_text(text)
@@ -321,7 +330,7 @@ class DocumentService:
         current_tokens = 0
 
         for chunk in chunks:
-            chunk_tokens = len(chunk.split())
+            chunk_tokens = count_tokens(chunk)
             if current_tokens + chunk_tokens <= max_tokens:
                 current_chunk += chunk
                 current_tokens += chunk_tokens
@@ -0,0 +1,304 @@
+"""
+可插拔的向量化后端
+- torch: 直接使用SentenceTransformer.encode
+- onnx: 将同一模型导出为ONNX计算图并进行int8动态量化，由ONNX Runtime在CPU上推理
+两种后端输出相同维度的float32向量，可直接用于现有的FAISS索引
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('embedding_backends')
+
+# 支持的后端类型
+BACKEND_TYPES = ('torch', 'onnx')
+
+class TorchEmbeddingBackend:
+    """基于PyTorch SentenceTransformer的向量化后端"""
+
+    def __init__(self, model, model_name, num_threads=0):
+        """初始化后端
+
+        Args:
+            model: 已加载的SentenceTransformer模型
+            model_name: 模型名称
+            num_threads: torch计算线程数，0表示使用torch默认值
+        """
+        import torch
+
+        self.model = model
+        self.model_name = model_name
+        # 缓存和持久化索引按model_id区分，torch后端沿用模型名称以兼容已有缓存
+        self.model_id = model_name
+        self.backend = 'torch'
+
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        """向量化文本
+
+        Args:
+            texts: 文本列表
+            batch_size: 批大小
+            show_progress_bar: 是否显示进度条
+
+        Returns:
+            float32向量矩阵
+        """
+        embeddings = self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar)
+        return np.asarray(embeddings, dtype='float32')
+
+
+class OnnxEmbeddingBackend:
+    """基于ONNX Runtime的向量化后端，默认使用int8动态量化模型"""
+
+    MODEL_FILE = 'model.onnx'
+    QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+    POOLING_FILE = 'pooling.json'
+
+    def __init__(self, model_name, export_dir, quantize=True, num_threads=0, load_torch_model=None):
+        """初始化后端，导出文件不存在时先从SentenceTransformer模型导出
+
+        Args:
+            model_name: 模型名称
+            export_dir: ONNX模型导出目录
+            quantize: 是否使用int8动态量化模型
+            num_threads: ONNX Runtime线程数，0表示使用默认值
+            load_torch_model: 返回SentenceTransformer模型的函数，仅在需要导出时调用
+        """
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise RuntimeError(f"ONNX向量化后端需要安装onnxruntime和transformers: {str(e)}")
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.backend = 'onnx-int8' if quantize else 'onnx'
+        self.model_id = f"{model_name}@{self.backend}"
+        self.export_dir = os.path.join(export_dir, model_name.replace('/', '__'))
+
+        model_path = os.path.join(self.export_dir, self.QUANTIZED_MODEL_FILE if quantize else self.MODEL_FILE)
+        if not os.path.exists(model_path):
+            if load_torch_model is None:
+                raise RuntimeError(f"ONNX模型不存在且无法导出: {model_path}")
+            self._export(load_torch_model(), quantize)
+
+        with open(os.path.join(self.export_dir, self.POOLING_FILE), 'r', encoding='utf-8') as f:
+            self.pooling = json.load(f)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.export_dir)
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            session_options.intra_op_num_threads = num_threads
+            session_options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, session_options, providers=['CPUExecutionProvider'])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+        logger.info(f"ONNX向量化后端加载完成: {model_path}，线程数: {num_threads or '默认'}")
+
+    def _export(self, model, quantize):
+        """将SentenceTransformer的Transformer部分导出为ONNX，并保存分词器和池化配置
+
+        先导出到临时目录，再逐个文件原子替换到导出目录，模型文件最后移入。
+        多个工作进程冷启动时同时导出不会读到写了一半的模型：模型文件存在即说明分词器和池化配置已就绪。
+
+        Args:
+            model: SentenceTransformer模型
+            quantize: 是否额外生成int8动态量化模型
+        """
+        os.makedirs(self.export_dir, exist_ok=True)
+        tmp_dir = f"{self.export_dir}.tmp-{os.getpid()}-{id(self)}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            self._export_to(model, quantize, tmp_dir)
+
+            model_files = [name for name in (self.MODEL_FILE, self.QUANTIZED_MODEL_FILE)
+                           if os.path.exists(os.path.join(tmp_dir, name))]
+            other_files = [name for name in os.listdir(tmp_dir) if name not in model_files]
+            for name in other_files + model_files:
+                os.replace(os.path.join(tmp_dir, name), os.path.join(self.export_dir, name))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _export_to(self, model, quantize, export_dir):
+        """导出ONNX模型、分词器和池化配置到指定目录"""
+        import torch
+        from sentence_transformers import models as st_models
+
+        logger.info(f"开始导出ONNX模型到 {self.export_dir}")
+        start_time = time.time()
+
+        transformer = model[0]
+        auto_model = transformer.auto_model
+        auto_model.eval()
+
+        # 池化方式和归一化设置与SentenceTransformer保持一致，确保向量可与torch后端互换
+        pooling_module = next((module for module in model if isinstance(module, st_models.Pooling)), None)
+        pooling = {
+            "mode": 'cls' if pooling_module is not None and pooling_module.pooling_mode_cls_token else 'mean',
+            "normalize": any(isinstance(module, st_models.Normalize) for module in model),
+            "max_seq_length": model.max_seq_length
+        }
+
+        dummy = transformer.tokenizer(["导出示例 export sample"], return_tensors='pt', padding=True)
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+        model_path = os.path.join(export_dir, self.MODEL_FILE)
+        with torch.no_grad():
+            torch.onnx.export(
+                auto_model,
+                tuple(dummy[name] for name in input_names),
+                model_path,
+                input_names=input_names,
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(
+                model_path,
+                os.path.join(export_dir, self.QUANTIZED_MODEL_FILE),
+                weight_type=QuantType.QInt8
+            )
+
+        transformer.tokenizer.save_pretrained(export_dir)
+        with open(os.path.join(export_dir, self.POOLING_FILE), 'w', encoding='utf-8') as f:
+            json.dump(pooling, f)
+
+        logger.info(f"ONNX模型导出完成，耗时: {time.time() - start_time:.2f}秒")
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        """向量化文本
+
+        Args:
+            texts: 文本列表
+            batch_size: 批大小
+            show_progress_bar: 为兼容SentenceTransformer接口保留，ONNX后端不显示进度条
+
+        Returns:
+            float32向量矩阵
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+
+        # 按长度排序后分批，减少padding带来的无效计算
+        order = np.argsort([-len(text) for text in texts])
+        results = [None] * len(texts)
+
+        for start in range(0, len(texts), batch_size):
+            batch_ids = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch_ids],
+                padding=True,
+                truncation=True,
+                max_length=self.pooling['max_seq_length'],
+                return_tensors='np'
+            )
+            feeds = {name: encoded[name].astype('int64') for name in self.input_names if name in encoded}
+            hidden_state = self.session.run(None, feeds)[0]
+
+            if self.pooling['mode'] == 'cls':
+                embeddings = hidden_state[:, 0]
+            else:
+                mask = encoded['attention_mask'][..., None].astype('float32')
+                embeddings = (hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+            if self.pooling['normalize']:
+                embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+            for row, i in enumerate(batch_ids):
+                results[i] = embeddings[row]
+
+        return np.vstack(results).astype('float32')
+
+
+def benchmark_backends(torch_backend, onnx_backend, texts, batch_size=32, repeats=3):
+    """比较两个后端的吞吐量和向量一致性
+
+    Args:
+        torch_backend: torch后端
+        onnx_backend: onnx后端
+        texts: 测试文本列表
+        batch_size: 批大小
+        repeats: 重复次数，取最快的一次
+
+    Returns:
+        包含各后端吞吐量(文本/秒)和余弦相似度统计的字典
+    """
+    def measure(backend):
+        backend.encode(texts[:batch_size], batch_size=batch_size)  # 预热
+        best = None
+        embeddings = None
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            embeddings = backend.encode(texts, batch_size=batch_size)
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        return embeddings, round(len(texts) / best, 1)
+
+    torch_embeddings, torch_throughput = measure(torch_backend)
+    onnx_embeddings, onnx_throughput = measure(onnx_backend)
+
+    def normalize(matrix):
+        return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    cosine = np.einsum('ij,ij->i', normalize(torch_embeddings), normalize(onnx_embeddings))
+    return {
+        "texts": len(texts),
+        "torch_texts_per_second": torch_throughput,
+        f"{onnx_backend.backend}_texts_per_second": onnx_throughput,
+        "speedup": round(onnx_throughput / torch_throughput, 2),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5)
+    }
+
+
+if __name__ == "__main__":
+    from app.config import get_config
+    from app.services.embedding_model_registry import get_embedding_model
+
+    parser = argparse.ArgumentParser(description="torch与ONNX向量化后端吞吐量及一致性对比")
+    parser.add_argument("--texts", help="测试文本文件，每行一条，不提供时使用内置示例")
+    parser.add_argument("--count", type=int, default=512, help="内置示例文本数量")
+    parser.add_argument("--batch-size", type=int, default=32, help="批大小")
+    parser.add_argument("--no-quantize", action="store_true", help="使用未量化的float32 ONNX模型")
+    args = parser.parse_args()
+
+    config = get_config()
+    model_name = config.EMBEDDING_MODEL
+
+    if args.texts:
+        with open(args.texts, 'r', encoding='utf-8') as f:
+            sample_texts = [line.strip() for line in f if line.strip()]
+    else:
+        sample_texts = [
+            f"需求{i}：用户在登录页面输入手机号和验证码后，系统应在3秒内完成校验并跳转到资产页面，"
+            f"验证码错误{i % 5 + 1}次后锁定账户。The system shall log every failed attempt #{i}."
+            for i in range(args.count)
+        ]
+
+    torch_model = get_embedding_model(model_name)
+    torch_backend = TorchEmbeddingBackend(torch_model, model_name, num_threads=config.EMBEDDING_NUM_THREADS)
+    onnx_backend = OnnxEmbeddingBackend(
+        model_name,
+        config.EMBEDDING_ONNX_DIR,
+        quantize=not args.no_quantize,
+        num_threads=config.EMBEDDING_NUM_THREADS,
+        load_torch_model=lambda: torch_model
+    )
+
+    result = benchmark_backends(torch_backend, onnx_backend, sample_texts, batch_size=args.batch_size)
+    logger.info("\n" + json.dumps(result, indent=2, ensure_ascii=False))
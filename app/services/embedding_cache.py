@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import numpy as np
+from app.config import get_config
+from app.utils.logger import get_logger
+from app.utils.sqlite_cache import SQLiteLRUCache
+
+# 获取日志记录器
+logger = get_logger('embedding_cache')
+
+class EmbeddingCache:
+    """文本块向量缓存，按(模型名称, 文本哈希)寻址
+
+    同一产品线的需求文档大量段落相同，缓存命中的文本块无需再次调用模型。
+    """
+
+    def __init__(self, path, max_entries=200000):
+        """初始化向量缓存
+
+        Args:
+            path: 缓存文件路径
+            max_entries: 最大缓存向量数
+        """
+        self.store = SQLiteLRUCache(path, max_entries=max_entries)
+
+    @staticmethod
+    def make_key(model_name, text):
+        """计算缓存键
+
+        Args:
+            model_name: 向量模型名称
+            text: 文本块
+
+        Returns:
+            缓存键
+        """
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{model_name}:{text_hash}"
+
+    def get_many(self, model_name, texts):
+        """批量读取文本向量
+
+        Args:
+            model_name: 向量模型名称
+            texts: 文本列表
+
+        Returns:
+            与texts一一对应的向量列表，未命中的位置为None
+        """
+        keys = [self.make_key(model_name, text) for text in texts]
+        values = self.store.get_many(keys)
+        return [np.frombuffer(value, dtype='float32') if value is not None else None for value in values]
+
+    def put_many(self, model_name, texts, embeddings):
+        """批量写入文本向量
+
+        Args:
+            model_name: 向量模型名称
+            texts: 文本列表
+            embeddings: 与texts一一对应的向量矩阵
+        """
+        embeddings = np.asarray(embeddings, dtype='float32')
+        items = [
+            (self.make_key(model_name, text), embeddings[i].tobytes())
+            for i, text in enumerate(texts)
+        ]
+        self.store.put_many(items)
+
+    def stats(self):
+        """获取缓存命中统计"""
+        return self.store.stats()
+
+
+# 进程内共享的向量缓存实例
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """获取进程内共享的向量缓存实例
+
+    Returns:
+        EmbeddingCache实例，未启用或初始化失败时返回None
+    """
+    global _embedding_cache
+
+    config = get_config()
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return None
+
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                try:
+                    _embedding_cache = EmbeddingCache(
+                        config.EMBEDDING_CACHE_PATH,
+                        max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES
+                    )
+                    logger.info(f"向量缓存初始化完成: {config.EMBEDDING_CACHE_PATH}")
+                except Exception as e:
+                    logger.error(f"向量缓存初始化失败，将直接调用模型: {str(e)}")
+                    return None
+
+    return _embedding_cache
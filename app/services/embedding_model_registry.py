@@ -0,0 +1,285 @@
+"""
+进程级共享的向量模型注册表
+SentenceTransformer模型和向量化后端在每个进程中只加载一次，所有VectorStoreService实例共享，
+各实例只保存自己的索引和文档状态
+"""
+import os
+import time
+import threading
+import traceback
+import torch
+from sentence_transformers import SentenceTransformer
+from app.config import get_config
+from app.utils.logger import get_logger
+from .embedding_backends import BACKEND_TYPES, TorchEmbeddingBackend, OnnxEmbeddingBackend
+
+# 获取日志记录器
+logger = get_logger('embedding_model_registry')
+
+# 已加载的模型，按模型名称索引
+_models = {}
+
+# 加载失败的模型及错误信息，避免每个请求都重复尝试
+_load_errors = {}
+
+# 已创建的向量化后端，按(后端类型, 模型名称, 线程数)索引
+_backends = {}
+
+_registry_lock = threading.RLock()
+
+def get_embedding_model(model_name=None):
+    """获取进程内共享的向量模型，首次调用时加载
+    
+    Args:
+        model_name: Sentence Transformer模型名称，默认使用配置中的EMBEDDING_MODEL
+        
+    Returns:
+        SentenceTransformer模型实例
+    """
+    model_name = model_name or get_config().EMBEDDING_MODEL
+    
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    
+    with _registry_lock:
+        if model_name in _models:
+            return _models[model_name]
+        
+        # 如果之前已经尝试初始化但失败了，直接抛出之前的错误
+        if model_name in _load_errors:
+            raise RuntimeError(f"SentenceTransformer初始化失败: {_load_errors[model_name]}")
+        
+        start_time = time.time()
+        try:
+            model = _load_sentence_transformer(model_name)
+        except Exception as e:
+            _load_errors[model_name] = str(e)
+            raise
+        
+        _models[model_name] = model
+        logger.info(f"向量模型 {model_name} 加载完成，耗时: {time.time() - start_time:.2f}秒")
+        return model
+
+def get_embedding_backend(model_name=None, backend=None, num_threads=None):
+    """获取进程内共享的向量化后端，首次调用时创建
+    
+    Args:
+        model_name: Sentence Transformer模型名称，默认使用配置中的EMBEDDING_MODEL
+        backend: 后端类型（torch或onnx），默认使用配置中的EMBEDDING_BACKEND
+        num_threads: 计算线程数，默认使用配置中的EMBEDDING_NUM_THREADS
+        
+    Returns:
+        提供encode(texts, batch_size, show_progress_bar)接口的后端实例
+    """
+    config = get_config()
+    model_name = model_name or config.EMBEDDING_MODEL
+    backend = backend or config.EMBEDDING_BACKEND
+    num_threads = config.EMBEDDING_NUM_THREADS if num_threads is None else num_threads
+    
+    if backend not in BACKEND_TYPES:
+        raise ValueError(f"不支持的向量化后端: {backend}，可选值: {', '.join(BACKEND_TYPES)}")
+    
+    # 线程数不同的后端（如工作进程按核数分配的线程数）分别创建，模型本身仍只加载一次
+    key = (backend, model_name, num_threads)
+    instance = _backends.get(key)
+    if instance is not None:
+        return instance
+    
+    with _registry_lock:
+        if key in _backends:
+            return _backends[key]
+        
+        error_key = f"{backend}:{model_name}:{num_threads}"
+        if error_key in _load_errors:
+            raise RuntimeError(f"向量化后端初始化失败: {_load_errors[error_key]}")
+        
+        try:
+            if backend == 'onnx':
+                instance = OnnxEmbeddingBackend(
+                    model_name,
+                    config.EMBEDDING_ONNX_DIR,
+                    quantize=config.EMBEDDING_ONNX_QUANTIZE,
+                    num_threads=num_threads,
+                    load_torch_model=lambda: get_embedding_model(model_name)
+                )
+            else:
+                instance = TorchEmbeddingBackend(
+                    get_embedding_model(model_name),
+                    model_name,
+                    num_threads=num_threads
+                )
+        except Exception as e:
+            _load_errors[error_key] = str(e)
+            raise
+        
+        _backends[key] = instance
+        logger.info(f"向量化后端 {instance.model_id} 已就绪")
+        return instance
+
+def warm_up(model_name=None):
+    """预加载向量化后端并执行一次向量化，应用启动时调用，避免首个用户请求承担模型加载延迟
+    
+    Args:
+        model_name: Sentence Transformer模型名称，默认使用配置中的EMBEDDING_MODEL
+        
+    Returns:
+        预热是否成功
+    """
+    try:
+        start_time = time.time()
+        backend = get_embedding_backend(model_name)
+        backend.encode(["warm up"], show_progress_bar=False)
+        logger.info(f"向量模型预热完成，耗时: {time.time() - start_time:.2f}秒")
+        return True
+    except Exception as e:
+        logger.error(f"向量模型预热失败: {str(e)}")
+        return False
+
+def get_loaded_models():
+    """获取当前进程已就绪的向量化后端列表"""
+    return [instance.model_id for instance in _backends.values()]
+
+def _load_sentence_transformer(model_name):
+    """依次尝试多种方案加载SentenceTransformer模型，规避meta tensor等设备问题
+    
+    Args:
+        model_name: Sentence Transformer模型名称
+    
+    Returns:
+        SentenceTransformer模型实例
+    """
+    # 明确指定设备为CPU，避免meta tensor问题
+    device = 'cpu'
+    
+    # 设置torch设备
+    torch.set_grad_enabled(False)  # 禁用梯度计算，减少内存使用
+    
+    logger.info("正在初始化SentenceTransformer模型...")
+    
+    # 使用明确的设备参数初始化模型
+    model_initialized = False
+    
+    # 尝试方案1：使用to_empty()方法（错误信息中明确推荐的方法）
+    if not model_initialized:
+        try:
+            logger.info("尝试方案1：使用to_empty()方法初始化...")
+            
+            # 先初始化模型，不指定设备
+            model = SentenceTransformer(model_name)
+            
+            # 使用to_empty()方法代替to()
+            try:
+                # 检查PyTorch版本
+                logger.info(f"PyTorch版本: {torch.__version__}")
+                
+                # 对于较新版本的PyTorch，使用to_empty
+                if hasattr(model, 'to_empty'):
+                    logger.info("检测到to_empty方法，尝试使用...")
+                    model = model.to_empty(device='cpu')
+                    model_initialized = True
+                    logger.info("使用to_empty()方法初始化成功")
+                else:
+                    # 如果to_empty不存在，尝试使用模块级别的to_empty
+                    logger.info("模型对象没有to_empty方法，尝试使用torch.nn.Module.to_empty...")
+                    if hasattr(torch.nn.Module, 'to_empty'):
+                        model = torch.nn.Module.to_empty(model, device='cpu')
+                        model_initialized = True
+                        logger.info("使用torch.nn.Module.to_empty()方法初始化成功")
+                    else:
+                        logger.warning("to_empty()方法不存在，尝试其他方法...")
+            except AttributeError as ae:
+                # 如果to_empty不存在，说明PyTorch版本较旧，继续尝试其他方法
+                logger.warning(f"to_empty()方法不存在: {str(ae)}")
+                logger.warning("尝试其他方法...")
+        
+        except Exception as e:
+            logger.error(f"使用to_empty()方法初始化失败: {str(e)}")
+            logger.error(f"错误详情: {traceback.format_exc()}")
+    
+    # 尝试方案2：添加额外的配置参数，避免meta tensor问题
+    if not model_initialized:
+        try:
+            logger.info("尝试方案2：使用device参数初始化...")
+            torch.set_default_tensor_type(torch.FloatTensor)  # 确保默认tensor类型正确
+            
+            # 尝试初始化模型
+            model = SentenceTransformer(model_name, device=device)
+            
+            # 标记为成功初始化
+            model_initialized = True
+            logger.info("使用device参数初始化成功")
+        
+        except Exception as e:
+            logger.error(f"使用device参数初始化失败: {str(e)}")
+            logger.error(f"错误详情: {traceback.format_exc()}")
+    
+    # 尝试方案3：使用torch.device
+    if not model_initialized:
+        try:
+            logger.info("尝试方案3：使用torch.device初始化...")
+            torch_device = torch.device('cpu')
+            model = SentenceTransformer(model_name, device=torch_device)
+            model_initialized = True
+            logger.info("使用torch.device初始化成功")
+        
+        except Exception as e2:
+            logger.error(f"使用torch.device初始化失败: {str(e2)}")
+            logger.error(f"错误详情: {traceback.format_exc()}")
+    
+    # 尝试方案4：先初始化，然后使用自定义to方法
+    if not model_initialized:
+        try:
+            logger.info("尝试方案4：使用自定义to方法...")
+            
+            # 先不指定设备参数初始化
+            model = SentenceTransformer(model_name)
+            
+            # 自定义to方法，避免使用内置的to方法
+            def custom_to(module, device):
+                # 遍历模块的所有参数和缓冲区，手动将它们移动到指定设备
+                for param in module.parameters():
+                    if hasattr(param, 'data'):
+                        param.data = param.data.to(device)
+                for buf in module.buffers():
+                    if hasattr(buf, 'data'):
+                        buf.data = buf.data.to(device)
+                return module
+            
+            # 使用自定义to方法
+            model = custom_to(model, 'cpu')
+            model_initialized = True
+            logger.info("使用自定义to方法初始化成功")
+        
+        except Exception as e3:
+            logger.error(f"使用自定义to方法初始化失败: {str(e3)}")
+            logger.error(f"错误详情: {traceback.format_exc()}")
+    
+    # 尝试方案5：完全禁用cuda，使用纯CPU模式
+    if not model_initialized:
+        try:
+            logger.info("尝试方案5：完全禁用CUDA，使用纯CPU模式...")
+            
+            # 禁用CUDA
+            os.environ["CUDA_VISIBLE_DEVICES"] = ""
+            torch.set_num_threads(1)
+            
+            # 重新初始化模型
+            model = SentenceTransformer(model_name)
+            model_initialized = True
+            logger.info("使用纯CPU模式初始化成功")
+        
+        except Exception as e4:
+            # 所有尝试都失败，记录错误并抛出
+            error_msg = f"所有SentenceTransformer初始化尝试均失败: {str(e4)}"
+            logger.error(error_msg)
+            logger.error(f"错误详情: {traceback.format_exc()}")
+            raise RuntimeError(error_msg)
+    
+    if not model_initialized:
+        # 这种情况理论上不会发生，因为如果所有初始化方法都失败，前面会抛出异常
+        error_msg = "模型初始化失败，但没有抛出异常，这是一个意外情况"
+        logger.error(error_msg)
+        raise RuntimeError(error_msg)
+    
+    return model
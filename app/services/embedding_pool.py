@@ -0,0 +1,126 @@
+"""
+多进程向量化工作池
+长文档（如数百页的PDF）切分出的大量文本块按顺序分片，分发到多个进程并行向量化，再按原顺序拼接
+默认使用spawn启动工作进程，每个工作进程在初始化时自行加载模型。
+工作池在请求线程中按需创建，此时父进程已有调度线程和torch/OpenMP线程池，fork出的子进程可能继承被其他线程持有的锁而卡死
+"""
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from app.config import get_config
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('embedding_pool')
+
+# 工作进程内的向量化后端
+_worker_backend = None
+
+def _init_worker(model_name, backend, num_threads):
+    """工作进程初始化：在本进程中加载模型并创建独立的向量化后端"""
+    global _worker_backend
+    from . import embedding_model_registry
+
+    _worker_backend = embedding_model_registry.get_embedding_backend(model_name, backend, num_threads=num_threads)
+
+def _encode_shard(texts, batch_size):
+    """在工作进程中向量化一个分片"""
+    return _worker_backend.encode(texts, batch_size=batch_size)
+
+
+class EmbeddingPool:
+    """多进程向量化工作池，进程常驻，模型只在进程启动时加载一次"""
+
+    def __init__(self, model_name, backend, workers, start_method='spawn'):
+        """初始化工作池
+
+        Args:
+            model_name: 向量模型名称
+            backend: 向量化后端类型
+            workers: 工作进程数
+            start_method: 进程启动方式，spawn或forkserver
+        """
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers
+        # 每个进程分到的计算线程数，避免多进程同时满核运行导致线程争抢
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(model_name, backend, self.threads_per_worker)
+        )
+        logger.info(f"向量化工作池已启动，进程数: {workers}，每进程线程数: {self.threads_per_worker}，启动方式: {start_method}")
+
+    def encode(self, texts, batch_size=32):
+        """按顺序分片并行向量化
+
+        Args:
+            texts: 文本列表
+            batch_size: 每个进程内的批大小
+
+        Returns:
+            float32向量矩阵，行顺序与texts一致
+        """
+        # 分片数取进程数的两倍，长短不一的分片可以更均匀地分摊到各进程
+        shard_count = min(len(texts), self.workers * 2)
+        shard_size = -(-len(texts) // shard_count)
+        shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+
+        logger.info(f"多进程向量化 {len(texts)} 个文本，分为 {len(shards)} 个分片")
+
+        # executor.map按提交顺序返回结果
+        results = self.executor.map(_encode_shard, shards, [batch_size] * len(shards))
+        return np.vstack(list(results)).astype('float32')
+
+    def shutdown(self):
+        """关闭工作池"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 进程内共享的工作池，按(后端类型, 模型名称)索引
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_embedding_pool(model_name=None, backend=None):
+    """获取进程内共享的向量化工作池
+
+    Args:
+        model_name: 向量模型名称，默认使用配置中的EMBEDDING_MODEL
+        backend: 向量化后端类型，默认使用配置中的EMBEDDING_BACKEND
+
+    Returns:
+        EmbeddingPool实例，工作进程数不足2时返回None
+    """
+    config = get_config()
+    workers = config.EMBEDDING_POOL_WORKERS or (os.cpu_count() or 1)
+    if workers < 2:
+        return None
+
+    model_name = model_name or config.EMBEDDING_MODEL
+    backend = backend or config.EMBEDDING_BACKEND
+    key = (backend, model_name)
+
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = EmbeddingPool(model_name, backend, workers, config.EMBEDDING_POOL_START_METHOD)
+        return _pools[key]
+
+def reset_embedding_pool(model_name=None, backend=None):
+    """丢弃已损坏的工作池（如工作进程被系统杀死），下次使用时重新创建"""
+    config = get_config()
+    key = (backend or config.EMBEDDING_BACKEND, model_name or config.EMBEDDING_MODEL)
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+    if pool is not None:
+        pool.shutdown()
+
+@atexit.register
+def _shutdown_pools():
+    """进程退出时关闭所有工作池"""
+    for pool in list(_pools.values()):
+        pool.shutdown()
@@ -0,0 +1,194 @@
+"""
+向量化微批调度器
+多个用户同时上传文档时，各请求线程分别以小批量调用encode，模型的批处理能力得不到利用，
+线程之间还会争抢GIL和torch计算线程。调度器把短时间窗口内的encode请求合并为一个批次，
+由单个后台线程统一调用模型，再把结果按调用方切片返回。
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+from app.config import get_config
+from app.utils.logger import get_logger
+from .embedding_model_registry import get_embedding_backend
+
+# 获取日志记录器
+logger = get_logger('embedding_scheduler')
+
+class _EncodeRequest:
+    """一次待合并的encode调用"""
+
+    __slots__ = ('texts', 'future', 'enqueued_at')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingScheduler:
+    """将并发的encode调用合并为批次执行的调度器"""
+
+    def __init__(self, backend, max_batch_size=256, max_wait_ms=5, batch_size=64):
+        """初始化调度器并启动后台线程
+
+        Args:
+            backend: 向量化后端
+            max_batch_size: 单个合并批次的最大文本数，单个请求超过该值时独立成批
+            max_wait_ms: 收到首个请求后等待其他请求加入的最长时间（毫秒）
+            batch_size: 调用模型时的批大小
+        """
+        self.backend = backend
+        self.model_id = backend.model_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue()
+        # 上一轮收集时超出批次上限、留到下一批的请求
+        self._carry = None
+
+        self._stats_lock = threading.Lock()
+        self._pending_texts = 0
+        self._max_queue_depth = 0
+        self._requests = 0
+        self._batches = 0
+        self._texts = 0
+        self._wait_seconds = 0.0
+        self._encode_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=f"embedding-scheduler-{self.model_id}", daemon=True)
+        self._thread.start()
+        logger.info(f"向量化微批调度器已启动: {self.model_id}，最大批次: {max_batch_size}，最长等待: {max_wait_ms}ms")
+
+    def encode(self, texts):
+        """提交文本并等待向量化结果
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            float32向量矩阵，行顺序与texts一致
+        """
+        request = _EncodeRequest(list(texts))
+        with self._stats_lock:
+            self._requests += 1
+            self._pending_texts += len(request.texts)
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize() + 1)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _collect(self):
+        """收集一个批次：阻塞等待首个请求，然后在等待窗口内继续合并，直到达到批次上限
+
+        Returns:
+            请求列表
+        """
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+
+        batch = [first]
+        total = len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+
+        while total < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            if total + len(request.texts) > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            total += len(request.texts)
+
+        return batch
+
+    def _run(self):
+        """后台线程主循环"""
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            started_at = time.perf_counter()
+
+            with self._stats_lock:
+                self._batches += 1
+                self._texts += len(texts)
+                self._pending_texts -= len(texts)
+                self._wait_seconds += sum(started_at - request.enqueued_at for request in batch)
+
+            try:
+                embeddings = np.asarray(self.backend.encode(texts, batch_size=self.batch_size), dtype='float32')
+            except Exception as e:
+                logger.error(f"合并批次向量化失败，涉及 {len(batch)} 个请求: {str(e)}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                with self._stats_lock:
+                    self._encode_seconds += time.perf_counter() - started_at
+
+            # 按提交顺序把结果切片返还给各调用方
+            offset = 0
+            for request in batch:
+                request.future.set_result(embeddings[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+    def stats(self):
+        """获取队列深度和合并效果统计"""
+        with self._stats_lock:
+            return {
+                "model": self.model_id,
+                "queue_depth": self._queue.qsize() + (1 if self._carry is not None else 0),
+                "pending_texts": self._pending_texts,
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": self._batches,
+                "texts": self._texts,
+                "avg_requests_per_batch": round(self._requests / self._batches, 2) if self._batches else 0,
+                "avg_batch_size": round(self._texts / self._batches, 1) if self._batches else 0,
+                "avg_wait_ms": round(self._wait_seconds * 1000 / self._requests, 2) if self._requests else 0,
+                "encode_seconds": round(self._encode_seconds, 3)
+            }
+
+
+# 进程内共享的调度器，按(后端类型, 模型名称)索引
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_embedding_scheduler(model_name=None, backend=None):
+    """获取进程内共享的向量化微批调度器
+
+    Args:
+        model_name: 向量模型名称，默认使用配置中的EMBEDDING_MODEL
+        backend: 向量化后端类型，默认使用配置中的EMBEDDING_BACKEND
+
+    Returns:
+        EmbeddingScheduler实例，未启用时返回None
+    """
+    config = get_config()
+    if not config.EMBEDDING_MICROBATCH_ENABLED:
+        return None
+
+    model_name = model_name or config.EMBEDDING_MODEL
+    backend = backend or config.EMBEDDING_BACKEND
+    key = (backend, model_name)
+
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = EmbeddingScheduler(
+                get_embedding_backend(model_name, backend),
+                max_batch_size=config.EMBEDDING_MICROBATCH_MAX_SIZE,
+                max_wait_ms=config.EMBEDDING_MICROBATCH_MAX_WAIT_MS,
+                batch_size=config.EMBEDDING_BATCH_SIZE
+            )
+        return _schedulers[key]
+
+def get_scheduler_stats():
+    """获取所有调度器的统计信息"""
+    return [scheduler.stats() for scheduler in list(_schedulers.values())]
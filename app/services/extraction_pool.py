@@ -0,0 +1,311 @@
+"""
+多文件并行解析
+一次上传多个文件时，PDF解析和OCR都是CPU密集型操作，逐个文件解析时总耗时是所有文件之和。
+多文件上传中的PDF分发到进程池中并行解析，其他类型的文件和单文件上传在当前进程中解析，结果按上传顺序返回。
+进程池在进程内只创建一次，由所有上传任务共享，工作进程按需启动并一直保留，OCR引擎在工作进程首次遇到需要OCR的PDF时才加载。
+进程池以spawn方式启动：上传任务在多线程的父进程中执行，fork出的子进程可能继承被其他线程持有的锁而卡死。
+主进程监控每个文件的解析时间和工作进程的常驻内存，超过上限时强制结束对应的工作进程并跳过该文件，
+进程池随之失效，同时在解析的其他文件在新的进程池中重新解析。
+工作进程意外退出（如解析库崩溃）时无法确定是哪个文件导致的，同时在解析的文件逐个单独重新解析，
+只有进程池中只解析过这一个文件时仍然退出、或多次遇到进程意外退出的文件记为失败。
+"""
+import os
+import time
+import signal
+import atexit
+import itertools
+import threading
+import multiprocessing
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from app.config import get_config
+from app.utils.logger import get_logger
+
+try:
+    import psutil
+except ImportError:  # 未安装psutil时无法监控工作进程内存
+    psutil = None
+
+# 获取日志记录器
+logger = get_logger('extraction_pool')
+
+# 主进程检查解析时间和内存的间隔（秒）
+MONITOR_INTERVAL = 0.5
+
+# 同一文件最多经历的进程意外退出次数，超过后记为失败；其他上传任务共用进程池时无法单独解析，避免反复重试
+MAX_CRASH_RETRIES = 3
+
+# 工作进程内的文档服务，以及通知主进程文件开始解析的队列
+_worker_service = None
+_worker_started = None
+
+def _init_worker(started_queue):
+    """工作进程初始化：创建本进程的DocumentService，OCR引擎在首次需要时才加载"""
+    global _worker_service, _worker_started
+    from app.services.document_service import DocumentService
+
+    _worker_service = DocumentService()
+    _worker_started = started_queue
+
+def _extract_in_worker(task_id, file_path, file_type):
+    """在工作进程中解析单个文件，开始前把任务编号和本进程PID发给主进程，以便超限时结束对应的进程"""
+    _worker_started.put((task_id, os.getpid()))
+    return _worker_service.process_document(file_path, file_type)
+
+def _kill(pid):
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except OSError:
+        pass
+
+
+class ExtractionPool:
+    """多文件并行解析，每个文件的解析时间和工作进程的常驻内存受上限约束"""
+
+    def __init__(self, service, workers=None, timeout=None, memory_limit_mb=None, start_method='spawn'):
+        """初始化解析池
+
+        Args:
+            service: DocumentService实例，用于在当前进程中解析文件
+            workers: 同时解析的文件数，默认使用配置中的EXTRACTION_WORKERS，0表示在当前进程中逐个解析
+            timeout: 单个文件的解析时间上限（秒），默认使用配置中的EXTRACTION_TIMEOUT
+            memory_limit_mb: 工作进程的常驻内存上限（MB），默认使用配置中的EXTRACTION_MEMORY_LIMIT_MB
+            start_method: 进程启动方式，spawn或forkserver
+        """
+        config = get_config()
+        self.service = service
+        self.workers = config.EXTRACTION_WORKERS if workers is None else workers
+        self.timeout = config.EXTRACTION_TIMEOUT if timeout is None else timeout
+        self.memory_limit_mb = config.EXTRACTION_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        self.start_method = start_method
+        self.use_processes = self.workers > 0
+        if self.memory_limit_mb and psutil is None:
+            logger.warning("未安装psutil，无法监控解析进程内存，EXTRACTION_MEMORY_LIMIT_MB不生效")
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._started_queue = None
+        self._generation = 0          # 进程池每次重建后加1，用于区分任务属于哪一个进程池
+        self._killed_generations = set()  # 因超限结束过工作进程的进程池，其失效原因是已知的
+        self._submitted = Counter()   # 进程池编号 -> 提交过的任务数
+        self._started = {}            # 已提交的任务编号 -> (工作进程PID, 开始解析时间)，未开始时为None
+        self._task_ids = itertools.count()
+
+    def _acquire(self):
+        """获取当前进程池，不存在时创建，返回(进程池, 进程池编号)"""
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._started_queue = context.Queue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._started_queue,)
+                )
+                self._generation += 1
+            return self._executor, self._generation
+
+    def _retire(self, generation):
+        """丢弃已失效的进程池，下次提交时重新创建；其他上传任务已重建过时直接返回"""
+        with self._lock:
+            if generation != self._generation or self._executor is None:
+                return
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._started_queue = None
+
+    def _poll_started(self):
+        """读取工作进程发出的开始解析通知，记录每个任务的工作进程和开始时间"""
+        with self._lock:
+            if self._started_queue is None:
+                return
+            while not self._started_queue.empty():
+                task_id, pid = self._started_queue.get()
+                if task_id in self._started:
+                    self._started[task_id] = (pid, time.monotonic())
+
+    def _exceeded_limit(self, pid, started_at):
+        """检查正在解析的文件是否超时或工作进程内存超限，返回错误信息或None"""
+        if self.timeout and time.monotonic() - started_at > self.timeout:
+            return f"解析超时（超过 {self.timeout} 秒）"
+        if self.memory_limit_mb and psutil is not None:
+            try:
+                rss = psutil.Process(pid).memory_info().rss
+            except psutil.Error:
+                return None
+            if rss > self.memory_limit_mb * 1024 * 1024:
+                return f"内存占用超过上限 {self.memory_limit_mb}MB"
+        return None
+
+    def extract_all(self, files, on_file_done=None):
+        """解析多个文件，多文件上传中的PDF在进程池中并行解析，其他文件在当前进程中解析
+
+        Args:
+            files: (文件路径, 文件类型)列表
+            on_file_done: 每个文件解析结束后的回调函数，参数为(文件下标, 已完成数量, 错误信息或None)
+
+        Returns:
+            与files一一对应的(文档文本, 错误信息)列表，解析失败时文档文本为None
+        """
+        results = [None] * len(files)
+        completed = 0
+
+        def finish(index, document_text, error, start):
+            nonlocal completed
+            results[index] = (document_text, error)
+            completed += 1
+            file_name = os.path.basename(files[index][0])
+            if error:
+                logger.error(f"文档解析失败: {file_name}: {error}")
+            else:
+                logger.info(f"文档解析完成: {file_name}，耗时: {time.monotonic() - start:.2f}秒")
+            if on_file_done is not None:
+                on_file_done(index, completed, error)
+
+        # 只有多文件上传中的PDF值得付出进程间传输的开销，其他文件直接在当前进程中解析
+        pooled = []
+        if self.use_processes and len(files) > 1:
+            pooled = [index for index, (_, file_type) in enumerate(files) if file_type == 'pdf']
+        local = [index for index in range(len(files)) if index not in pooled]
+
+        workers = min(self.workers, len(pooled))
+        pending = deque(pooled)
+        suspects = set()   # 工作进程意外退出时正在解析、需要单独重新解析的文件下标
+        crashes = Counter()  # 文件下标 -> 解析时遇到进程意外退出的次数
+        running = {}      # future -> (文件下标, 任务编号, 进程池编号)
+        submitted_at = {}  # 文件下标 -> 提交时间
+
+        def submit():
+            """提交待解析的文件，同时解析的文件数不超过进程数；可疑文件单独解析"""
+            while pending and len(running) < workers:
+                indexes = {index for index, _, _ in running.values()}
+                if suspects & indexes or (pending[0] in suspects and running):
+                    break
+                executor, generation = self._acquire()
+                index = pending[0]
+                task_id = next(self._task_ids)
+                self._started[task_id] = None
+                try:
+                    future = executor.submit(_extract_in_worker, task_id, *files[index])
+                except (BrokenProcessPool, RuntimeError):
+                    # 进程池刚被其他上传任务结束了工作进程或关闭，重建后再提交
+                    self._started.pop(task_id, None)
+                    self._retire(generation)
+                    continue
+                pending.popleft()
+                with self._lock:
+                    self._submitted[generation] += 1
+                running[future] = (index, task_id, generation)
+                submitted_at.setdefault(index, time.monotonic())
+
+        def settle(future, error):
+            """记录已结束任务的结果"""
+            index, task_id, _ = running.pop(future)
+            self._started.pop(task_id, None)
+            if error is not None:
+                finish(index, None, str(error), submitted_at[index])
+            else:
+                finish(index, future.result(), None, submitted_at[index])
+
+        try:
+            # 先提交PDF，工作进程解析的同时在当前进程中解析其他文件
+            submit()
+            for index in local:
+                file_path, file_type = files[index]
+                start = time.monotonic()
+                try:
+                    finish(index, self.service.process_document(file_path, file_type), None, start)
+                except Exception as e:
+                    finish(index, None, str(e), start)
+
+            while running or pending:
+                submit()
+                done, _ = wait(running, timeout=MONITOR_INTERVAL, return_when=FIRST_COMPLETED)
+                self._poll_started()
+
+                broken = set()  # 已失效的进程池编号
+                for future in done:
+                    error = future.exception()
+                    if isinstance(error, BrokenProcessPool):
+                        broken.add(running[future][2])
+                    else:
+                        settle(future, error)
+
+                # 超时或内存超限的文件直接结束其工作进程，进程池随之失效
+                killed = {}  # 因超限被结束的文件下标 -> 错误信息
+                for index, task_id, generation in list(running.values()):
+                    state = self._started.get(task_id)
+                    if generation in broken or state is None:
+                        continue
+                    error = self._exceeded_limit(*state)
+                    if error:
+                        killed[index] = error
+                        broken.add(generation)
+                        with self._lock:
+                            self._killed_generations.add(generation)
+                        _kill(state[0])
+
+                # 进程池失效后其中所有未完成的任务都会失败：超限的文件记为失败，其他文件在新的进程池中重新解析
+                for generation in broken:
+                    unexplained = generation not in self._killed_generations
+                    victims = [future for future, (_, _, g) in running.items() if g == generation]
+                    # 进程池可能同时在解析其他上传任务的文件，只有整个进程池只解析过这一个文件时才能确定是它导致的
+                    alone = self._submitted[generation] == 1
+                    retried = 0
+                    for future in victims:
+                        error = future.exception()
+                        if not isinstance(error, BrokenProcessPool):
+                            settle(future, error)
+                            continue
+                        index, task_id, _ = running.pop(future)
+                        self._started.pop(task_id, None)
+                        if index in killed:
+                            finish(index, None, killed[index], submitted_at[index])
+                        elif unexplained and (alone or crashes[index] + 1 >= MAX_CRASH_RETRIES):
+                            finish(index, None, "解析进程异常退出", submitted_at[index])
+                        else:
+                            if unexplained:
+                                crashes[index] += 1
+                                suspects.add(index)
+                            pending.appendleft(index)
+                            retried += 1
+                    self._retire(generation)
+                    if retried:
+                        logger.warning(f"解析进程池已失效，重新解析 {retried} 个文件")
+        finally:
+            for future, (_, task_id, _) in running.items():
+                future.cancel()
+                self._started.pop(task_id, None)
+
+        return results
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._started_queue = None
+
+
+# 进程内共享的解析池
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """获取进程内共享的解析池，工作进程在首次解析多个PDF时启动并一直保留"""
+    global _extraction_pool
+    if _extraction_pool is None:
+        with _extraction_pool_lock:
+            if _extraction_pool is None:
+                from app.services import document_service  # 全局实例，在当前进程中解析时使用
+                _extraction_pool = ExtractionPool(document_service)
+    return _extraction_pool
+
+@atexit.register
+def _shutdown_extraction_pool():
+    """进程退出时关闭解析池"""
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown()
@@ -0,0 +1,430 @@
+"""
+FAISS索引工厂，根据向量数量选择精确检索(Flat)或近似检索(IVF-Flat / HNSW)索引
+单文档场景使用精确检索，需求文档归档库规模增长后自动切换为近似检索
+可选int8标量量化(sq8)或乘积量化(pq)压缩向量存储，检索后用原始向量精确重排
+"""
+import time
+import argparse
+import numpy as np
+import faiss
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('index_factory')
+
+# 支持的索引类型
+INDEX_TYPES = ('auto', 'flat', 'ivf', 'hnsw')
+
+# 支持的向量量化方式
+QUANTIZATION_TYPES = ('none', 'sq8', 'pq')
+
+# IVF每个聚类中心至少需要的训练样本数（FAISS建议值）
+MIN_POINTS_PER_CENTROID = 39
+
+def index_params_from_config(config):
+    """从配置中读取索引参数
+
+    Args:
+        config: 配置类
+
+    Returns:
+        索引参数字典，可直接传给build_index
+    """
+    return {
+        "index_type": config.VECTOR_INDEX_TYPE,
+        "hnsw_min_vectors": config.VECTOR_HNSW_MIN_VECTORS,
+        "ivf_min_vectors": config.VECTOR_IVF_MIN_VECTORS,
+        "ivf_nlist": config.VECTOR_IVF_NLIST,
+        "ivf_nprobe": config.VECTOR_IVF_NPROBE,
+        "hnsw_m": config.VECTOR_HNSW_M,
+        "hnsw_ef_construction": config.VECTOR_HNSW_EF_CONSTRUCTION,
+        "hnsw_ef_search": config.VECTOR_HNSW_EF_SEARCH,
+        "train_sample_size": config.VECTOR_TRAIN_SAMPLE_SIZE,
+        "quantization": config.VECTOR_QUANTIZATION,
+        "pq_m": config.VECTOR_PQ_M,
+        "pq_nbits": config.VECTOR_PQ_NBITS
+    }
+
+def choose_index_type(n_vectors, index_type='auto', hnsw_min_vectors=5000, ivf_min_vectors=200000, **kwargs):
+    """根据向量数量选择索引类型
+
+    Args:
+        n_vectors: 向量数量
+        index_type: 配置的索引类型，auto表示按数量自动选择
+        hnsw_min_vectors: 自动模式下切换为HNSW的最小向量数
+        ivf_min_vectors: 自动模式下切换为IVF-Flat的最小向量数
+
+    Returns:
+        实际使用的索引类型：flat、ivf或hnsw
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选值: {', '.join(INDEX_TYPES)}")
+
+    if index_type != 'auto':
+        return index_type
+
+    if n_vectors >= ivf_min_vectors:
+        return 'ivf'
+    if n_vectors >= hnsw_min_vectors:
+        return 'hnsw'
+    return 'flat'
+
+def get_index_type(index):
+    """识别已有索引的类型
+
+    Args:
+        index: FAISS索引
+
+    Returns:
+        flat、ivf、hnsw（不区分是否量化），无法识别时返回other
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexFlatCodes):
+        return 'flat'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf'
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'other'
+
+def is_quantized(index):
+    """判断索引是否以有损压缩的方式存储向量，量化索引的检索结果需要精确重排
+
+    Args:
+        index: FAISS索引
+
+    Returns:
+        是否为量化索引
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return not isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+def index_bytes_per_vector(index):
+    """计算索引中平均每个向量占用的字节数（含索引结构开销）
+
+    Args:
+        index: FAISS索引
+
+    Returns:
+        每个向量的字节数
+    """
+    if index.ntotal == 0:
+        return 0.0
+    return round(len(faiss.serialize_index(index)) / index.ntotal, 1)
+
+def _default_pq_m(dimension):
+    """PQ子空间数的经验值：每个子空间约8维，且必须整除向量维度"""
+    pq_m = max(1, dimension // 8)
+    while dimension % pq_m:
+        pq_m -= 1
+    return pq_m
+
+def _resolve_quantization(n_vectors, quantization, pq_nbits):
+    """检查量化方式是否适用于当前向量数，PQ码本训练样本不足时退回sq8"""
+    if quantization not in QUANTIZATION_TYPES:
+        raise ValueError(f"不支持的量化方式: {quantization}，可选值: {', '.join(QUANTIZATION_TYPES)}")
+
+    if quantization == 'pq' and n_vectors < 2 ** pq_nbits:
+        logger.warning(f"向量数 {n_vectors} 不足以训练PQ码本，改用sq8量化")
+        return 'sq8'
+    return quantization
+
+def _default_nlist(n_vectors):
+    """IVF聚类中心数的经验值：约4*sqrt(n)，且保证每个中心有足够的训练样本"""
+    nlist = int(4 * np.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+def _train_sample(embeddings, sample_size):
+    """随机抽取训练样本，避免在全量数据上训练聚类"""
+    if len(embeddings) <= sample_size:
+        return embeddings
+    rng = np.random.default_rng(1234)
+    sample_ids = rng.choice(len(embeddings), size=sample_size, replace=False)
+    return embeddings[np.sort(sample_ids)]
+
+def build_index(embeddings, index_type='auto', hnsw_min_vectors=5000, ivf_min_vectors=200000,
+                ivf_nlist=0, ivf_nprobe=16, hnsw_m=32, hnsw_ef_construction=200, hnsw_ef_search=64,
+                train_sample_size=100000, quantization='none', pq_m=0, pq_nbits=8):
+    """创建索引并添加向量
+
+    Args:
+        embeddings: float32向量矩阵
+        index_type: 索引类型，auto表示按向量数量自动选择
+        hnsw_min_vectors: 自动模式下切换为HNSW的最小向量数
+        ivf_min_vectors: 自动模式下切换为IVF-Flat的最小向量数
+        ivf_nlist: IVF聚类中心数，0表示按向量数量自动计算
+        ivf_nprobe: IVF检索时访问的聚类数
+        hnsw_m: HNSW每个节点的邻居数
+        hnsw_ef_construction: HNSW构建时的候选集大小
+        hnsw_ef_search: HNSW检索时的候选集大小
+        train_sample_size: IVF/量化器训练最多使用的样本数
+        quantization: 向量量化方式，none、sq8（int8标量量化）或pq（乘积量化）
+        pq_m: PQ子空间数，0表示按向量维度自动计算
+        pq_nbits: PQ每个子空间的编码位数
+
+    Returns:
+        已添加全部向量的FAISS索引
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    n_vectors, dimension = embeddings.shape
+    actual_type = choose_index_type(n_vectors, index_type, hnsw_min_vectors, ivf_min_vectors)
+    quantization = _resolve_quantization(n_vectors, quantization, pq_nbits)
+    pq_m = pq_m or _default_pq_m(dimension)
+
+    # 向量太少时IVF无法训练，退回精确检索
+    if actual_type == 'ivf' and n_vectors < MIN_POINTS_PER_CENTROID:
+        logger.warning(f"向量数 {n_vectors} 不足以训练IVF索引，改用Flat索引")
+        actual_type = 'flat'
+
+    start_time = time.time()
+
+    if actual_type == 'ivf':
+        nlist = ivf_nlist or _default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatL2(dimension)
+        if quantization == 'sq8':
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit)
+        elif quantization == 'pq':
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        sample_size = max(train_sample_size, nlist * MIN_POINTS_PER_CENTROID)
+    elif actual_type == 'hnsw':
+        if quantization == 'sq8':
+            index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, hnsw_m)
+        elif quantization == 'pq':
+            index = faiss.IndexHNSWPQ(dimension, pq_m, hnsw_m, pq_nbits)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        index.hnsw.efConstruction = hnsw_ef_construction
+        sample_size = train_sample_size
+    else:
+        if quantization == 'sq8':
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        elif quantization == 'pq':
+            index = faiss.IndexPQ(dimension, pq_m, pq_nbits)
+        else:
+            index = faiss.IndexFlatL2(dimension)
+        sample_size = train_sample_size
+
+    # IVF聚类和量化器码本都需要在样本上训练
+    if not index.is_trained:
+        sample = _train_sample(embeddings, sample_size)
+        logger.info(f"训练{actual_type}索引（量化方式: {quantization}），训练样本数={len(sample)}")
+        index.train(sample)
+    index.add(embeddings)
+
+    apply_search_params(index, ivf_nprobe=ivf_nprobe, hnsw_ef_search=hnsw_ef_search)
+
+    logger.info(
+        f"{actual_type}索引创建完成（量化方式: {quantization}），向量数: {n_vectors}，"
+        f"每向量约 {index_bytes_per_vector(index)} 字节，耗时: {time.time() - start_time:.2f}秒"
+    )
+    return index
+
+def apply_search_params(index, ivf_nprobe=None, hnsw_ef_search=None, **kwargs):
+    """设置近似检索的查询参数，对Flat索引无影响
+
+    Args:
+        index: FAISS索引
+        ivf_nprobe: IVF检索时访问的聚类数
+        hnsw_ef_search: HNSW检索时的候选集大小
+    """
+    index_type = get_index_type(index)
+    index = faiss.downcast_index(index)
+    if index_type == 'ivf' and ivf_nprobe:
+        index.nprobe = min(ivf_nprobe, index.nlist)
+    elif index_type == 'hnsw' and hnsw_ef_search:
+        index.hnsw.efSearch = hnsw_ef_search
+
+def get_index_vectors(index):
+    """取出索引中保存的全部向量，用于索引类型切换时重建，量化索引取出的是有损解码后的向量
+
+    Args:
+        index: FAISS索引
+
+    Returns:
+        float32向量矩阵
+    """
+    if get_index_type(index) == 'ivf':
+        faiss.downcast_index(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def rerank_exact(query_vectors, indices, get_vectors, k):
+    """用原始向量重新计算候选结果的精确L2距离并排序
+
+    Args:
+        query_vectors: 查询向量矩阵
+        indices: 量化索引返回的候选ID矩阵，-1表示空位
+        get_vectors: 根据ID列表返回原始float32向量矩阵的函数
+        k: 每个查询保留的结果数量
+
+    Returns:
+        (距离矩阵, ID矩阵)，不足k个结果时以inf和-1填充
+    """
+    candidate_ids = sorted(set(int(i) for i in np.unique(indices) if i >= 0))
+    out_distances = np.full((len(query_vectors), k), np.inf, dtype='float32')
+    out_indices = np.full((len(query_vectors), k), -1, dtype='int64')
+    if not candidate_ids:
+        return out_distances, out_indices
+
+    vectors = np.asarray(get_vectors(candidate_ids), dtype='float32')
+    position = {doc_id: row for row, doc_id in enumerate(candidate_ids)}
+
+    for q, row_ids in enumerate(indices):
+        row_ids = [int(i) for i in row_ids if i >= 0]
+        if not row_ids:
+            continue
+        diffs = vectors[[position[i] for i in row_ids]] - query_vectors[q]
+        exact = np.einsum('ij,ij->i', diffs, diffs)
+        order = np.argsort(exact)[:k]
+        out_distances[q, :len(order)] = exact[order]
+        out_indices[q, :len(order)] = np.asarray(row_ids)[order]
+
+    return out_distances, out_indices
+
+def evaluate_index(index, queries, ground_truth, k=10, repeats=3, corpus=None, rerank_factor=0):
+    """评估索引的召回率和检索延迟
+
+    Args:
+        index: 待评估的FAISS索引
+        queries: 查询向量矩阵
+        ground_truth: 精确检索得到的近邻ID矩阵
+        k: 评估的近邻数量
+        repeats: 重复检索次数，取最快的一次作为延迟
+        corpus: 原始语料向量，提供且rerank_factor>0时评估精确重排后的结果
+        rerank_factor: 重排时候选数量为k的倍数
+
+    Returns:
+        包含recall@k和单查询平均延迟(毫秒)的字典
+    """
+    rerank = corpus is not None and rerank_factor > 0
+    fetch_k = min(k * rerank_factor, index.ntotal) if rerank else k
+
+    best_elapsed = None
+    indices = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        _, indices = index.search(queries, fetch_k)
+        if rerank:
+            _, indices = rerank_exact(queries, indices, lambda ids: corpus[ids], k)
+        elapsed = time.perf_counter() - start_time
+        best_elapsed = elapsed if best_elapsed is None else min(best_elapsed, elapsed)
+
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(indices[:, :k], ground_truth[:, :k]))
+    return {
+        "recall_at_k": round(hits / float(ground_truth[:, :k].size), 4),
+        "latency_ms": round(best_elapsed * 1000 / len(queries), 4)
+    }
+
+def benchmark_index_types(embeddings, queries=None, k=10, nprobe_values=(1, 4, 16, 64),
+                          ef_search_values=(16, 32, 64, 128), hnsw_m=32, ivf_nlist=0, train_sample_size=100000,
+                          pq_m=0, pq_nbits=8, rerank_factor=4):
+    """生成召回率-延迟-内存报告，用于为当前语料规模选择索引类型、量化方式和检索参数
+
+    Args:
+        embeddings: 语料向量矩阵
+        queries: 查询向量矩阵，为空时从语料中抽取
+        k: 评估的近邻数量
+        nprobe_values: 需要评估的IVF nprobe取值
+        ef_search_values: 需要评估的HNSW efSearch取值
+        hnsw_m: HNSW每个节点的邻居数
+        ivf_nlist: IVF聚类中心数，0表示自动计算
+        train_sample_size: IVF/量化器训练最多使用的样本数
+        pq_m: PQ子空间数，0表示自动计算
+        pq_nbits: PQ每个子空间的编码位数
+        rerank_factor: 量化索引精确重排时的候选倍数
+
+    Returns:
+        报告条目列表，每项包含索引类型、量化方式、参数、构建耗时、每向量字节数、recall@k和单查询延迟
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    if queries is None:
+        queries = _train_sample(embeddings, min(1000, len(embeddings)))
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    k = min(k, len(embeddings))
+
+    report = []
+
+    def timed_build(**params):
+        start_time = time.perf_counter()
+        index = build_index(embeddings, train_sample_size=train_sample_size, **params)
+        return index, round(time.perf_counter() - start_time, 3)
+
+    def add_entry(index, index_type, quantization, params, build_seconds, rerank=False):
+        result = evaluate_index(
+            index, queries, ground_truth, k,
+            corpus=embeddings if rerank else None,
+            rerank_factor=rerank_factor if rerank else 0
+        )
+        if rerank:
+            params = {**params, "rerank": rerank_factor}
+        report.append({
+            "index_type": index_type,
+            "quantization": quantization,
+            "params": params,
+            "build_seconds": build_seconds,
+            "bytes_per_vector": index_bytes_per_vector(index),
+            **result
+        })
+
+    # 精确检索作为召回率基准
+    flat_index, build_seconds = timed_build(index_type='flat')
+    _, ground_truth = flat_index.search(queries, k)
+    add_entry(flat_index, 'flat', 'none', {}, build_seconds)
+
+    if len(embeddings) >= MIN_POINTS_PER_CENTROID:
+        ivf_index, build_seconds = timed_build(index_type='ivf', ivf_nlist=ivf_nlist)
+        for nprobe in nprobe_values:
+            apply_search_params(ivf_index, ivf_nprobe=nprobe)
+            params = {"nlist": faiss.downcast_index(ivf_index).nlist, "nprobe": faiss.downcast_index(ivf_index).nprobe}
+            add_entry(ivf_index, 'ivf', 'none', params, build_seconds)
+
+    hnsw_index, build_seconds = timed_build(index_type='hnsw', hnsw_m=hnsw_m)
+    for ef_search in ef_search_values:
+        apply_search_params(hnsw_index, hnsw_ef_search=ef_search)
+        add_entry(hnsw_index, 'hnsw', 'none', {"m": hnsw_m, "ef_search": ef_search}, build_seconds)
+
+    # 量化索引：分别评估直接检索和精确重排后的召回率
+    for quantization in ('sq8', 'pq'):
+        quantized_index, build_seconds = timed_build(
+            index_type='flat', quantization=quantization, pq_m=pq_m, pq_nbits=pq_nbits
+        )
+        quantized = faiss.downcast_index(quantized_index)
+        params = {"m": quantized.pq.M, "nbits": quantized.pq.nbits} if isinstance(quantized, faiss.IndexPQ) else {}
+        add_entry(quantized_index, 'flat', quantization, params, build_seconds)
+        add_entry(quantized_index, 'flat', quantization, params, build_seconds, rerank=True)
+
+    return report
+
+def format_report(report):
+    """将召回率-延迟-内存报告格式化为文本表格"""
+    lines = [
+        f"{'index':<8}{'quant':<7}{'params':<28}{'build_s':>10}"
+        f"{'bytes/vec':>11}{'recall@k':>10}{'ms/query':>12}"
+    ]
+    for item in report:
+        params = ", ".join(f"{key}={value}" for key, value in item["params"].items()) or "-"
+        lines.append(
+            f"{item['index_type']:<8}{item['quantization']:<7}{params:<28}{item['build_seconds']:>10}"
+            f"{item['bytes_per_vector']:>11}{item['recall_at_k']:>10}{item['latency_ms']:>12}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FAISS索引召回率-延迟-内存报告")
+    parser.add_argument("--embeddings", help="语料向量文件(.npy)，不提供时使用随机向量")
+    parser.add_argument("--vectors", type=int, default=50000, help="随机向量数量")
+    parser.add_argument("--dim", type=int, default=384, help="随机向量维度")
+    parser.add_argument("--k", type=int, default=10, help="评估的近邻数量")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        corpus = np.load(args.embeddings).astype('float32')
+    else:
+        corpus = np.random.default_rng(0).standard_normal((args.vectors, args.dim)).astype('float32')
+
+    logger.info(f"语料规模: {corpus.shape[0]} 个向量，维度 {corpus.shape[1]}")
+    logger.info("\n" + format_report(benchmark_index_types(corpus, k=args.k)))
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import unicodedata
+import faiss
+import numpy as np
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('index_store')
+
+class IndexStore:
+    """持久化的FAISS索引存储，按文档内容哈希寻址
+
+    同一份需求文档（归一化后的文本、分块参数和向量模型均相同）只需向量化一次，
+    之后直接从磁盘以内存映射方式加载索引和文本块，跳过model.encode。
+    量化索引只保存了有损编码，同时保存文本块的原始float32向量，检索时用于精确重排。
+    存储总大小超过上限时按最近访问时间淘汰最久未使用的条目。
+    """
+
+    INDEX_FILE = 'index.faiss'
+    CHUNKS_FILE = 'chunks.json'
+    VECTORS_FILE = 'vectors.npy'
+
+    def __init__(self, root_dir, max_bytes=0):
+        """初始化索引存储
+
+        Args:
+            root_dir: 索引存储根目录
+            max_bytes: 存储总大小上限（字节），0表示不限制
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize_text(text):
+        """归一化文档文本，避免换行符、行尾空白等差异导致缓存失效
+
+        Args:
+            text: 原始文档文本
+
+        Returns:
+            归一化后的文本
+        """
+        text = unicodedata.normalize('NFC', text or '')
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        lines = [line.rstrip() for line in text.split('\n')]
+        return '\n'.join(lines).strip()
+
+    def make_key(self, text, chunk_size, chunk_overlap, model_name, index_settings=None):
+        """根据文档内容、分块参数、模型名称和索引配置计算缓存键
+
+        Args:
+            text: 文档文本
+            chunk_size: 分块大小
+            chunk_overlap: 分块重叠大小
+            model_name: 向量模型名称
+            index_settings: 影响索引结构的配置（索引类型、量化方式等）
+
+        Returns:
+            十六进制的SHA-256缓存键
+        """
+        text_hash = hashlib.sha256(self.normalize_text(text).encode('utf-8')).hexdigest()
+        settings = json.dumps({
+            'text': text_hash,
+            'chunk_size': chunk_size,
+            'chunk_overlap': chunk_overlap,
+            'model': model_name,
+            'index': index_settings or {}
+        }, sort_keys=True)
+        return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        """获取缓存条目所在目录，按键前两位分目录，避免单目录文件过多"""
+        return os.path.join(self.root_dir, key[:2], key)
+
+    def load(self, key):
+        """加载缓存的索引和文本块
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            (索引, 文本块列表, 原始向量矩阵或None)，未命中或加载失败时返回None
+        """
+        entry_dir = self._entry_dir(key)
+        index_path = os.path.join(entry_dir, self.INDEX_FILE)
+        chunks_path = os.path.join(entry_dir, self.CHUNKS_FILE)
+
+        if not (os.path.exists(index_path) and os.path.exists(chunks_path)):
+            return None
+
+        try:
+            # 以内存映射方式加载索引，多个请求/进程共享操作系统页缓存
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                texts = json.load(f)
+
+            if index.ntotal != len(texts):
+                logger.warning(f"索引缓存 {key[:12]} 向量数与文本块数不一致，忽略该缓存")
+                return None
+
+            # 原始向量同样以内存映射方式加载，重排时只读取候选文本块所在的页
+            vectors = None
+            vectors_path = os.path.join(entry_dir, self.VECTORS_FILE)
+            if os.path.exists(vectors_path):
+                vectors = np.load(vectors_path, mmap_mode='r')
+                if len(vectors) != index.ntotal:
+                    logger.warning(f"索引缓存 {key[:12]} 原始向量数与索引不一致，忽略原始向量")
+                    vectors = None
+
+            # 更新条目目录的修改时间作为最近访问时间，淘汰时据此判断
+            self._touch(entry_dir)
+            logger.info(f"命中索引缓存 {key[:12]}，包含 {index.ntotal} 个向量")
+            return index, texts, vectors
+
+        except Exception as e:
+            logger.warning(f"加载索引缓存 {key[:12]} 失败: {str(e)}")
+            return None
+
+    def save(self, key, index, texts, vectors=None):
+        """保存索引、文本块和原始向量到磁盘
+
+        先写入临时目录再原子重命名，避免并发请求读到写了一半的缓存。
+
+        Args:
+            key: 缓存键
+            index: FAISS索引
+            texts: 文本块列表
+            vectors: 文本块的原始float32向量矩阵，量化索引重排时使用，默认不保存
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{id(index)}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            faiss.write_index(index, os.path.join(tmp_dir, self.INDEX_FILE))
+
+            with open(os.path.join(tmp_dir, self.CHUNKS_FILE), 'w', encoding='utf-8') as f:
+                json.dump(texts, f, ensure_ascii=False)
+
+            if vectors is not None:
+                np.save(os.path.join(tmp_dir, self.VECTORS_FILE), np.asarray(vectors, dtype='float32'))
+
+            os.rename(tmp_dir, entry_dir)
+            logger.info(f"索引已缓存到磁盘 {key[:12]}，包含 {index.ntotal} 个向量")
+            self.prune(keep=key)
+
+        except OSError as e:
+            # 其他进程可能已抢先写入相同的缓存条目
+            if os.path.exists(entry_dir):
+                logger.debug(f"索引缓存 {key[:12]} 已由其他请求写入")
+            else:
+                logger.warning(f"保存索引缓存 {key[:12]} 失败: {str(e)}")
+        except Exception as e:
+            logger.warning(f"保存索引缓存 {key[:12]} 失败: {str(e)}")
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _touch(entry_dir):
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            pass
+
+    def _entries(self):
+        """列出所有缓存条目，返回(最近访问时间, 占用字节数, 条目目录)列表"""
+        entries = []
+        for prefix in os.listdir(self.root_dir):
+            prefix_dir = os.path.join(self.root_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, name)
+                # 跳过其他请求正在写入的临时目录
+                if '.tmp-' in name or not os.path.isdir(entry_dir):
+                    continue
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+                    entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+                except OSError:
+                    continue
+        return entries
+
+    def prune(self, keep=None):
+        """存储总大小超过上限时，按最近访问时间删除最久未使用的条目
+
+        Args:
+            keep: 不删除的缓存键，通常是刚写入的条目
+
+        Returns:
+            删除的条目数
+        """
+        if not self.max_bytes:
+            return 0
+
+        try:
+            entries = self._entries()
+        except OSError as e:
+            logger.warning(f"统计索引缓存大小失败: {str(e)}")
+            return 0
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        keep_dir = self._entry_dir(keep) if keep else None
+        removed = 0
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_dir == keep_dir:
+                continue
+            # 已被内存映射加载的索引文件删除后仍可继续读取，直到映射释放
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            if not os.path.exists(entry_dir):
+                total -= size
+                removed += 1
+
+        logger.info(f"索引缓存超过上限 {self.max_bytes // (1024 * 1024)}MB，淘汰 {removed} 个最久未使用的条目，"
+                    f"当前占用 {total // (1024 * 1024)}MB")
+        return removed
@@ -0,0 +1,398 @@
+"""
+后台任务服务
+耗时数分钟的测试用例生成流程（文档解析、OCR、摘要、知识库检索、生成、评审、入库、上传知识库）
+不再占用HTTP请求线程：接口提交任务后立即返回任务ID，由后台线程池执行，前端按任务ID查询阶段进度。
+任务在提交它的进程中执行，事件保存在该进程内存中；任务状态和结果同时写入数据库，
+多进程部署时查询请求落到其他进程也能返回任务进度。
+"""
+import json
+import time
+import uuid
+import threading
+from functools import partial
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy.orm import Session
+from app.config import get_config
+from app.models import db, JobRecord
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('job_service')
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+# 任务进度写入数据库的最小间隔（秒），阶段切换和任务结束时立即写入
+PERSIST_INTERVAL = 1.0
+
+class Job:
+    """后台任务，按阶段汇报进度"""
+
+    def __init__(self, kind, stages, on_change=None):
+        """初始化任务
+
+        Args:
+            kind: 任务类型
+            stages: 阶段定义列表，每项为(阶段名称, 显示名称, 进度权重)
+            on_change: 任务状态变化时的回调函数，参数为to_dict()的结果，用于持久化任务状态
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = JOB_QUEUED
+        self.message = '排队中'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        total_weight = sum(weight for _, _, weight in stages) or 1
+        self.stages = [
+            {
+                "name": name,
+                "label": label,
+                "weight": weight / total_weight,
+                "status": 'pending',
+                "progress": 0.0,
+                "started_at": None,
+                "finished_at": None
+            }
+            for name, label, weight in stages
+        ]
+        self._current = None
+        # 事件列表供SSE推送使用，新事件到达时唤醒等待的推送线程
+        self._events = []
+        self._lock = threading.Condition(threading.RLock())
+        self._on_change = on_change
+        self._persisted_at = 0.0
+
+    def _find_stage(self, name):
+        for stage in self.stages:
+            if stage["name"] == name:
+                return stage
+        raise ValueError(f"未定义的任务阶段: {name}")
+
+    def start_stage(self, name, message=None):
+        """进入新阶段，之前未结束的阶段标记为完成
+
+        Args:
+            name: 阶段名称
+            message: 进度说明，默认使用阶段显示名称
+        """
+        now = time.time()
+        with self._lock:
+            if self._current is not None and self._current["status"] == 'running':
+                self._current["status"] = 'completed'
+                self._current["progress"] = 1.0
+                self._current["finished_at"] = now
+
+            stage = self._find_stage(name)
+            stage["status"] = 'running'
+            stage["started_at"] = now
+            self._current = stage
+            self.message = message or stage["label"]
+            self._publish_progress(persist=True)
+
+    def update_stage(self, progress, message=None):
+        """更新当前阶段的完成比例
+
+        Args:
+            progress: 0~1之间的完成比例
+            message: 进度说明
+        """
+        with self._lock:
+            if self._current is None:
+                return
+            self._current["progress"] = min(max(progress, 0.0), 1.0)
+            if message:
+                self.message = message
+            self._publish_progress()
+
+    def publish(self, event, data):
+        """发布任务事件，如流式生成过程中解析出的测试用例
+
+        Args:
+            event: 事件类型
+            data: 可JSON序列化的事件数据
+        """
+        with self._lock:
+            self._events.append((event, data))
+            self._lock.notify_all()
+
+    def _publish_progress(self, persist=False):
+        """发布进度事件，调用方需持有锁
+
+        Args:
+            persist: 是否立即持久化任务状态，否则按PERSIST_INTERVAL限制写入频率
+        """
+        snapshot = self.to_dict()
+        self._events.append(('progress', snapshot))
+        self._lock.notify_all()
+        self._persist(snapshot, force=persist)
+
+    def _persist(self, snapshot=None, force=True):
+        """调用状态变化回调，调用方需持有锁"""
+        if self._on_change is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._persisted_at < PERSIST_INTERVAL:
+            return
+        self._persisted_at = now
+        self._on_change(snapshot or self.to_dict())
+
+    @property
+    def finished(self):
+        """任务是否已结束"""
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def wait_events(self, cursor, timeout=15):
+        """等待并获取cursor之后的新事件
+
+        Args:
+            cursor: 已读取的事件数
+            timeout: 没有新事件时的最长等待时间（秒）
+
+        Returns:
+            (新事件列表, 任务是否已结束)
+        """
+        with self._lock:
+            if cursor >= len(self._events) and not self.finished:
+                self._lock.wait(timeout)
+            return self._events[cursor:], self.finished
+
+    @property
+    def progress(self):
+        """整体进度百分比"""
+        return round(sum(stage["weight"] * stage["progress"] for stage in self.stages) * 100, 1)
+
+    def to_dict(self):
+        """转换为字典，用于API返回"""
+        with self._lock:
+            now = time.time()
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "stage": self._current["name"] if self._current else None,
+                "message": self.message,
+                "progress": 100.0 if self.status == JOB_SUCCEEDED else self.progress,
+                "stages": [
+                    {
+                        "name": stage["name"],
+                        "label": stage["label"],
+                        "status": stage["status"],
+                        "elapsed": round((stage["finished_at"] or now) - stage["started_at"], 2)
+                        if stage["started_at"] else None
+                    }
+                    for stage in self.stages
+                ],
+                "result": self.result,
+                "error": self.error,
+                "created_at": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.created_at)),
+                "elapsed": round((self.finished_at or now) - (self.started_at or now), 2)
+            }
+
+    def _mark_running(self):
+        with self._lock:
+            self.status = JOB_RUNNING
+            self.started_at = time.time()
+            self._persist()
+
+    def _mark_finished(self, result=None, error=None):
+        now = time.time()
+        with self._lock:
+            if self._current is not None and self._current["status"] == 'running':
+                self._current["status"] = 'failed' if error else 'completed'
+                self._current["finished_at"] = now
+                if not error:
+                    self._current["progress"] = 1.0
+            self.finished_at = now
+            if error:
+                self.status = JOB_FAILED
+                self.error = error
+                self.message = f"处理失败: {error}"
+            else:
+                self.status = JOB_SUCCEEDED
+                self.result = result
+                self.message = '处理完成'
+            self._publish_progress(persist=True)
+
+
+class JobStore:
+    """任务状态的数据库存储
+
+    使用独立的数据库会话读写，不影响任务函数自身会话中尚未提交的数据。
+    写入失败（如数据库未创建jobs表）只记录警告，任务照常执行，此时只有提交任务的进程能查询到任务。
+    """
+
+    def __init__(self, retention_days=7):
+        """初始化任务存储
+
+        Args:
+            retention_days: 已结束任务的保留天数
+        """
+        self.retention_days = retention_days
+
+    def save(self, app, snapshot):
+        """写入任务状态
+
+        Args:
+            app: Flask应用实例，任务线程中没有应用上下文
+            snapshot: 任务的to_dict()结果
+        """
+        try:
+            with app.app_context(), Session(db.engine) as session:
+                record = session.get(JobRecord, snapshot["job_id"])
+                if record is None:
+                    record = JobRecord(id=snapshot["job_id"], kind=snapshot["kind"])
+                    session.add(record)
+                record.status = snapshot["status"]
+                record.snapshot = json.dumps(snapshot, ensure_ascii=False)
+                session.commit()
+        except Exception as e:
+            logger.warning(f"保存任务状态失败: {snapshot['job_id']}: {str(e)}")
+
+    def load(self, app, job_id):
+        """读取任务状态，不存在或读取失败时返回None"""
+        try:
+            with app.app_context(), Session(db.engine) as session:
+                record = session.get(JobRecord, job_id)
+                return record.to_dict() if record is not None else None
+        except Exception as e:
+            logger.warning(f"读取任务状态失败: {job_id}: {str(e)}")
+            return None
+
+    def prune(self, app):
+        """删除超过保留天数的已结束任务"""
+        if self.retention_days <= 0:
+            return
+        try:
+            with app.app_context(), Session(db.engine) as session:
+                session.query(JobRecord).filter(
+                    JobRecord.status.in_((JOB_SUCCEEDED, JOB_FAILED)),
+                    JobRecord.updated_at < datetime.now() - timedelta(days=self.retention_days)
+                ).delete(synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            logger.warning(f"清理过期任务失败: {str(e)}")
+
+
+class JobManager:
+    """后台任务管理器：有界线程池执行任务，内存中保留最近的任务及事件，任务状态同时写入数据库"""
+
+    def __init__(self, max_workers=2, history_limit=200, store=None):
+        """初始化任务管理器
+
+        Args:
+            max_workers: 同时执行的任务数
+            history_limit: 内存中保留的已结束任务数
+            store: 任务状态的数据库存储，为None时只保存在内存中
+        """
+        self.max_workers = max_workers
+        self.history_limit = history_limit
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, stages, func, *args, **kwargs):
+        """提交任务
+
+        Args:
+            kind: 任务类型
+            stages: 阶段定义列表
+            func: 任务函数，第一个参数为Job实例，返回值作为任务结果
+            *args, **kwargs: 传给任务函数的其他参数
+
+        Returns:
+            Job实例
+        """
+        on_change = None
+        if self.store is not None:
+            # 在请求上下文中提交任务，任务线程中通过应用实例访问数据库
+            app = current_app._get_current_object()
+            self.store.prune(app)
+            on_change = partial(self.store.save, app)
+        
+        job = Job(kind, stages, on_change)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        # 返回任务ID前先写入数据库，之后落到任意进程的查询请求都能找到该任务
+        with job._lock:
+            job._persist()
+        self.executor.submit(self._run, job, func, args, kwargs)
+        logger.info(f"任务已提交: {job.id} ({kind})")
+        return job
+
+    def get(self, job_id):
+        """按ID获取本进程中的任务，不存在时返回None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_status(self, job_id):
+        """按ID查询任务状态，本进程中没有该任务时从数据库读取，需要在应用上下文中调用
+
+        Returns:
+            与Job.to_dict()格式相同的字典，任务不存在时返回None
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is None:
+            return None
+        return self.store.load(current_app._get_current_object(), job_id)
+
+    def _run(self, job, func, args, kwargs):
+        """在工作线程中执行任务"""
+        job._mark_running()
+        logger.info(f"任务开始执行: {job.id}")
+        try:
+            result = func(job, *args, **kwargs)
+        except Exception as e:
+            logger.error(f"任务执行失败: {job.id}: {str(e)}", exc_info=True)
+            job._mark_finished(error=str(e))
+            return
+        job._mark_finished(result=result)
+        logger.info(f"任务执行完成: {job.id}，耗时: {job.finished_at - job.started_at:.2f}秒")
+
+    def _prune(self):
+        """清理超出保留数量的最早的已结束任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (JOB_SUCCEEDED, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.history_limit)]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        """获取任务数量统计"""
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_SUCCEEDED: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {"workers": self.max_workers, **counts}
+
+
+# 进程内共享的任务管理器
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+def get_job_manager():
+    """获取进程内共享的任务管理器"""
+    global _job_manager
+
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                config = get_config()
+                _job_manager = JobManager(
+                    max_workers=config.JOB_WORKERS,
+                    history_limit=config.JOB_HISTORY_LIMIT,
+                    store=JobStore(config.JOB_RETENTION_DAYS)
+                )
+
+    return _job_manager
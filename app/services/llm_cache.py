@@ -0,0 +1,96 @@
+import json
+import hashlib
+import threading
+from app.config import get_config
+from app.utils.logger import get_logger
+from app.utils.sqlite_cache import SQLiteLRUCache
+
+# 获取日志记录器
+logger = get_logger('llm_cache')
+
+class LLMResponseCache:
+    """大模型响应缓存，按(模型服务地址, 模型, temperature, max_tokens, 提示哈希)寻址
+
+    流程后段（入库、上传知识库）失败后用户重新点击生成时，文档未变，提示完全相同，
+    摘要、生成和评审的响应可直接复用，避免重复付费调用。
+    """
+
+    def __init__(self, path, max_entries=5000, ttl_seconds=None):
+        """初始化响应缓存
+
+        Args:
+            path: 缓存文件路径
+            max_entries: 最大缓存响应数
+            ttl_seconds: 响应有效期（秒），None表示永不过期
+        """
+        self.store = SQLiteLRUCache(path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    @staticmethod
+    def make_key(base_url, model, temperature, max_tokens, prompt):
+        """计算缓存键
+
+        Args:
+            base_url: 模型服务地址，不同服务上同名的模型（如不同的微调版本或量化版本）不共享缓存
+            model: 模型名称
+            temperature: 采样温度
+            max_tokens: 最大生成token数
+            prompt: 提示文本
+
+        Returns:
+            缓存键
+        """
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        params = json.dumps({
+            'base_url': (base_url or '').rstrip('/'),
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'prompt': prompt_hash
+        }, sort_keys=True)
+        return hashlib.sha256(params.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存的响应文本，未命中或已过期时返回None"""
+        value = self.store.get_many([key])[0]
+        return value.decode('utf-8') if value is not None else None
+
+    def put(self, key, content):
+        """写入响应文本"""
+        self.store.put_many([(key, content.encode('utf-8'))])
+
+    def stats(self):
+        """获取缓存命中统计"""
+        return self.store.stats()
+
+
+# 进程内共享的响应缓存实例
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """获取进程内共享的大模型响应缓存
+
+    Returns:
+        LLMResponseCache实例，未启用或初始化失败时返回None
+    """
+    global _llm_cache
+
+    config = get_config()
+    if not config.LLM_CACHE_ENABLED:
+        return None
+
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                try:
+                    _llm_cache = LLMResponseCache(
+                        config.LLM_CACHE_PATH,
+                        max_entries=config.LLM_CACHE_MAX_ENTRIES,
+                        ttl_seconds=config.LLM_CACHE_TTL_SECONDS or None
+                    )
+                    logger.info(f"大模型响应缓存初始化完成: {config.LLM_CACHE_PATH}")
+                except Exception as e:
+                    logger.error(f"大模型响应缓存初始化失败，将直接调用模型: {str(e)}")
+                    return None
+
+    return _llm_cache
@@ -0,0 +1,183 @@
+"""
+进程级大模型客户端注册表
+- 每个模型服务地址共享一个保持长连接的HTTP客户端，避免每次请求重新建立TCP/TLS连接
+- 每组(模型, temperature, max_tokens, 超时)参数共享一个ChatOpenAI实例
+- 每个服务地址限制同时进行的调用数，并统计连接池利用率
+"""
+import time
+import threading
+from contextlib import contextmanager
+import httpx
+from langchain_openai import ChatOpenAI
+from app.config import get_config
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('llm_client_registry')
+
+class EndpointLimiter:
+    """单个模型服务地址的并发限制和利用率统计"""
+
+    def __init__(self, endpoint, max_in_flight):
+        """初始化并发限制
+
+        Args:
+            endpoint: 模型服务地址
+            max_in_flight: 最大同时进行的调用数
+        """
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.created_at = time.time()
+
+    @contextmanager
+    def slot(self):
+        """占用一个调用名额，名额用尽时阻塞等待"""
+        wait_start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        self._semaphore.acquire()
+        acquired_at = time.perf_counter()
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.calls += 1
+            self.wait_seconds += acquired_at - wait_start
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.busy_seconds += time.perf_counter() - acquired_at
+            self._semaphore.release()
+
+    def stats(self):
+        """获取并发和利用率统计"""
+        with self._lock:
+            uptime = max(time.time() - self.created_at, 1e-9)
+            return {
+                "endpoint": self.endpoint,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "waiting": self.waiting,
+                "calls": self.calls,
+                "utilization": round(self.in_flight / self.max_in_flight, 3),
+                # 自启动以来调用名额的平均占用比例
+                "avg_utilization": round(self.busy_seconds / (uptime * self.max_in_flight), 4),
+                "avg_wait_ms": round(self.wait_seconds * 1000 / self.calls, 2) if self.calls else 0
+            }
+
+
+class LLMClientRegistry:
+    """按服务地址共享HTTP连接池、按参数组合共享ChatOpenAI实例的注册表"""
+
+    def __init__(self, max_in_flight=8, keepalive_expiry=60):
+        """初始化注册表
+
+        Args:
+            max_in_flight: 每个服务地址的最大同时调用数，同时作为HTTP连接池大小
+            keepalive_expiry: 空闲连接保持时间（秒）
+        """
+        self.max_in_flight = max_in_flight
+        self.keepalive_expiry = keepalive_expiry
+        self._http_clients = {}
+        self._limiters = {}
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _get_http_client(self, endpoint):
+        """获取服务地址对应的长连接HTTP客户端（调用方需持有锁）"""
+        if endpoint not in self._http_clients:
+            self._http_clients[endpoint] = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight,
+                    max_keepalive_connections=self.max_in_flight,
+                    keepalive_expiry=self.keepalive_expiry
+                )
+            )
+            self._limiters[endpoint] = EndpointLimiter(endpoint, self.max_in_flight)
+            logger.info(f"创建模型服务连接池: {endpoint}，最大并发: {self.max_in_flight}")
+        return self._http_clients[endpoint]
+
+    def get_chat_model(self, model, api_key, base_url, temperature=0.7, max_tokens=None, request_timeout=None):
+        """获取共享的ChatOpenAI实例
+
+        Args:
+            model: 模型名称
+            api_key: API密钥
+            base_url: 模型服务地址
+            temperature: 采样温度
+            max_tokens: 最大生成token数
+            request_timeout: 请求超时（秒），None表示不限制
+
+        Returns:
+            ChatOpenAI实例
+        """
+        key = (base_url, model, api_key, temperature, max_tokens, request_timeout)
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = ChatOpenAI(
+                    model=model,
+                    openai_api_key=api_key,
+                    openai_api_base=base_url,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    request_timeout=request_timeout,
+                    # 429等错误由限流调度器统一排队重试，不使用SDK内置的重试
+                    max_retries=0,
+                    http_client=self._get_http_client(base_url)
+                )
+            return self._models[key]
+
+    def slot(self, base_url):
+        """占用服务地址的一个调用名额
+
+        Args:
+            base_url: 模型服务地址
+
+        Returns:
+            上下文管理器
+        """
+        with self._lock:
+            self._get_http_client(base_url)
+            limiter = self._limiters[base_url]
+        return limiter.slot()
+
+    def stats(self):
+        """获取各服务地址的连接池利用率统计"""
+        with self._lock:
+            limiters = list(self._limiters.values())
+            profiles = {}
+            for key in self._models:
+                profiles[key[0]] = profiles.get(key[0], 0) + 1
+        return [dict(limiter.stats(), clients=profiles.get(limiter.endpoint, 0)) for limiter in limiters]
+
+
+# 进程内共享的注册表
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_llm_client_registry():
+    """获取进程内共享的大模型客户端注册表"""
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = get_config()
+                _registry = LLMClientRegistry(
+                    max_in_flight=config.LLM_MAX_IN_FLIGHT,
+                    keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY
+                )
+
+    return _registry
@@ -0,0 +1,223 @@
+"""
+大模型调用限流调度
+在调用模型网关之前按每分钟请求数(RPM)和每分钟token数(TPM)两个令牌桶排队，
+使吞吐量稳定在网关的限额附近，而不是突发请求后被429拒绝、整个上传失败。
+- 等待中的调用按优先级排序（摘要低于生成和评审），同一优先级内已获得调用次数少的任务优先，保证并发任务之间的公平
+- 网关返回429时按Retry-After暂停所有调用，再重新排队
+"""
+import time
+import heapq
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from app.config import get_config
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('llm_rate_limiter')
+
+# 调用优先级，数值越小越优先
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+class TokenBucket:
+    """按分钟额度匀速补充的令牌桶"""
+
+    def __init__(self, per_minute):
+        """初始化令牌桶
+
+        Args:
+            per_minute: 每分钟额度，0表示不限制
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """距离桶内令牌足够支付amount还需等待的秒数"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        # 单次请求超过桶容量时按桶满处理，避免永远无法发出
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        if self.capacity > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        if self.capacity > 0:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMRateLimiter:
+    """RPM/TPM双令牌桶限流器，等待中的调用按(优先级, 任务已获调用次数, 到达顺序)出队"""
+
+    def __init__(self, rpm=0, tpm=0):
+        """初始化限流器
+
+        Args:
+            rpm: 每分钟请求数上限，0表示不限制
+            tpm: 每分钟token数上限，0表示不限制
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        # 各任务已获得的调用次数，用于同一优先级内的公平排序
+        self._served = {}
+        self._paused_until = 0.0
+        self.granted = 0
+        self.rate_limited = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, estimated_tokens, priority=PRIORITY_HIGH, owner=None):
+        """排队等待调用额度
+
+        Args:
+            estimated_tokens: 预计消耗的token数（提示token数 + 最大生成token数）
+            priority: 调用优先级
+            owner: 调用所属的任务标识，用于公平排序
+        """
+        start = time.monotonic()
+        with self._condition:
+            entry = (priority, self._served.get(owner, 0), next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._waiters[0] is entry:
+                        delay = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(estimated_tokens, now)
+                        )
+                        if delay <= 0:
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+            finally:
+                # 无论正常出队还是异常退出，都要唤醒其他等待者重新判断队首
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self._served[owner] = self._served.get(owner, 0) + 1
+            if len(self._served) > 1000:
+                self._served.clear()
+            self.granted += 1
+            self.wait_seconds += time.monotonic() - start
+
+    def release(self, estimated_tokens, actual_tokens):
+        """调用结束后按实际消耗归还多预扣的token额度
+
+        Args:
+            estimated_tokens: 排队时预扣的token数
+            actual_tokens: 实际消耗的token数，未知时传None
+        """
+        if actual_tokens is None or actual_tokens >= estimated_tokens:
+            return
+        with self._condition:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        """网关返回429后暂停所有调用
+
+        Args:
+            seconds: 暂停秒数
+        """
+        with self._condition:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+        logger.warning(f"模型网关限流，暂停调用 {seconds:.1f} 秒")
+
+    def stats(self):
+        """获取排队和限流统计"""
+        with self._condition:
+            return {
+                "rpm_limit": self.requests.capacity,
+                "tpm_limit": self.tokens.capacity,
+                "queued": len(self._waiters),
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "paused_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 2),
+                "avg_wait_ms": round(self.wait_seconds * 1000 / self.granted, 2) if self.granted else 0
+            }
+
+
+def is_rate_limit_error(error):
+    """判断异常是否为网关返回的429"""
+    return getattr(error, 'status_code', None) == 429
+
+def get_retry_after(error, default=5.0):
+    """从429响应头中读取建议的重试等待时间
+
+    Args:
+        error: 调用异常
+        default: 响应头中没有等待时间时使用的默认值（秒）
+
+    Returns:
+        等待秒数
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            # HTTP日期格式
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+    return default
+
+
+# 进程内共享的限流器，按模型服务地址索引
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(base_url):
+    """获取模型服务地址对应的限流器
+
+    Args:
+        base_url: 模型服务地址
+
+    Returns:
+        LLMRateLimiter实例
+    """
+    with _limiters_lock:
+        if base_url not in _limiters:
+            config = get_config()
+            _limiters[base_url] = LLMRateLimiter(
+                rpm=config.LLM_RATE_LIMIT_RPM,
+                tpm=config.LLM_RATE_LIMIT_TPM
+            )
+        return _limiters[base_url]
+
+def get_rate_limiter_stats():
+    """获取所有限流器的统计信息"""
+    with _limiters_lock:
+        return {base_url: limiter.stats() for base_url, limiter in _limiters.items()}
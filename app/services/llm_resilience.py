@@ -0,0 +1,232 @@
+"""
+大模型调用容错策略
+- 重试：5xx、超时和连接错误按指数退避加随机抖动重试，避免一次偶发失败导致整个上传失败
+- 对冲请求：调用耗时超过该类调用历史耗时的p95仍未返回时，再发出一个相同的请求，采用先完成的结果。
+  只有约5%的慢请求会触发对冲，并且对冲次数受比例上限约束，在降低尾延迟的同时不会使平均调用成本翻倍
+"""
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+import httpx
+from app.config import get_config
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('llm_resilience')
+
+# 可重试的HTTP状态码，429由限流调度器单独处理
+RETRYABLE_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+
+def is_retryable_error(error):
+    """判断异常是否为可重试的临时错误（5xx、超时、连接错误）"""
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code > 504
+    if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    # openai SDK的连接错误和超时错误（APITimeoutError是APIConnectionError的子类）
+    return any(cls.__name__ == 'APIConnectionError' for cls in type(error).__mro__)
+
+
+class RetryPolicy:
+    """指数退避重试策略"""
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=30.0):
+        """初始化重试策略
+
+        Args:
+            max_retries: 最大重试次数
+            base_delay: 首次重试的基准等待时间（秒）
+            max_delay: 单次等待时间上限（秒）
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        """第attempt次重试前的等待时间：指数增长，在后一半区间内随机抖动，避免并发任务同时重试"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class LatencyTracker:
+    """滑动窗口内的调用耗时分位数统计"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        """计算q分位数（0~100），没有样本时返回None"""
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+class RequestHedger:
+    """对冲请求执行器：按调用类别统计耗时分位数，慢请求超过分位数耗时后再发出一个相同请求"""
+
+    def __init__(self, enabled=False, percentile=95, min_samples=20, max_ratio=0.1, min_delay=1.0, window=200):
+        """初始化对冲执行器
+
+        Args:
+            enabled: 是否启用对冲
+            percentile: 触发对冲的耗时分位数
+            min_samples: 该类调用至少积累多少个耗时样本后才开始对冲
+            max_ratio: 对冲请求数占调用总数的比例上限
+            min_delay: 对冲等待时间下限（秒）
+            window: 耗时统计窗口大小
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.window = window
+        self._trackers = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _tracker(self, key):
+        """获取调用类别的耗时统计（调用方需持有锁）"""
+        if key not in self._trackers:
+            self._trackers[key] = LatencyTracker(self.window)
+        return self._trackers[key]
+
+    def hedge_delay(self, key):
+        """计算对冲等待时间，样本不足或未启用时返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            tracker = self._tracker(key)
+            if len(tracker) < self.min_samples:
+                return None
+            return max(self.min_delay, tracker.percentile(self.percentile))
+
+    def _claim_hedge(self):
+        """占用一次对冲额度，超过比例上限时返回False"""
+        with self._lock:
+            if self.hedged + 1 > self.max_ratio * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    @staticmethod
+    def _spawn(func):
+        """在独立线程中执行调用，返回Future"""
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            start = time.perf_counter()
+            try:
+                result = func()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.elapsed = time.perf_counter() - start
+                future.set_result(result)
+
+        threading.Thread(target=run, name='llm-hedge', daemon=True).start()
+        return future
+
+    def call(self, key, func):
+        """执行调用，必要时发出对冲请求
+
+        Args:
+            key: 调用类别，同一类别的调用共享耗时统计
+            func: 无参调用函数
+
+        Returns:
+            先成功完成的调用结果；所有请求都失败时抛出主请求的异常
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.hedge_delay(key)
+
+        if delay is None:
+            start = time.perf_counter()
+            result = func()
+            self._record(key, time.perf_counter() - start)
+            return result
+
+        primary = self._spawn(func)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._claim_hedge():
+            return self._finish(key, primary, primary.result())
+
+        logger.info(f"调用耗时超过 {delay:.1f} 秒，发出对冲请求")
+        hedge = self._spawn(func)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 未完成的请求在后台自然结束，结果丢弃
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return self._finish(key, future, future.result())
+        return primary.result()
+
+    def _finish(self, key, future, result):
+        self._record(key, future.elapsed)
+        return result
+
+    def _record(self, key, seconds):
+        with self._lock:
+            self._tracker(key).record(seconds)
+
+    def stats(self):
+        """获取对冲次数和各类调用的耗时分位数"""
+        with self._lock:
+            latencies = {}
+            for key, tracker in self._trackers.items():
+                p50 = tracker.percentile(50)
+                p95 = tracker.percentile(95)
+                latencies[':'.join(str(part) for part in key)] = {
+                    "samples": len(tracker),
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+                }
+            return {
+                "enabled": self.enabled,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "latencies": latencies
+            }
+
+
+# 进程内共享的对冲执行器
+_hedger = None
+_hedger_lock = threading.Lock()
+
+def get_request_hedger():
+    """获取进程内共享的对冲执行器"""
+    global _hedger
+
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                config = get_config()
+                _hedger = RequestHedger(
+                    enabled=config.LLM_HEDGE_ENABLED,
+                    percentile=config.LLM_HEDGE_PERCENTILE,
+                    min_samples=config.LLM_HEDGE_MIN_SAMPLES,
+                    max_ratio=config.LLM_HEDGE_MAX_RATIO
+                )
+
+    return _hedger
@@ -0,0 +1,92 @@
+"""
+处理流程的依赖图执行
+流程中的每个阶段声明它依赖的阶段，依赖全部完成后立即在线程池中执行，
+互不依赖的阶段（如文档向量化与摘要生成、知识库查询）并发进行，总耗时取决于依赖图中最长的路径。
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('pipeline')
+
+class Pipeline:
+    """按依赖关系并发执行阶段的处理流程"""
+
+    def __init__(self, name, max_workers=None):
+        """初始化处理流程
+
+        Args:
+            name: 流程名称，用于日志
+            max_workers: 最大并发阶段数，默认等于阶段数
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=()):
+        """添加阶段
+
+        Args:
+            name: 阶段名称
+            func: 阶段函数，以依赖阶段的名称为关键字参数接收其结果
+            deps: 依赖的阶段名称列表，必须已经添加
+
+        Returns:
+            流程本身，便于链式调用
+        """
+        if name in self.stages:
+            raise ValueError(f"阶段已存在: {name}")
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖未定义的阶段: {dep}")
+        self.stages[name] = (func, tuple(deps))
+        return self
+
+    def _run_stage(self, name, results):
+        func, deps = self.stages[name]
+        start = time.perf_counter()
+        try:
+            return func(**{dep: results[dep] for dep in deps})
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def run(self):
+        """执行全部阶段
+
+        Returns:
+            阶段名称到阶段结果的字典
+
+        Raises:
+            任一阶段抛出的异常，此时不再启动新的阶段
+        """
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(self.stages) or 1,
+                                thread_name_prefix=f"{self.name}-stage") as executor:
+            while pending or running:
+                # 启动依赖已全部完成的阶段
+                for name, (_, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        running[executor.submit(self._run_stage, name, dict(results))] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.error(f"流程 {self.name} 的阶段 {name} 失败: {str(error)}")
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    results[name] = future.result()
+
+        total = time.perf_counter() - start
+        stage_timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+        logger.info(f"流程 {self.name} 完成，总耗时 {total:.2f}s，各阶段耗时: {stage_timings}")
+        return results
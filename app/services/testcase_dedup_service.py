@@ -0,0 +1,98 @@
+import numpy as np
+from app.config import get_config
+from app.utils.logger import get_logger
+from .vector_store_service import VectorStoreService
+
+# 获取日志记录器
+logger = get_logger('testcase_dedup')
+
+class TestCaseDedupService:
+    """基于向量相似度的测试用例语义去重
+
+    生成和评审阶段经常返回措辞不同但内容几乎相同的测试用例。入库前将"标题+步骤"一次性批量向量化，
+    计算两两余弦相似度，把相似度超过阈值的用例聚为一组，每组只保留内容最完整的一个。
+    """
+
+    def __init__(self, threshold=None, vector_store=None):
+        """初始化去重服务
+
+        Args:
+            threshold: 余弦相似度阈值，默认使用配置中的TESTCASE_DEDUP_THRESHOLD
+            vector_store: 用于向量化的向量存储服务，默认使用配置中的TESTCASE_DEDUP_MODEL新建
+        """
+        config = get_config()
+        self.threshold = config.TESTCASE_DEDUP_THRESHOLD if threshold is None else threshold
+        self.vector_store = vector_store or VectorStoreService(config.TESTCASE_DEDUP_MODEL or None)
+
+    @staticmethod
+    def _case_text(test_case):
+        """用于比较的测试用例文本"""
+        return f"{test_case.get('title', '')}\n{test_case.get('steps', '')}".strip()
+
+    @staticmethod
+    def _case_detail(test_case):
+        """测试用例内容的完整程度，用于在相似用例中选择保留哪一个"""
+        return sum(len(str(test_case.get(field) or '')) for field in ('description', 'preconditions', 'steps', 'expected_results'))
+
+    def cluster(self, test_cases):
+        """将相似的测试用例聚类
+
+        Args:
+            test_cases: 测试用例列表
+
+        Returns:
+            聚类列表，每个聚类是测试用例下标列表，按首个用例的位置排序
+        """
+        if len(test_cases) < 2:
+            return [[i] for i in range(len(test_cases))]
+
+        embeddings = self.vector_store.embed_texts([self._case_text(tc) for tc in test_cases])
+        embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        similarity = embeddings @ embeddings.T
+
+        # 贪心聚类：按顺序取未分配的用例作为中心，吸收所有相似度超过阈值的未分配用例
+        assigned = np.zeros(len(test_cases), dtype=bool)
+        clusters = []
+        for i in range(len(test_cases)):
+            if assigned[i]:
+                continue
+            members = np.flatnonzero((similarity[i] >= self.threshold) & ~assigned)
+            members = members[members >= i]
+            assigned[members] = True
+            clusters.append([int(j) for j in members])
+
+        return clusters
+
+    def deduplicate(self, test_cases):
+        """去除语义重复的测试用例
+
+        Args:
+            test_cases: 测试用例列表
+
+        Returns:
+            (去重后的测试用例列表, 统计信息字典)
+        """
+        test_cases = [tc for tc in test_cases if isinstance(tc, dict)]
+        clusters = self.cluster(test_cases)
+
+        unique = []
+        merged_groups = []
+        for members in clusters:
+            # 每组保留内容最完整的用例，位置沿用组内第一个用例
+            keep = max(members, key=lambda i: self._case_detail(test_cases[i]))
+            unique.append(test_cases[keep])
+            if len(members) > 1:
+                merged_groups.append({
+                    "kept": test_cases[keep].get('title', ''),
+                    "merged": [test_cases[i].get('title', '') for i in members if i != keep]
+                })
+
+        stats = {
+            "threshold": self.threshold,
+            "input": len(test_cases),
+            "output": len(unique),
+            "merged": len(test_cases) - len(unique),
+            "groups": merged_groups
+        }
+        logger.info(f"测试用例语义去重完成: {stats['input']} -> {stats['output']}，合并 {stats['merged']} 个相似用例")
+        return unique, stats
@@ -1,12 +1,19 @@
-import os
 import faiss
 import numpy as np
-import torch
-import traceback
-from sentence_transformers import SentenceTransformer
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document as LangchainDocument
+from app.config import get_config
 from app.utils.logger import get_logger
+from app.utils.token_counter import count_tokens, truncate_to_tokens
+from .index_store import IndexStore
+from .index_factory import (
+    index_params_from_config, build_index, choose_index_type, get_index_type,
+    get_index_vectors, apply_search_params, is_quantized, rerank_exact
+)
+from .embedding_cache import get_embedding_cache
+from .embedding_model_registry import get_embedding_backend
+from .embedding_pool import get_embedding_pool, reset_embedding_pool
+from .embedding_scheduler import get_embedding_scheduler
 
 # 获取日志记录器
 logger = get_logger('vector_store')
@@ -14,175 +21,47 @@ logger = get_logger('vector_store')
 class VectorStoreService:
     """向量存储服务，用于文档向量化和相似度搜索"""
     
-    # 类级别变量，用于跟踪初始化状态
-    _initialized = False
-    _init_error = None
-    
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
+    def __init__(self, model_name=None):
         """初始化向量存储服务
         
         Args:
-            model_name: 使用的Sentence Transformer模型名称
+            model_name: 使用的Sentence Transformer模型名称，默认使用配置中的EMBEDDING_MODEL
         """
-        # 如果类已经尝试初始化但失败了，直接抛出之前的错误
-        if VectorStoreService._init_error is not None:
-            raise RuntimeError(f"SentenceTransformer初始化失败: {VectorStoreService._init_error}")
-            
-        # 如果类已经成功初始化，直接返回
-        if VectorStoreService._initialized:
-            return
-            
-        # 明确指定设备为CPU，避免meta tensor问题
-        device = 'cpu'
+        config = get_config()
         
-        # 设置torch设备
-        torch.set_grad_enabled(False)  # 禁用梯度计算，减少内存使用
+        # 向量化后端由进程级注册表统一加载，所有实例共享，实例只保存自己的索引和文档
+        self.model_name = model_name or config.EMBEDDING_MODEL
+        self.model = get_embedding_backend(self.model_name)
+        # 不同后端（如int8量化的ONNX模型）的向量不完全相同，缓存按model_id区分
+        self.model_id = self.model.model_id
         
-        logger.info("正在初始化SentenceTransformer模型...")
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=len
+        )
+        self.index = None
+        self.documents = []
+        # 量化索引对应的原始float32向量，行顺序与documents一致，用于精确重排；非量化索引为None
+        self.vectors = None
         
-        # 使用明确的设备参数初始化模型
-        model_initialized = False
+        # 持久化索引存储，相同文档重复上传时跳过向量化
+        self.index_store = IndexStore(
+            config.VECTOR_INDEX_CACHE_DIR, config.VECTOR_INDEX_CACHE_MAX_MB * 1024 * 1024
+        ) if config.VECTOR_INDEX_CACHE_ENABLED else None
         
-        # 尝试方案1：使用to_empty()方法（错误信息中明确推荐的方法）
-        if not model_initialized:
-            try:
-                logger.info("尝试方案1：使用to_empty()方法初始化...")
-                
-                # 先初始化模型，不指定设备
-                self.model = SentenceTransformer(model_name)
-                
-                # 使用to_empty()方法代替to()
-                try:
-                    # 检查PyTorch版本
-                    logger.info(f"PyTorch版本: {torch.__version__}")
-                    
-                    # 对于较新版本的PyTorch，使用to_empty
-                    if hasattr(self.model, 'to_empty'):
-                        logger.info("检测到to_empty方法，尝试使用...")
-                        self.model = self.model.to_empty(device='cpu')
-                        model_initialized = True
-                        VectorStoreService._initialized = True
-                        logger.info("使用to_empty()方法初始化成功")
-                    else:
-                        # 如果to_empty不存在，尝试使用模块级别的to_empty
-                        logger.info("模型对象没有to_empty方法，尝试使用torch.nn.Module.to_empty...")
-                        if hasattr(torch.nn.Module, 'to_empty'):
-                            self.model = torch.nn.Module.to_empty(self.model, device='cpu')
-                            model_initialized = True
-                            VectorStoreService._initialized = True
-                            logger.info("使用torch.nn.Module.to_empty()方法初始化成功")
-                        else:
-                            logger.warning("to_empty()方法不存在，尝试其他方法...")
-                except AttributeError as ae:
-                    # 如果to_empty不存在，说明PyTorch版本较旧，继续尝试其他方法
-                    logger.warning(f"to_empty()方法不存在: {str(ae)}")
-                    logger.warning("尝试其他方法...")
-                
-            except Exception as e:
-                logger.error(f"使用to_empty()方法初始化失败: {str(e)}")
-                logger.error(f"错误详情: {traceback.format_exc()}")
+        # 文本块向量缓存，只有未命中的文本块才交给模型
+        self.embedding_cache = get_embedding_cache()
+        self.batch_size = config.EMBEDDING_BATCH_SIZE
+        # 未命中缓存的文本块数量达到阈值时，分发到多进程工作池并行向量化
+        self.pool_threshold = config.EMBEDDING_POOL_THRESHOLD
         
-        # 尝试方案2：添加额外的配置参数，避免meta tensor问题
-        if not model_initialized:
-            try:
-                logger.info("尝试方案2：使用device参数初始化...")
-                torch.set_default_tensor_type(torch.FloatTensor)  # 确保默认tensor类型正确
-                
-                # 尝试初始化模型
-                self.model = SentenceTransformer(model_name, device=device)
-                
-                # 标记为成功初始化
-                model_initialized = True
-                VectorStoreService._initialized = True
-                logger.info("使用device参数初始化成功")
-                
-            except Exception as e:
-                logger.error(f"使用device参数初始化失败: {str(e)}")
-                logger.error(f"错误详情: {traceback.format_exc()}")
-        
-        # 尝试方案3：使用torch.device
-        if not model_initialized:
-            try:
-                logger.info("尝试方案3：使用torch.device初始化...")
-                torch_device = torch.device('cpu')
-                self.model = SentenceTransformer(model_name, device=torch_device)
-                model_initialized = True
-                VectorStoreService._initialized = True
-                logger.info("使用torch.device初始化成功")
-                
-            except Exception as e2:
-                logger.error(f"使用torch.device初始化失败: {str(e2)}")
-                logger.error(f"错误详情: {traceback.format_exc()}")
-        
-        # 尝试方案4：先初始化，然后使用自定义to方法
-        if not model_initialized:
-            try:
-                logger.info("尝试方案4：使用自定义to方法...")
-                
-                # 先不指定设备参数初始化
-                self.model = SentenceTransformer(model_name)
-                
-                # 自定义to方法，避免使用内置的to方法
-                def custom_to(module, device):
-                    # 遍历模块的所有参数和缓冲区，手动将它们移动到指定设备
-                    for param in module.parameters():
-                        if hasattr(param, 'data'):
-                            param.data = param.data.to(device)
-                    for buf in module.buffers():
-                        if hasattr(buf, 'data'):
-                            buf.data = buf.data.to(device)
-                    return module
-                
-                # 使用自定义to方法
-                self.model = custom_to(self.model, 'cpu')
-                model_initialized = True
-                VectorStoreService._initialized = True
-                logger.info("使用自定义to方法初始化成功")
-                
-            except Exception as e3:
-                logger.error(f"使用自定义to方法初始化失败: {str(e3)}")
-                logger.error(f"错误详情: {traceback.format_exc()}")
-        
-        # 尝试方案5：完全禁用cuda，使用纯CPU模式
-        if not model_initialized:
-            try:
-                logger.info("尝试方案5：完全禁用CUDA，使用纯CPU模式...")
-                
-                # 禁用CUDA
-                os.environ["CUDA_VISIBLE_DEVICES"] = ""
-                torch.set_num_threads(1)
-                
-                # 重新初始化模型
-                self.model = SentenceTransformer(model_name)
-                model_initialized = True
-                VectorStoreService._initialized = True
-                logger.info("使用纯CPU模式初始化成功")
-                
-            except Exception as e4:
-                # 所有尝试都失败，记录错误并抛出
-                error_msg = f"所有SentenceTransformer初始化尝试均失败: {str(e4)}"
-                logger.error(error_msg)
-                logger.error(f"错误详情: {traceback.format_exc()}")
-                VectorStoreService._init_error = error_msg
-                raise RuntimeError(error_msg)
-        
-        # 只有在模型成功初始化后，才初始化其他属性
-        if model_initialized:
-            logger.info("模型初始化成功，现在初始化其他属性...")
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len
-            )
-            self.index = None
-            self.documents = []
-            logger.info("VectorStoreService初始化完成")
-        else:
-            # 这种情况理论上不会发生，因为如果所有初始化方法都失败，前面会抛出异常
-            error_msg = "模型初始化失败，但没有抛出异常，这是一个意外情况"
-            logger.error(error_msg)
-            VectorStoreService._init_error = error_msg
-            raise RuntimeError(error_msg)
+        # 索引类型及检索参数，向量规模增长后自动切换为近似检索
+        self.index_params = index_params_from_config(config)
+        # 量化索引检索时多取若干倍候选，再用原始向量精确重排
+        self.rerank_factor = config.VECTOR_RERANK_FACTOR
         
     def process_document(self, text):
         """处理文档文本，分割并向量化
@@ -193,51 +72,213 @@ class VectorStoreService:
         Returns:
             分割后的文档块列表
         """
+        # 先查询持久化索引存储，命中时直接加载，无需重新分割和向量化
+        cache_key = None
+        if self.index_store is not None:
+            index_settings = {
+                key: self.index_params[key] for key in ('index_type', 'quantization', 'pq_m', 'pq_nbits')
+            }
+            cache_key = self.index_store.make_key(
+                text, self.chunk_size, self.chunk_overlap, self.model_id, index_settings
+            )
+            cached = self.index_store.load(cache_key)
+            if cached is not None:
+                self.index, texts, self.vectors = cached
+                apply_search_params(self.index, **self.index_params)
+                self.documents = [LangchainDocument(page_content=t) for t in texts]
+                return self.documents
+        
         # 分割文本为小块
         texts = self.text_splitter.split_text(text)
         
         # 创建Langchain文档对象
         documents = [LangchainDocument(page_content=t) for t in texts]
         
-        # 存储文档
-        self.documents = documents
+        # 清空旧索引后一次性批量向量化整个文档
+        self.documents = []
+        self.index = None
+        self.vectors = None
+        self.add_documents(documents)
         
-        # 向量化文档
-        self._create_index(texts)
+        # 将新建的索引和量化索引的原始向量写入持久化存储
+        if cache_key is not None and self.index is not None:
+            self.index_store.save(cache_key, self.index, texts, self.vectors)
         
         return documents
         
-    def _create_index(self, texts):
-        """创建FAISS索引
+    def add_texts(self, texts):
+        """增量添加文本到现有索引，不会清空已有文档
         
         Args:
-            texts: 文本列表
+            texts: 文本列表，每个文本作为一个文档块
+            
+        Returns:
+            成功添加的文档块列表
         """
-        if not texts:
-            return
+        return self.add_documents([LangchainDocument(page_content=t) for t in texts])
+        
+    def add_documents(self, documents):
+        """增量添加文档块到现有索引，所有文档块合并为一批向量化
+        
+        Args:
+            documents: Langchain文档对象列表
+            
+        Returns:
+            成功添加的文档块列表，失败时返回空列表
+        """
+        if not documents:
+            return []
+        
+        texts = [doc.page_content for doc in documents]
         
         try:
             logger.info(f"开始向量化 {len(texts)} 个文本片段...")
             
             # 向量化文本
-            embeddings = self.model.encode(texts, show_progress_bar=True)
+            embeddings = self._encode(texts, show_progress_bar=True)
             
             logger.info(f"向量化完成，向量维度: {embeddings.shape}")
             
-            # 创建FAISS索引
-            vector_dimension = embeddings.shape[1]  # 获取向量维度
-            self.index = faiss.IndexFlatL2(vector_dimension)
+            # 首次添加时按向量数量创建合适类型的FAISS索引，否则追加到现有索引
+            if self.index is None:
+                self.index = build_index(embeddings, **self.index_params)
+                self.vectors = embeddings if is_quantized(self.index) else None
+            else:
+                self._append_to_index(embeddings)
             
-            # 将向量添加到索引
-            self.index.add(np.array(embeddings).astype('float32'))
+            # 文档列表与索引中的向量顺序保持一致
+            self.documents.extend(documents)
             
-            logger.info(f"FAISS索引创建成功，包含 {self.index.ntotal} 个向量")
+            logger.info(f"FAISS索引更新成功，包含 {self.index.ntotal} 个向量")
+            return documents
             
         except Exception as e:
-            error_msg = f"创建索引失败: {str(e)}"
+            error_msg = f"添加文档到索引失败: {str(e)}"
             logger.error(error_msg)
-            # 不抛出异常，而是返回空索引，以便程序可以继续运行
-            self.index = None
+            # 不抛出异常，以便程序可以继续运行
+            return []
+        
+    def _append_to_index(self, embeddings):
+        """追加向量到现有索引，向量总数跨过阈值时重建为更合适的索引类型
+        
+        Args:
+            embeddings: 新增的float32向量矩阵
+        """
+        total = self.index.ntotal + len(embeddings)
+        current_type = get_index_type(self.index)
+        target_type = choose_index_type(total, **self.index_params)
+        
+        if current_type == target_type:
+            self.index.add(embeddings)
+            if self.vectors is not None:
+                self.vectors = np.vstack([self.vectors, embeddings])
+            return
+        
+        logger.info(f"向量数增长到 {total}，索引类型由 {current_type} 切换为 {target_type}")
+        
+        # 量化索引只保存了有损编码，重建时使用原始向量
+        if is_quantized(self.index):
+            existing_embeddings = self._document_vectors(range(self.index.ntotal))
+        else:
+            existing_embeddings = get_index_vectors(self.index)
+        
+        all_embeddings = np.vstack([existing_embeddings, embeddings])
+        self.index = build_index(all_embeddings, **self.index_params)
+        self.vectors = all_embeddings if is_quantized(self.index) else None
+        
+    def _document_vectors(self, ids):
+        """获取文档块的原始向量，直接读取与索引一同保存的向量矩阵，无需调用模型
+        
+        Args:
+            ids: 文档块在索引中的ID列表
+            
+        Returns:
+            float32向量矩阵
+        """
+        ids = list(ids)
+        if self.vectors is not None:
+            return np.asarray(self.vectors[ids], dtype='float32')
+        # 旧版本的索引缓存没有保存原始向量，退回重新向量化
+        return self._encode([self.documents[i].page_content for i in ids])
+        
+    def _model_encode(self, texts, show_progress_bar=False):
+        """调用向量化后端，大量文本分发到多进程工作池，少量文本经微批调度器合并
+        
+        Args:
+            texts: 文本列表
+            show_progress_bar: 是否显示进度条
+            
+        Returns:
+            float32向量矩阵，行顺序与texts一致
+        """
+        if self.pool_threshold > 0 and len(texts) >= self.pool_threshold:
+            pool = get_embedding_pool(self.model_name)
+            if pool is not None:
+                try:
+                    return pool.encode(texts, batch_size=self.batch_size)
+                except Exception as e:
+                    # 工作进程异常退出等情况，丢弃工作池并退回当前进程向量化
+                    logger.warning(f"多进程向量化失败，改为在当前进程中执行: {str(e)}")
+                    reset_embedding_pool(self.model_name)
+        
+        # 少量文本交给微批调度器，与其他并发请求合并成一个批次调用模型
+        scheduler = get_embedding_scheduler(self.model_name)
+        if scheduler is not None:
+            return scheduler.encode(texts)
+        
+        return np.asarray(
+            self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=show_progress_bar),
+            dtype='float32'
+        )
+        
+    def _encode(self, texts, show_progress_bar=False):
+        """向量化文本，优先读取向量缓存，未命中的文本合并为一批交给模型
+        
+        Args:
+            texts: 文本列表
+            show_progress_bar: 是否显示进度条
+            
+        Returns:
+            float32向量矩阵，行顺序与texts一致
+        """
+        if self.embedding_cache is None:
+            return self._model_encode(texts, show_progress_bar=show_progress_bar)
+        
+        try:
+            vectors = self.embedding_cache.get_many(self.model_id, texts)
+        except Exception as e:
+            logger.warning(f"读取向量缓存失败，直接调用模型: {str(e)}")
+            vectors = [None] * len(texts)
+        
+        # 去重后的未命中文本，一次性交给模型
+        miss_texts = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        
+        if miss_texts:
+            logger.info(f"向量缓存命中 {len(texts) - len(miss_texts)}/{len(texts)}，向量化 {len(miss_texts)} 个未命中文本")
+            miss_embeddings = self._model_encode(miss_texts, show_progress_bar=show_progress_bar)
+            
+            try:
+                self.embedding_cache.put_many(self.model_id, miss_texts, miss_embeddings)
+            except Exception as e:
+                logger.warning(f"写入向量缓存失败: {str(e)}")
+            
+            miss_vectors = dict(zip(miss_texts, miss_embeddings))
+            vectors = [vector if vector is not None else miss_vectors[text] for text, vector in zip(texts, vectors)]
+        
+        return np.vstack(vectors).astype('float32')
+        
+    def embed_texts(self, texts):
+        """向量化不属于文档的短文本（如测试用例），不写入文本块向量缓存
+        
+        Args:
+            texts: 文本列表
+            
+        Returns:
+            float32向量矩阵，行顺序与texts一致
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        return self._model_encode(list(texts))
         
     def similarity_search(self, query, k=5):
         """执行相似度搜索
@@ -249,32 +290,60 @@ class VectorStoreService:
         Returns:
             最相似的文档列表
         """
+        hits = self.similarity_search_batch([query], k=k)[0]
+        return [doc for doc, _ in hits]
+        
+    def similarity_search_batch(self, queries, k=5):
+        """批量执行相似度搜索，所有查询一次性向量化并执行一次FAISS搜索
+        
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的最相似文档数量
+            
+        Returns:
+            与queries一一对应的结果列表，每个结果为(文档, L2距离)列表，按距离升序排列
+        """
+        if not queries:
+            return []
+            
         if not self.index or not self.documents:
             logger.warning("索引或文档为空，无法执行搜索")
-            return []
+            return [[] for _ in queries]
             
         try:
-            logger.info(f"开始向量化查询: '{query[:50]}...'")
+            logger.info(f"开始批量向量化 {len(queries)} 个查询")
             
-            # 向量化查询
-            query_vector = self.model.encode([query])
+            # 所有查询合并为一批向量化；查询不写入文本块向量缓存，以免挤出真正的文本块向量
+            query_vectors = self._model_encode(list(queries))
             
-            # 执行搜索
+            # 对查询矩阵执行一次搜索
             k_value = min(k, len(self.documents))
-            logger.info(f"执行FAISS搜索，k={k_value}...")
-            distances, indices = self.index.search(np.array(query_vector).astype('float32'), k=k_value)
+            rerank = self.rerank_factor > 0 and is_quantized(self.index)
+            fetch_k = min(k_value * self.rerank_factor, len(self.documents)) if rerank else k_value
+            logger.info(f"执行FAISS搜索，查询数={len(queries)}，k={fetch_k}...")
+            distances, indices = self.index.search(query_vectors, k=fetch_k)
+            
+            # 量化索引的距离是近似值，用原始向量精确重排候选结果
+            if rerank:
+                distances, indices = rerank_exact(query_vectors, indices, self._document_vectors, k_value)
             
-            # 获取相似文档
-            similar_documents = [self.documents[i] for i in indices[0] if i < len(self.documents) and i >= 0]
+            # 获取每个查询的相似文档及距离
+            results = []
+            for row_distances, row_indices in zip(distances, indices):
+                results.append([
+                    (self.documents[i], float(distance))
+                    for i, distance in zip(row_indices, row_distances)
+                    if 0 <= i < len(self.documents)
+                ])
             
-            logger.info(f"搜索完成，找到 {len(similar_documents)} 个相似文档")
+            logger.info(f"搜索完成，共找到 {sum(len(hits) for hits in results)} 个相似文档")
             
-            return similar_documents
+            return results
             
         except Exception as e:
             error_msg = f"相似度搜索失败: {str(e)}"
             logger.error(error_msg)
-            return []
+            return [[] for _ in queries]
         
     def get_relevant_context(self, query, max_tokens=4000):
         """获取与查询相关的上下文
@@ -286,25 +355,47 @@ class VectorStoreService:
         Returns:
             相关上下文文本
         """
-        similar_docs = self.similarity_search(query)
+        return self.get_relevant_contexts([query], max_tokens=max_tokens)[0]
+        
+    def get_relevant_contexts(self, queries, max_tokens=4000, k=5):
+        """批量获取与多个查询相关的上下文
+        
+        Args:
+            queries: 查询文本列表
+            max_tokens: 每个查询的最大token数量
+            k: 每个查询检索的文档数量
+            
+        Returns:
+            与queries一一对应的上下文文本列表
+        """
+        results = self.similarity_search_batch(queries, k=k)
+        return [self._build_context([doc for doc, _ in hits], max_tokens) for hits in results]
         
+    def _build_context(self, similar_docs, max_tokens):
+        """将相似文档合并为不超过token上限的上下文
+        
+        Args:
+            similar_docs: 相似文档列表
+            max_tokens: 最大token数量
+            
+        Returns:
+            上下文文本
+        """
         # 合并相似文档内容
         context = ""
         token_count = 0
         
         for doc in similar_docs:
-            # 简单估算token数量（按空格分词）
-            doc_tokens = len(doc.page_content.split())
+            doc_tokens = count_tokens(doc.page_content)
             
             if token_count + doc_tokens <= max_tokens:
                 context += doc.page_content + "\n\n"
                 token_count += doc_tokens
             else:
                 # 如果添加整个文档会超出最大token数，则尝试添加部分内容
-                words = doc.page_content.split()
                 remaining_tokens = max_tokens - token_count
                 if remaining_tokens > 0:
-                    context += " ".join(words[:remaining_tokens]) + "...\n\n"
+                    context += truncate_to_tokens(doc.page_content, remaining_tokens) + "...\n\n"
                 logger.debug(f"达到最大token限制({max_tokens})，截断上下文")
                 break
         
@@ -32,8 +32,11 @@ function initApp() {
 // 绑定全局事件
 function bindGlobalEvents() {
     // 文件上传表单提交
+    // 首页的上传表单已在index.html中绑定（带阶段进度条），这里不再重复绑定，避免重复提交生成任务
+    const currentPath = window.location.pathname;
+    const isIndexPage = currentPath === '/' || currentPath === '/index.html' || currentPath === '/static/index.html';
     const uploadForm = document.getElementById('upload-form');
-    if (uploadForm) {
+    if (uploadForm && !isIndexPage) {
         uploadForm.addEventListener('submit', function(e) {
             e.preventDefault();
             uploadDocument();
@@ -665,6 +668,110 @@ function exportBatch(batchId, status = 'all') {
     }, 1000);
 }
 
+// 轮询后台任务状态，直到任务完成或失败
+// 多进程部署时查询请求可能落到尚未读到该任务的进程，404和网络错误都会重试，连续失败maxRetries次后才放弃
+function pollJob(jobId, onProgress, interval = 2000, maxRetries = 30) {
+    return new Promise((resolve, reject) => {
+        let failures = 0;
+        
+        const retry = error => {
+            failures += 1;
+            if (failures > maxRetries) {
+                reject(error);
+            } else {
+                setTimeout(check, interval);
+            }
+        };
+        
+        const check = () => {
+            fetch(`/api/testcase/jobs/${jobId}`)
+                .then(response => response.json().then(job => ({ ok: response.ok, job })))
+                .then(({ ok, job }) => {
+                    if (!ok) {
+                        retry(new Error(job.error || '查询任务状态失败'));
+                        return;
+                    }
+                    failures = 0;
+                    
+                    if (onProgress) {
+                        onProgress(job);
+                    }
+                    
+                    if (job.status === 'succeeded') {
+                        resolve(job);
+                    } else if (job.status === 'failed') {
+                        reject(new Error(job.error || '任务执行失败'));
+                    } else {
+                        setTimeout(check, interval);
+                    }
+                })
+                .catch(retry);
+        };
+        check();
+    });
+}
+
+// 通过Server-Sent Events接收任务进度和流式生成的测试用例，浏览器不支持时退回轮询
+// onTestCase接收生成阶段的初稿测试用例，onTestCases接收入库的最终测试用例列表，用于替换初稿
+function watchJob(jobId, { onProgress, onTestCase, onTestCases } = {}) {
+    if (!window.EventSource) {
+        return pollJob(jobId, onProgress);
+    }
+    
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/api/testcase/jobs/${jobId}/events`);
+        
+        source.addEventListener('test_case', event => {
+            if (onTestCase) {
+                onTestCase(JSON.parse(event.data).test_case);
+            }
+        });
+        
+        source.addEventListener('test_cases', event => {
+            if (onTestCases) {
+                onTestCases(JSON.parse(event.data).test_cases);
+            }
+        });
+        
+        source.addEventListener('progress', event => {
+            const job = JSON.parse(event.data);
+            if (onProgress) {
+                onProgress(job);
+            }
+            
+            if (job.status === 'succeeded') {
+                source.close();
+                resolve(job);
+            } else if (job.status === 'failed') {
+                source.close();
+                reject(new Error(job.error || '任务执行失败'));
+            }
+        });
+        
+        // 连接中断或服务端到达连接时长上限时浏览器会自动重连并从断点继续；任务暂时查询不到等无法重连的情况改为轮询
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                pollJob(jobId, onProgress).then(resolve, reject);
+            }
+        };
+    });
+}
+
+// 提交测试用例生成任务，返回任务ID
+function submitGenerationJob(formData) {
+    return fetch('/api/testcase/upload', {
+        method: 'POST',
+        body: formData
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                throw new Error(data.error);
+            }
+            return data.job_id;
+        });
+}
+
 // 上传文档
 function uploadDocument() {
     const formData = new FormData(document.getElementById('upload-form'));
@@ -683,32 +790,28 @@ function uploadDocument() {
     // 显示加载动画
     UI.Loader.show(`正在上传并处理 ${fileText}，这可能需要一些时间...`);
     
-    fetch('/api/testcase/upload', {
-        method: 'POST',
-        body: formData
-    })
-        .then(response => response.json())
-        .then(data => {
-            // 隐藏加载动画
-            UI.Loader.hide();
-            
-            if (data.error) {
+    submitGenerationJob(formData)
+        .then(jobId => watchJob(jobId, {
+            onProgress: job => {
                 if (uploadStatus) {
-                    uploadStatus.textContent = `上传失败: ${data.error}`;
+                    uploadStatus.textContent = `${job.message} (${Math.round(job.progress)}%)`;
                 }
-                UI.Toast.error(`上传失败: ${data.error}`);
-                return;
             }
+        }))
+        .then(job => {
+            // 隐藏加载动画
+            UI.Loader.hide();
             
             if (uploadStatus) {
-                uploadStatus.textContent = '上传成功！正在跳转...';
+                uploadStatus.textContent = '生成成功！正在跳转...';
             }
             
             // 显示成功通知
-            UI.Toast.success('测试用例生成成功！');
+            const mergedCount = job.result.merged_count || 0;
+            UI.Toast.success(mergedCount > 0 ? `测试用例生成成功！已合并 ${mergedCount} 个相似测试用例` : '测试用例生成成功！');
             
             // 跳转到测试用例页面
-            window.location.href = `/static/testcase.html?batch_id=${data.batch_id}`;
+            window.location.href = `/static/testcase.html?batch_id=${job.result.batch_id}`;
         })
         .catch(error => {
             // 隐藏加载动画
@@ -0,0 +1,165 @@
+"""
+增量JSON数组解析
+模型以流式方式逐段返回形如 [ {...}, {...} ] 的测试用例数组，
+解析器在每个顶层对象的右花括号到达时立即解析出该对象，无需等待整个响应结束。
+完整响应也用同一个解析器容错提取：响应被截断时保留所有完整的对象，只丢弃末尾不完整的那一个。
+"""
+import re
+import json
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('json_stream')
+
+# Markdown代码块
+_FENCE_PATTERN = re.compile(r'```(?:json)?\s*\n(.*?)(?:```|$)', re.DOTALL | re.IGNORECASE)
+# 对象数组的开始位置，跳过说明文字中出现的普通方括号
+_ARRAY_START_PATTERN = re.compile(r'\[\s*[{\]]')
+# 右括号前多余的逗号
+_TRAILING_COMMA_PATTERN = re.compile(r',(\s*[}\]])')
+
+class JSONArrayStreamParser:
+    """从流式文本中逐个解析顶层JSON数组里的对象
+
+    数组之前的说明文字、Markdown代码块标记等会被忽略，只有后面（跳过空白后）紧跟'{'或']'的'['才被视为数组开始，
+    与_ARRAY_START_PATTERN规则一致，说明文字中的"[注意]"之类不会被误认为数组；
+    字符串内部的括号和转义字符不影响层级计数。
+    """
+
+    def __init__(self):
+        self.in_array = False
+        # 已读到'['但还没读到其后第一个非空白字符，可能跨越多个文本片段
+        self.pending_bracket = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        # 当前对象的字符
+        self.current = []
+        # 已解析的对象数和解析失败被丢弃的对象数
+        self.parsed = 0
+        self.dropped = 0
+
+    def feed(self, chunk):
+        """输入一段新文本
+
+        Args:
+            chunk: 模型新返回的文本片段
+
+        Returns:
+            本段文本中完成解析的对象列表
+        """
+        objects = []
+        if self.finished or not chunk:
+            return objects
+
+        for char in chunk:
+            if not self.in_array:
+                if self.pending_bracket and char.isspace():
+                    continue
+                if self.pending_bracket and char in '{]':
+                    # 确认数组开始，当前字符继续按数组内的字符处理
+                    self.in_array = True
+                else:
+                    self.pending_bracket = char == '['
+                    continue
+
+            if self.depth == 0:
+                # 数组内、对象之间：只关心对象开始和数组结束
+                if char == '{':
+                    self.depth = 1
+                    self.current = [char]
+                elif char == ']':
+                    self.finished = True
+                    break
+                continue
+
+            self.current.append(char)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    obj = self._parse(''.join(self.current))
+                    self.current = []
+                    if obj is not None:
+                        objects.append(obj)
+
+        return objects
+
+    def close(self):
+        """输入结束，统计末尾未闭合（被截断）的对象
+
+        Returns:
+            响应是否被截断（数组没有正常结束）
+        """
+        if self.depth > 0:
+            self.dropped += 1
+            self.depth = 0
+            self.current = []
+            self.in_string = False
+            self.escape = False
+        return self.in_array and not self.finished
+
+    def _parse(self, text):
+        """解析单个对象，失败时去掉多余的逗号再试一次，仍失败则计数并丢弃"""
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                obj = json.loads(_TRAILING_COMMA_PATTERN.sub(r'\1', text))
+            except json.JSONDecodeError as e:
+                self.dropped += 1
+                logger.warning(f"流式解析丢弃无法解析的对象: {str(e)}")
+                return None
+
+        if not isinstance(obj, dict):
+            self.dropped += 1
+            return None
+
+        self.parsed += 1
+        return obj
+
+
+def extract_json_array(content):
+    """从完整的模型响应中容错提取对象数组
+
+    先去掉Markdown代码块标记，再从第一个对象数组开始逐个解析，
+    修复多余的逗号，跳过无法解析的对象，响应被截断时保留已完整的对象。
+
+    Args:
+        content: 模型响应文本
+
+    Returns:
+        (对象列表, 统计信息字典)；统计信息包括found（是否找到数组）、parsed、dropped和truncated
+    """
+    content = content or ''
+    fence = _FENCE_PATTERN.search(content)
+    if fence and _ARRAY_START_PATTERN.search(fence.group(1)):
+        content = fence.group(1)
+
+    start = _ARRAY_START_PATTERN.search(content)
+    if start is None:
+        return [], {"found": False, "parsed": 0, "dropped": 0, "truncated": False}
+
+    parser = JSONArrayStreamParser()
+    objects = parser.feed(content[start.start():])
+    truncated = parser.close()
+    return objects, {
+        "found": True,
+        "parsed": parser.parsed,
+        "dropped": parser.dropped,
+        "truncated": truncated
+    }
@@ -0,0 +1,166 @@
+"""
+基于SQLite的本地键值缓存，支持容量上限、LRU淘汰和可选的过期时间
+多个进程可以共享同一个缓存文件（WAL模式）
+"""
+import os
+import time
+import sqlite3
+import threading
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('sqlite_cache')
+
+class SQLiteLRUCache:
+    """SQLite键值缓存，超过容量上限时按最近访问时间淘汰，设置过期时间时过期条目视为未命中"""
+
+    def __init__(self, path, max_entries=100000, evict_ratio=0.1, ttl_seconds=None):
+        """初始化缓存
+
+        Args:
+            path: SQLite数据库文件路径
+            max_entries: 最大缓存条目数
+            evict_ratio: 超出上限时一次性额外淘汰的比例，避免每次写入都触发淘汰
+            ttl_seconds: 条目写入后的有效期（秒），None表示永不过期
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_ratio = evict_ratio
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, "
+            "value BLOB NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "created_at REAL NOT NULL DEFAULT 0)"
+        )
+        # 兼容没有created_at列的旧缓存文件
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+        if 'created_at' not in columns:
+            self._conn.execute("ALTER TABLE cache ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+        self._conn.commit()
+
+    def _expire_before(self):
+        """早于该时间写入的条目已过期，未设置过期时间时返回None"""
+        return time.time() - self.ttl_seconds if self.ttl_seconds else None
+
+    def get_many(self, keys):
+        """批量读取缓存
+
+        Args:
+            keys: 键列表
+
+        Returns:
+            与keys一一对应的值列表，未命中的位置为None
+        """
+        if not keys:
+            return []
+
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        expire_before = self._expire_before()
+        with self._lock:
+            # SQLite单条语句的参数数量有限，分批查询
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                if expire_before is None:
+                    rows = self._conn.execute(
+                        f"SELECT key, value FROM cache WHERE key IN ({placeholders})", batch
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        f"SELECT key, value FROM cache WHERE key IN ({placeholders}) AND created_at >= ?",
+                        batch + [expire_before]
+                    ).fetchall()
+                found.update(rows)
+
+            # 更新命中条目的访问时间，用于LRU淘汰
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE cache SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            values = [found.get(key) for key in keys]
+            hit_count = sum(1 for value in values if value is not None)
+            self.hits += hit_count
+            self.misses += len(values) - hit_count
+
+        return values
+
+    def put_many(self, items):
+        """批量写入缓存
+
+        Args:
+            items: (键, 值)列表，值为bytes
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, last_access, created_at) VALUES (?, ?, ?, ?)",
+                [(key, sqlite3.Binary(value), now, now) for key, value in items]
+            )
+            self._conn.commit()
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """清理过期条目，超过容量上限时淘汰最久未访问的条目（调用方需持有锁）"""
+        expire_before = self._expire_before()
+        if expire_before is not None:
+            expired = self._conn.execute("DELETE FROM cache WHERE created_at < ?", (expire_before,)).rowcount
+            if expired:
+                self._conn.commit()
+                self.expirations += expired
+
+        count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        evict_count = count - self.max_entries + int(self.max_entries * self.evict_ratio)
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)",
+            (evict_count,)
+        )
+        self._conn.commit()
+        self.evictions += evict_count
+        logger.info(f"缓存 {os.path.basename(self.path)} 超出上限 {self.max_entries}，淘汰 {evict_count} 个条目")
+
+    def stats(self):
+        """获取缓存统计信息
+
+        Returns:
+            包含命中、未命中、淘汰及过期次数和当前条目数的字典
+        """
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
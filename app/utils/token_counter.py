@@ -0,0 +1,188 @@
+"""
+统一的token计数模块
+需求文档以中文为主，按空格分词会把整段中文计为1个token，导致提示词超出AI_MAX_TOKENS。
+这里使用本地BPE分词器（tiktoken）精确计数，并提供不调用分词器的近似模式，供文本分块等热点循环使用。
+"""
+import re
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from app.config import get_config
+from app.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger('token_counter')
+
+# 中日韩文字及全角符号，BPE分词器中通常每个字对应1~2个token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+# 非中日韩文本按字母串、数字串和单个符号切分
+_LATIN_PATTERN = re.compile(r'[A-Za-z]+|\d+|[^\sA-Za-z\d\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+# 近似模式的估算系数，取偏大的值，宁可少放内容也不要超出上下文窗口
+_CJK_TOKENS_PER_CHAR = 1.2
+_CHARS_PER_LATIN_TOKEN = 4
+_DIGITS_PER_TOKEN = 3
+
+class TokenCounter:
+    """基于tiktoken的token计数器，分词器不可用时退化为近似估算"""
+
+    def __init__(self, encoding_name='cl100k_base', cache_size=4096):
+        """初始化计数器
+
+        Args:
+            encoding_name: tiktoken编码名称
+            cache_size: 精确计数结果的缓存条数，缓存以文本摘要为键，不会长期持有文本本身
+        """
+        self.encoding_name = encoding_name
+        self.encoding = None
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding_name)
+            logger.info(f"token计数器使用tiktoken编码: {encoding_name}")
+        except Exception as e:
+            # 未安装tiktoken或离线环境无法获取编码文件
+            logger.warning(f"tiktoken不可用，token计数改用近似估算: {str(e)}")
+
+        # 同一段文本（如知识库条目、文档块）在预算计算中会被反复计数
+        # 以文本的摘要而非文本本身作为键，缓存不会让整篇文档和提示词在进程生命周期内一直驻留内存
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def exact(self):
+        """是否使用分词器精确计数"""
+        return self.encoding is not None
+
+    def _count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _count_cached(self, text):
+        key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        with self._cache_lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                return count
+
+        count = self._count(text)
+        with self._cache_lock:
+            self._cache[key] = count
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def count(self, text, approximate=False):
+        """计算文本的token数
+
+        Args:
+            text: 文本
+            approximate: 是否使用近似模式，近似模式不调用分词器，适合热点循环
+
+        Returns:
+            token数
+        """
+        if not text:
+            return 0
+        if approximate or self.encoding is None:
+            return self.estimate(text)
+        return self._count_cached(text)
+
+    @staticmethod
+    def estimate(text):
+        """不调用分词器的近似估算：中日韩文字按字计数，英文按约4个字符一个token计数
+
+        Args:
+            text: 文本
+
+        Returns:
+            估算的token数
+        """
+        if not text:
+            return 0
+        cjk_chars = len(_CJK_PATTERN.findall(text))
+        tokens = cjk_chars * _CJK_TOKENS_PER_CHAR
+        for piece in _LATIN_PATTERN.findall(text):
+            if piece[0].isalpha():
+                tokens += math.ceil(len(piece) / _CHARS_PER_LATIN_TOKEN)
+            elif piece[0].isdigit():
+                tokens += math.ceil(len(piece) / _DIGITS_PER_TOKEN)
+            else:
+                tokens += 1
+        return math.ceil(tokens)
+
+    def truncate(self, text, max_tokens, from_end=False):
+        """截取不超过max_tokens的文本
+
+        Args:
+            text: 文本
+            max_tokens: 最大token数
+            from_end: 是否保留文本结尾部分，默认保留开头部分
+
+        Returns:
+            截取后的文本
+        """
+        if not text or max_tokens <= 0:
+            return ""
+
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            kept = tokens[-max_tokens:] if from_end else tokens[:max_tokens]
+            # 截断位置可能落在多字节字符中间，解码时丢弃不完整的字节
+            return self.encoding.decode_bytes(kept).decode('utf-8', errors='ignore')
+
+        total = self.estimate(text)
+        if total <= max_tokens:
+            return text
+        # 按估算比例截取字符，再逐步收缩直到满足预算
+        length = int(len(text) * max_tokens / total)
+        while length > 0:
+            piece = text[-length:] if from_end else text[:length]
+            if self.estimate(piece) <= max_tokens:
+                return piece
+            length = int(length * 0.9)
+        return ""
+
+
+# 进程内共享的计数器实例
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+def get_token_counter():
+    """获取进程内共享的token计数器"""
+    global _token_counter
+
+    if _token_counter is None:
+        with _token_counter_lock:
+            if _token_counter is None:
+                _token_counter = TokenCounter(get_config().TOKENIZER_ENCODING)
+
+    return _token_counter
+
+def count_tokens(text, approximate=False):
+    """计算文本的token数
+
+    Args:
+        text: 文本
+        approximate: 是否使用近似模式
+
+    Returns:
+        token数
+    """
+    return get_token_counter().count(text, approximate=approximate)
+
+def truncate_to_tokens(text, max_tokens, from_end=False):
+    """截取不超过max_tokens的文本
+
+    Args:
+        text: 文本
+        max_tokens: 最大token数
+        from_end: 是否保留文本结尾部分
+
+    Returns:
+        截取后的文本
+    """
+    return get_token_counter().truncate(text, max_tokens, from_end=from_end)